@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark da camada de coleta do Facebook contra a Graph API local
+───────────────────────────────────────────────────────────────────
+Sobe ``benchmarks/graph_api_stub.py`` num processo à parte e roda os
+coletores existentes (sem upload) com configurações de grupo sintéticas:
+
+- scripts com ``process_group`` (campanhas e adsperformance): os grupos vão
+  pelo ``run_groups`` como no ``execute_notebook``
+- scripts horários: ``fetch_all_groups_async`` do próprio script
+
+Cada cenário (script × número de contas) roda num processo novo, com
+``FUNCTIONS_STATE_DIR`` temporário (sem cache de contas, tamanhos de página ou
+orçamentos da execução anterior) e ``GRAPH_API_HOST`` apontando para o stub.
+
+Resultado por cenário: makespan, requisições/s (contadas no stub), linhas/s
+(linhas devolvidas pelo coletor), erros injetados, CPU e pico de RSS
+(``utils.run_metrics.RunMeter``).
+
+Uso::
+
+    BENCH_SCRIPTS=cloud_facebook_today,cloud_facebook_hour_today BENCH_ACCOUNTS=10,100,500 \\
+        STUB_ERRORS="17:0.01,reduce:0.005" python benchmarks/bench_graph_fetch.py
+
+As variáveis ``STUB_*`` configuram o servidor; as dos scripts (``MAX_WORKERS``,
+``SLEEP_SECONDS``...) valem como numa execução normal. Com erros 17/429
+injetados, as pausas de rate limit (``GRAPH_THROTTLE_PAUSE``, esperas fixas
+dos scripts) entram no makespan como em produção.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import tempfile
+import subprocess
+import urllib.request
+import importlib.util
+from functools import partial
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Scripts de facebook_ads/ (separados por vírgula; "all" = todos os coletores)
+BENCH_SCRIPTS = os.getenv("BENCH_SCRIPTS", "cloud_facebook_today,cloud_facebook_adsperformance,cloud_facebook_hour_today")
+# Número de contas de cada cenário
+BENCH_ACCOUNTS = [int(n) for n in os.getenv("BENCH_ACCOUNTS", "10,50,100,500").split(",") if n.strip()]
+# Contas por grupo (cada grupo tem seu token)
+BENCH_ACCOUNTS_PER_GROUP = int(os.getenv("BENCH_ACCOUNTS_PER_GROUP", "25"))
+# Tokens por grupo (>1 usa a fila multi-token do adsperformance)
+BENCH_TOKENS_PER_GROUP = int(os.getenv("BENCH_TOKENS_PER_GROUP", "1"))
+# Arquivo JSONL com uma linha por cenário (vazio = só a tabela no terminal)
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "")
+# Nível de log dos coletores durante a medição
+BENCH_LOG_LEVEL = os.getenv("BENCH_LOG_LEVEL", "WARNING")
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def collector_scripts() -> list:
+    """Scripts de facebook_ads/ que têm ``process_group`` ou ``fetch_all_groups_async``."""
+    base = os.path.join(REPO_ROOT, "facebook_ads")
+    scripts = []
+    for name in sorted(os.listdir(base)):
+        path = os.path.join(base, name, "main.py")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                source = f.read()
+            if "def process_group(" in source or "def fetch_all_groups_async(" in source:
+                scripts.append(name)
+    return scripts
+
+
+def synthetic_groups(accounts: int) -> dict:
+    """``accounts`` contas em grupos de ``BENCH_ACCOUNTS_PER_GROUP``, um token (ou vários) por grupo."""
+    ids = [f"act_{900000000 + i}" for i in range(accounts)]
+    groups = {}
+    for g, start in enumerate(range(0, accounts, BENCH_ACCOUNTS_PER_GROUP)):
+        group = {"accounts": ids[start:start + BENCH_ACCOUNTS_PER_GROUP], "token": f"stub_token_{g}"}
+        if BENCH_TOKENS_PER_GROUP > 1:
+            group["tokens"] = [f"stub_token_{g}_{t}" for t in range(BENCH_TOKENS_PER_GROUP)]
+        groups[f"BENCH_{g:03d}"] = group
+    return groups
+
+
+# ------------------------------------------------------------------------------
+# CENÁRIO (processo filho)
+# ------------------------------------------------------------------------------
+def _stub_request(host: str, path: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(f"{host}{path}", method=method)
+    with urllib.request.urlopen(request, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def _load_script(script: str):
+    path = os.path.join(REPO_ROOT, "facebook_ads", script, "main.py")
+    spec = importlib.util.spec_from_file_location(f"bench_{script}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _collect(module) -> int:
+    """Roda a coleta do script (sem upload) e devolve o número de linhas."""
+    if hasattr(module, "fetch_all_groups_async"):
+        return len(asyncio.run(module.fetch_all_groups_async()))
+
+    from utils.run_scheduler import run_groups
+
+    process_group, sink = module.process_group, None
+    if hasattr(module, "ArrowTableSink"):
+        sink = module.ArrowTableSink(module.FACEBOOK_ADS_PERFORMANCE)
+        process_group = partial(module.process_group, sink=sink)
+    records = 0
+    try:
+        for group_name, future in run_groups(module.GROUPS, process_group):
+            try:
+                records += future.result().get("records", 0)
+            except Exception as e:
+                logger.error("❌ Grupo %s falhou: %s", group_name, e)
+    finally:
+        if sink is not None:
+            sink.close()
+            sink.discard()
+    return records
+
+
+def run_scenario(script: str, accounts: int) -> dict:
+    """Mede um cenário; roda no processo filho (o stub já está no ar em ``GRAPH_API_HOST``)."""
+    from utils.run_metrics import RunMeter
+
+    host = os.environ["GRAPH_API_HOST"]
+    module = _load_script(script)
+    # Alguns scripts têm os grupos no próprio código em vez de SECRET_FACEBOOK_GROUPS_CONFIG
+    module.GROUPS = synthetic_groups(accounts)
+    logging.getLogger().setLevel(BENCH_LOG_LEVEL)
+
+    _stub_request(host, "/__reset", "POST")
+    meter = RunMeter(script).start()
+    started = time.perf_counter()
+    rows = _collect(module)
+    makespan = time.perf_counter() - started
+    metrics = meter.finish()
+    stats = _stub_request(host, "/__stats")
+
+    return {
+        "script": script,
+        "accounts": accounts,
+        "groups": len(module.GROUPS),
+        "makespan_seconds": round(makespan, 3),
+        "requests": stats["requests"],
+        "requests_per_second": round(stats["requests"] / makespan, 2) if makespan else None,
+        "rows": rows,
+        "rows_per_second": round(rows / makespan, 1) if makespan else None,
+        "rows_served": stats["rows"],
+        "errors_injected": sum(stats["errors"].values()),
+        "errors_by_kind": {k: v for k, v in stats["errors"].items() if v},
+        "requests_by_endpoint": stats["by_endpoint"],
+        "cpu_seconds": metrics.get("cpu_seconds"),
+        "peak_rss_mb": metrics.get("peak_rss_mb"),
+        "backoff_sleep_seconds": metrics.get("backoff_sleep_seconds"),
+        "rate_limit_wait_seconds": metrics.get("rate_limit_wait_seconds"),
+    }
+
+
+# ------------------------------------------------------------------------------
+# MATRIZ (processo principal)
+# ------------------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub() -> tuple:
+    """Sobe o stub num processo à parte e espera ele responder; devolve (processo, URL)."""
+    port = _free_port()
+    host = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "benchmarks", "graph_api_stub.py")],
+        env={**os.environ, "STUB_PORT": str(port)},
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            _stub_request(host, "/__stats")
+            return process, host
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Servidor local da Graph API não subiu")
+
+
+def run_child(script: str, accounts: int, host: str) -> dict | None:
+    groups = json.dumps(synthetic_groups(accounts))
+    with tempfile.TemporaryDirectory(prefix="bench_state_") as state_dir:
+        env = {
+            **os.environ,
+            "GRAPH_API_HOST": host,
+            "FUNCTIONS_STATE_DIR": state_dir,
+            "SECRET_FACEBOOK_GROUPS_CONFIG": groups,
+            "SECRET_FACEBOOK_GROUPS_CONFIG_UTC": groups,
+            "TRACE_ENABLED": os.getenv("TRACE_ENABLED", "0"),
+        }
+        proc = subprocess.run([sys.executable, __file__, "run", script, str(accounts)], env=env,
+                              capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    logger.error("❌ %s com %s contas falhou (código %s):\n%s", script, accounts, proc.returncode,
+                 proc.stderr[-3000:])
+    return None
+
+
+def print_table(results: list) -> None:
+    columns = [("script", 32), ("accounts", 8), ("groups", 6), ("makespan_seconds", 10), ("requests", 8),
+               ("requests_per_second", 9), ("rows", 9), ("rows_per_second", 10), ("errors_injected", 7),
+               ("cpu_seconds", 7), ("peak_rss_mb", 8)]
+    headers = ["script", "contas", "grupos", "makespan", "req", "req/s", "linhas", "linhas/s", "erros",
+               "cpu_s", "rss_mb"]
+    print("  ".join(h.rjust(w) if i else h.ljust(w) for i, (h, (_, w)) in enumerate(zip(headers, columns))))
+    for result in results:
+        print("  ".join(str(result.get(key, "")).rjust(w) if i else str(result.get(key, "")).ljust(w)
+                        for i, (key, w) in enumerate(columns)))
+
+
+def main():
+    scripts = collector_scripts() if BENCH_SCRIPTS == "all" else [s.strip() for s in BENCH_SCRIPTS.split(",")]
+    process, host = start_stub()
+    logger.info("🧪 Graph API local em %s", host)
+    results = []
+    try:
+        for script in scripts:
+            for accounts in BENCH_ACCOUNTS:
+                logger.info("⏱️ %s com %s contas...", script, accounts)
+                result = run_child(script, accounts, host)
+                if result:
+                    results.append(result)
+                    logger.info("✅ %s/%s: %.1fs, %s req/s, %s linhas/s", script, accounts,
+                                result["makespan_seconds"], result["requests_per_second"], result["rows_per_second"])
+    finally:
+        process.terminate()
+        process.wait()
+
+    print_table(results)
+    if BENCH_OUTPUT:
+        with open(BENCH_OUTPUT, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps({**result, "timestamp": time.time()}) + "\n")
+        logger.info("💾 Resultados em %s", BENCH_OUTPUT)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+    if len(sys.argv) == 4 and sys.argv[1] == "run":
+        print(RESULT_PREFIX + json.dumps(run_scenario(sys.argv[2], int(sys.argv[3])), default=str), flush=True)
+    else:
+        main()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark das transformações (sem rede) com dados sintéticos
+─────────────────────────────────────────────────────────────
+O custo das transformações cresce com o número de contas, mas só aparecia
+misturado à coleta. Aqui cada transformação roda sozinha, com entradas
+sintéticas no formato que a API devolve, de 10 mil a 1 milhão de linhas:
+
+- ``process_all``: ``pd.DataFrame`` dos insights por hora, campanhas vistas,
+  merge dos orçamentos, expansão por hora e coerção para o schema
+  (``transform_campaigns`` do ``cloud_facebook_utc_today``)
+- ``process_hourly_data``: agregação por hora do ``cloud_facebook_hour_today``
+  (com ``actions``, como pede o ``cloud_facebook_page_per_hour``)
+- ``aggregate_kvp_data``: agregação por chave-valor do ``cloud_gam_adsperformance``
+- ``prepare_performance`` / ``prepare_rules``: conversão do ``cloud_av_adunit_hour_today``
+- ``google_ads_rows``: ``get_google_ads_data`` do ``cloud_googleads_hour`` com
+  um cliente local cujo ``search_stream`` devolve ``GoogleAdsRow`` reais em
+  lotes de 10 mil linhas (a desserialização dos lotes entra na medição, como na API)
+
+Os insights do Facebook vêm do mesmo gerador do ``graph_api_stub.py``
+(20 campanhas × 24 horas por conta).
+
+Cada cenário (transformação × linhas) roda num processo novo. A entrada é
+montada antes da medição; o tempo é o melhor de ``BENCH_REPEAT`` execuções
+e a memória é o pico do ``tracemalloc`` numa execução à parte (só o que a
+transformação alocou), além do pico de RSS do processo (entrada incluída).
+O ``tracemalloc`` não vê os buffers do Arrow (colunas de texto do pandas 3);
+para essas o RSS é a referência.
+
+Uso::
+
+    BENCH_CASES=process_all,aggregate_kvp_data BENCH_ROWS=10000,100000 python benchmarks/bench_transforms.py
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import resource
+import tracemalloc
+import subprocess
+import importlib.util
+from datetime import datetime
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Transformações medidas (separadas por vírgula; "all" = todas)
+BENCH_CASES = os.getenv("BENCH_CASES", "all")
+# Linhas de entrada de cada cenário
+BENCH_ROWS = [int(n) for n in os.getenv("BENCH_ROWS", "10000,100000,1000000").split(",") if n.strip()]
+# Execuções cronometradas por cenário (vale a mais rápida)
+BENCH_REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+# Arquivo JSONL com uma linha por cenário (vazio = só a tabela no terminal)
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "")
+# Nível de log dos scripts durante a medição
+BENCH_LOG_LEVEL = os.getenv("BENCH_LOG_LEVEL", "WARNING")
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+# Campos pedidos pelos scripts horários (cloud_facebook_page_per_hour inclui actions)
+HOURLY_FIELDS = "account_name,account_id,campaign_id,campaign_name,date_start,date_stop,impressions,spend,ctr,actions"
+# Valores distintos de utm_content por site no relatório de KVP
+KVP_VALUES_PER_SITE = 1_000
+# Linhas por lote do GoogleAdsService.search_stream
+GOOGLE_ADS_BATCH_SIZE = 10_000
+
+
+def _load_script(path: str):
+    """Carrega ``<path>/main.py`` (ex: ``gam/cloud_gam_adsperformance``) como módulo."""
+    # Os scripts do Facebook leem os grupos na importação
+    os.environ.setdefault("SECRET_FACEBOOK_GROUPS_CONFIG", "{}")
+    os.environ.setdefault("SECRET_FACEBOOK_GROUPS_CONFIG_UTC", "{}")
+    spec = importlib.util.spec_from_file_location(f"bench_{os.path.basename(path)}",
+                                                  os.path.join(REPO_ROOT, path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ------------------------------------------------------------------------------
+# ENTRADAS SINTÉTICAS
+# ------------------------------------------------------------------------------
+def insights_rows(rows: int, fields: str) -> list:
+    """``rows`` linhas de insights por campanha e hora, conta a conta (como o GET de insights devolve)."""
+    from graph_api_stub import HOURLY_BREAKDOWN, InsightsShape
+
+    params = {"fields": fields, "breakdowns": HOURLY_BREAKDOWN, "level": "campaign"}
+    data, account = [], 0
+    while len(data) < rows:
+        shape = InsightsShape(f"act_{900000000 + account}", params)
+        data.extend(shape.row(i) for i in range(min(shape.total, rows - len(data))))
+        account += 1
+    return data
+
+
+def budget_rows(insights: list) -> list:
+    """Orçamentos (``/campaigns``) das campanhas que aparecem nos insights."""
+    from graph_api_stub import STUB_CAMPAIGNS, campaign_object
+    from utils.campaign_budgets import CAMPAIGN_BUDGET_FIELDS
+
+    fields = CAMPAIGN_BUDGET_FIELDS.split(",")
+    accounts = sorted({int(row["account_id"]) for row in insights})
+    return [campaign_object(account, c, fields) for account in accounts for c in range(STUB_CAMPAIGNS)]
+
+
+def kvp_records(rows: int, sites: list) -> list:
+    """Registros do relatório de KVP (``utm_content``) já anotados com ``network_id`` e ``site``."""
+    records = []
+    for i in range(rows):
+        site = sites[i % len(sites)]
+        impressions = 50 + i % 2_000
+        records.append({
+            "key": "utm_content",
+            "value": f"criativo_{(i // len(sites)) % KVP_VALUES_PER_SITE}",
+            "ad_exchange_line_item_level_impressions": impressions,
+            "ad_exchange_line_item_level_clicks": i % 37,
+            "ad_exchange_line_item_level_revenue": impressions * (800 + i % 900),
+            "ad_exchange_line_item_level_ctr": (i % 37) / impressions,
+            "ad_exchange_active_view_viewable_impressions": impressions * 0.7,
+            "network_id": site["network_id"],
+            "site": site["site"],
+        })
+    return records
+
+
+def performance_records(rows: int) -> list:
+    """Linhas do relatório ``from-gam`` por ad unit."""
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    return [{
+        "DATE": date_str,
+        "SITE_NAME": f"site{i % 14}.com",
+        "URL_NAME": f"https://site{i % 14}.com/artigo-{i % 5_000}",
+        "AD_UNIT_NAME": f"ad_unit_{i % 40}",
+        "AD_EXCHANGE_LINE_ITEM_LEVEL_IMPRESSIONS": 100 + i % 3_000,
+        "AD_EXCHANGE_LINE_ITEM_LEVEL_CTR": (i % 50) / 1_000,
+        "AD_EXCHANGE_LINE_ITEM_LEVEL_REVENUE": 2_500_000 + i % 900_000,
+        "AD_EXCHANGE_LINE_ITEM_LEVEL_AVERAGE_ECPM": 1_200_000 + i % 500_000,
+        "PROGRAMMATIC_MATCH_RATE": (i % 100) / 100,
+        "AD_EXCHANGE_ACTIVE_VIEW_VIEWABLE_IMPRESSIONS_RATE": (i % 90) / 100,
+        "AD_EXCHANGE_TOTAL_REQUESTS": 500 + i % 10_000,
+    } for i in range(rows)]
+
+
+def rule_records(rows: int) -> list:
+    """Regras de preço (``/rules``), com números em texto, ``NaN`` e ``None`` como a API devolve."""
+    return [{
+        "ad_unit": f"ad_unit_{i % 40}",
+        "aggressiveness": str(i % 5),
+        "country": ("BR", "US", "PT", None)[i % 4],
+        "desired_match_rate": (i % 100) / 100,
+        "device": ("mobile", "desktop")[i % 2],
+        "domain": f"site{i % 14}.com",
+        "ecpm": float("nan") if i % 11 == 0 else (i % 700) / 100,
+        "impressions": i % 10_000,
+        "match_rate": None if i % 13 == 0 else (i % 100) / 100,
+        "request_uri": f"/artigo-{i % 5_000}",
+        "revenue": f"{(i % 9_000) / 100:.2f}",
+        "rule": (i % 300) / 100,
+        "state": ("AUTO", "MANUAL")[i % 2],
+        "utm_source": f"fb_{i % 20}",
+    } for i in range(rows)]
+
+
+class _GoogleAdsStream:
+    """``GoogleAdsService`` local: ``search_stream`` devolve lotes serializados, como o stream da API."""
+
+    def __init__(self, rows: int):
+        from google.ads.googleads.v25.services.types.google_ads_service import SearchGoogleAdsStreamResponse
+
+        self.response_type = SearchGoogleAdsStreamResponse
+        batch = SearchGoogleAdsStreamResponse.pb()()
+        date_str = datetime.now().strftime("%Y-%m-%d")
+        for i in range(min(rows, GOOGLE_ADS_BATCH_SIZE)):
+            row = batch.results.add()
+            row.customer.id = 9679496200
+            row.customer.descriptive_name = "Conta 001"
+            row.customer.currency_code = "BRL"
+            row.campaign.id = 20_000_000_000 + i % 500
+            row.campaign.name = f"BR_FIN_{i % 500}_campanha"
+            row.segments.date = date_str
+            row.segments.hour = i % 24
+            row.campaign_budget.amount_micros = 50_000_000 + i % 500 * 1_000_000
+            row.metrics.cost_micros = 1_000_000 + i * 7_919 % 90_000_000
+            row.metrics.clicks = i % 300
+            row.metrics.average_cpc = 350_000 + i % 200_000
+            row.metrics.impressions = 1_000 + i % 40_000
+            row.metrics.ctr = (i % 300) / 10_000
+            row.metrics.conversions = float(i % 9)
+            row.metrics.cost_per_conversion = 9_000_000 + i % 3_000_000
+        self.batch = batch.SerializeToString()
+        self.batch_rows = len(batch.results)
+        self.rows = rows
+
+    def get_service(self, name: str, **kwargs):
+        return self
+
+    def search_stream(self, customer_id: str, query: str):
+        remaining = self.rows
+        while remaining > 0:
+            batch = self.response_type.deserialize(self.batch)
+            if remaining < self.batch_rows:
+                del batch.results[remaining:]
+            yield batch
+            remaining -= self.batch_rows
+
+
+# ------------------------------------------------------------------------------
+# CENÁRIOS
+# ------------------------------------------------------------------------------
+def _case_process_all(rows: int):
+    import pandas as pd
+
+    module = _load_script("facebook_ads/cloud_facebook_utc_today")
+    raw = insights_rows(rows, module.INSIGHTS_FIELDS_FULL)
+    budgets = budget_rows(raw)
+
+    def run():
+        df_insights = pd.DataFrame(raw)
+        module.campaign_ids_by_account(df_insights)
+        return module.transform_campaigns(df_insights, pd.DataFrame(budgets))
+
+    return run
+
+
+def _case_process_hourly_data(rows: int):
+    module = _load_script("facebook_ads/cloud_facebook_hour_today")
+    raw = insights_rows(rows, HOURLY_FIELDS)
+    return lambda: module.process_hourly_data(raw)
+
+
+def _case_aggregate_kvp_data(rows: int):
+    module = _load_script("gam/cloud_gam_adsperformance")
+    records = kvp_records(rows, module.GAM_SITES)
+    return lambda: module.aggregate_kvp_data(records)
+
+
+def _case_prepare_performance(rows: int):
+    module = _load_script("gam/cloud_av_adunit_hour_today")
+    records = performance_records(rows)
+    captured_at = datetime.now(module.BRT).isoformat()
+    return lambda: module.prepare_performance(records, captured_at)
+
+
+def _case_prepare_rules(rows: int):
+    module = _load_script("gam/cloud_av_adunit_hour_today")
+    records = rule_records(rows)
+    captured_at = datetime.now(module.BRT).isoformat()
+    return lambda: module.prepare_rules(records, "23152058020", "onplif.com", captured_at)
+
+
+def _case_google_ads_rows(rows: int):
+    module = _load_script("google_ads/cloud_googleads_hour")
+    client = _GoogleAdsStream(rows)
+    return lambda: module.get_google_ads_data(client, "9679496200")
+
+
+CASES = {
+    "process_all": _case_process_all,
+    "process_hourly_data": _case_process_hourly_data,
+    "aggregate_kvp_data": _case_aggregate_kvp_data,
+    "prepare_performance": _case_prepare_performance,
+    "prepare_rules": _case_prepare_rules,
+    "google_ads_rows": _case_google_ads_rows,
+}
+
+
+def run_scenario(case: str, rows: int) -> dict:
+    """Mede um cenário; roda no processo filho."""
+    os.environ.setdefault("TRACE_ENABLED", "0")
+    started = time.perf_counter()
+    run = CASES[case](rows)
+    setup_seconds = time.perf_counter() - started
+    logging.getLogger().setLevel(BENCH_LOG_LEVEL)
+
+    timings = []
+    for _ in range(max(BENCH_REPEAT, 1)):
+        gc.collect()
+        started = time.perf_counter()
+        output = run()
+        timings.append(time.perf_counter() - started)
+        output_rows = len(output)
+        del output
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        "case": case,
+        "rows": rows,
+        "output_rows": output_rows,
+        "seconds": round(seconds, 4),
+        "seconds_all": [round(t, 4) for t in timings],
+        "rows_per_second": round(rows / seconds) if seconds else None,
+        "peak_mb": round(peak / 1e6, 1),
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "setup_seconds": round(setup_seconds, 2),
+    }
+
+
+# ------------------------------------------------------------------------------
+# MATRIZ (processo principal)
+# ------------------------------------------------------------------------------
+def run_child(case: str, rows: int) -> dict | None:
+    env = {**os.environ, "TRACE_ENABLED": os.getenv("TRACE_ENABLED", "0")}
+    proc = subprocess.run([sys.executable, __file__, "run", case, str(rows)], env=env,
+                          capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    logger.error("❌ %s com %s linhas falhou (código %s):\n%s", case, rows, proc.returncode, proc.stderr[-3000:])
+    return None
+
+
+def print_table(results: list) -> None:
+    columns = [("case", 20), ("rows", 9), ("output_rows", 9), ("seconds", 9), ("rows_per_second", 10),
+               ("peak_mb", 9), ("rss_mb", 9)]
+    headers = ["transformação", "linhas", "saída", "segundos", "linhas/s", "pico_mb", "rss_mb"]
+    print("  ".join(h.rjust(w) if i else h.ljust(w) for i, (h, (_, w)) in enumerate(zip(headers, columns))))
+    for result in results:
+        print("  ".join(str(result.get(key, "")).rjust(w) if i else str(result.get(key, "")).ljust(w)
+                        for i, (key, w) in enumerate(columns)))
+
+
+def main():
+    cases = list(CASES) if BENCH_CASES == "all" else [c.strip() for c in BENCH_CASES.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        raise ValueError(f"Transformações desconhecidas em BENCH_CASES: {unknown} (use {', '.join(CASES)})")
+
+    results = []
+    for case in cases:
+        for rows in BENCH_ROWS:
+            logger.info("⏱️ %s com %s linhas...", case, rows)
+            result = run_child(case, rows)
+            if result:
+                results.append(result)
+                logger.info("✅ %s/%s: %.3fs, %s linhas/s, pico %.1f MB", case, rows,
+                            result["seconds"], result["rows_per_second"], result["peak_mb"])
+
+    print_table(results)
+    if BENCH_OUTPUT:
+        with open(BENCH_OUTPUT, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps({**result, "timestamp": time.time()}) + "\n")
+        logger.info("💾 Resultados em %s", BENCH_OUTPUT)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+    if len(sys.argv) == 4 and sys.argv[1] == "run":
+        print(RESULT_PREFIX + json.dumps(run_scenario(sys.argv[2], int(sys.argv[3])), default=str), flush=True)
+    else:
+        main()
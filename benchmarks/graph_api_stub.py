@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor local que imita a Graph API (para benchmarks)
+───────────────────────────────────────────────────────
+Medir uma mudança em ``fb_get``, ``fetch_insights_all_accounts`` ou no
+cliente compartilhado contra a API real gasta rate limit de produção e
+depende do humor do Facebook. Este servidor aiohttp responde no mesmo
+formato os endpoints que os coletores usam:
+
+- ``GET /vXX/act_X/insights`` (``level`` campaign/ad, ``time_increment``,
+  ``time_range``, breakdown por hora) com paginação por cursor
+- ``POST /vXX/act_X/insights`` + ``GET /vXX/<report_run_id>[/insights]``
+  (relatório assíncrono de ``utils/insights_report.py``)
+- ``GET /vXX/act_X/campaigns`` (com ``filtering`` por ``id IN`` e
+  ``updated_time``), ``/adsets`` e ``/ads`` (creative expandido)
+- ``GET /vXX/?ids=act_1,act_2`` (``utils/account_access.py``), ``GET /vXX/<ad_id>``
+  e ``POST /vXX`` com ``batch``
+
+Os dados são sintéticos e determinísticos por conta. Latência e erros são
+configuráveis por variável de ambiente (``STUB_*``); os erros injetados são
+os que o cliente trata: código 17, HTTP 429, 500 "reduce the amount of
+data", 5xx transitório e 401.
+
+Uso::
+
+    STUB_PORT=8765 STUB_ERRORS="17:0.01,reduce:0.005" python benchmarks/graph_api_stub.py
+    GRAPH_API_HOST=http://127.0.0.1:8765 python facebook_ads/cloud_facebook_today/main.py
+
+``GET /__stats`` devolve os contadores (requisições, linhas, erros por tipo)
+e ``POST /__reset`` zera os contadores.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+STUB_HOST = os.getenv("STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.getenv("STUB_PORT", "8765"))
+# Latência de cada resposta: base + jitter uniforme + custo por linha devolvida (ms)
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "80"))
+STUB_JITTER_MS = float(os.getenv("STUB_JITTER_MS", "40"))
+STUB_MS_PER_ROW = float(os.getenv("STUB_MS_PER_ROW", "0.05"))
+# Tamanho sintético de cada conta
+STUB_CAMPAIGNS = int(os.getenv("STUB_CAMPAIGNS", "20"))
+STUB_ADS_PER_CAMPAIGN = int(os.getenv("STUB_ADS_PER_CAMPAIGN", "5"))
+# Erros injetados por requisição: "tipo:probabilidade,..." (tipos: 17, 429, reduce, 500, 401)
+STUB_ERRORS = os.getenv("STUB_ERRORS", "")
+# "reduce the amount of data" no GET de insights com limit acima disto (0 = desligado)
+STUB_REDUCE_ABOVE = int(os.getenv("STUB_REDUCE_ABOVE", "0"))
+# Uso informado nos headers X-App-Usage / X-Ad-Account-Usage (%)
+STUB_USAGE_PCT = float(os.getenv("STUB_USAGE_PCT", "5"))
+# Semente do sorteio de latência e erros
+STUB_SEED = int(os.getenv("STUB_SEED", "42"))
+
+ERROR_KINDS = ("17", "429", "reduce", "500", "401")
+
+# Corpo e status de cada erro injetado (mesmo formato da Graph API)
+_ERROR_RESPONSES = {
+    "17": (400, {"code": 17, "message": "(#17) User request limit reached", "type": "OAuthException"}),
+    "429": (429, {"code": 4, "message": "(#4) Application request limit reached", "type": "OAuthException"}),
+    "reduce": (500, {"code": 1, "message": "Please reduce the amount of data you're asking for, then retry "
+                                          "your request", "type": "OAuthException"}),
+    "500": (500, {"code": 2, "message": "An unexpected error has occurred. Please retry your request later.",
+                  "type": "OAuthException", "is_transient": True}),
+    "401": (401, {"code": 190, "message": "Error validating access token: Session has expired",
+                  "type": "OAuthException"}),
+}
+
+HOURLY_BREAKDOWN = "hourly_stats_aggregated_by_advertiser_time_zone"
+UPDATED_TIME = "2024-05-01T12:00:00-0300"
+
+
+def parse_error_rates(spec: str) -> dict:
+    """``"17:0.01,reduce:0.005"`` → ``{"17": 0.01, "reduce": 0.005}``."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, rate = item.partition(":")
+        if kind not in ERROR_KINDS:
+            raise ValueError(f"Tipo de erro desconhecido em STUB_ERRORS: {kind} (use {', '.join(ERROR_KINDS)})")
+        rates[kind] = float(rate or 0)
+    return rates
+
+
+def parse_fields(spec: str) -> list:
+    """Campos do parâmetro ``fields`` no nível de cima (``creative{id,name}`` fica inteiro)."""
+    fields, depth, current = [], 0, ""
+    for char in spec or "":
+        if char == "," and depth == 0:
+            fields.append(current.strip())
+            current = ""
+            continue
+        depth += (char == "{") - (char == "}")
+        current += char
+    if current.strip():
+        fields.append(current.strip())
+    return fields
+
+
+def _account_number(account_id: str) -> int:
+    digits = "".join(c for c in account_id if c.isdigit())
+    return int(digits[-9:] or 0)
+
+
+def _days(params: dict) -> list:
+    """Dias cobertos pela consulta (``time_range`` ou ``date_preset``)."""
+    today = date.today()
+    if params.get("time_range"):
+        time_range = json.loads(params["time_range"])
+        since, until = date.fromisoformat(time_range["since"]), date.fromisoformat(time_range["until"])
+        days = [since + timedelta(days=i) for i in range((until - since).days + 1)]
+        if params.get("time_increment") in (None, "all_days"):
+            return [(days[0], days[-1])]
+        return [(day, day) for day in days]
+    preset = params.get("date_preset", "today")
+    day = today - timedelta(days=1) if preset == "yesterday" else today
+    return [(day, day)]
+
+
+class InsightsShape:
+    """Quantas linhas uma consulta de insights tem e como achar a linha ``i`` sem gerar as outras."""
+
+    def __init__(self, account_id: str, params: dict):
+        self.account_id = account_id
+        self.account = _account_number(account_id)
+        self.fields = parse_fields(params.get("fields", ""))
+        self.ads = STUB_ADS_PER_CAMPAIGN if params.get("level") == "ad" else 1
+        self.hours = 24 if HOURLY_BREAKDOWN in params.get("breakdowns", "") else 1
+        self.days = _days(params)
+        self.total = len(self.days) * STUB_CAMPAIGNS * self.ads * self.hours
+
+    def row(self, index: int) -> dict:
+        index, hour = divmod(index, self.hours)
+        index, ad = divmod(index, self.ads)
+        day, campaign = divmod(index, STUB_CAMPAIGNS)
+        since, until = self.days[day]
+        seed = (self.account * 1_000_003 + index * 7_919 + ad * 31 + hour * 17) % 10_000
+        impressions = 100 + seed % 5_000
+        clicks = seed % 97
+        spend = (seed % 50_000) / 100
+        values = {
+            "account_id": self.account_id.removeprefix("act_"),
+            "account_name": f"Conta {self.account}",
+            "campaign_id": _campaign_id(self.account, campaign),
+            "campaign_name": f"Campanha {campaign}",
+            "adset_id": _campaign_id(self.account, campaign) + "1",
+            "adset_name": f"Conjunto {campaign}",
+            "ad_id": _ad_id(self.account, campaign, ad),
+            "ad_name": f"Anúncio {campaign}.{ad}",
+            "date_start": since.isoformat(),
+            "date_stop": until.isoformat(),
+            "spend": f"{spend:.2f}",
+            "impressions": str(impressions),
+            "reach": str(int(impressions * 0.8)),
+            "clicks": str(clicks),
+            "ctr": f"{clicks / impressions * 100:.6f}",
+            "cpc": f"{spend / clicks:.6f}" if clicks else "0",
+            "cpm": f"{spend / impressions * 1000:.6f}",
+            "frequency": "1.25",
+            "objective": "OUTCOME_SALES",
+            "conversions": [{"action_type": "offsite_conversion.fb_pixel_purchase", "value": str(seed % 7)}],
+            "actions": [{"action_type": "link_click", "value": str(clicks)}],
+        }
+        if self.hours > 1:
+            values[HOURLY_BREAKDOWN] = f"{hour:02d}:00:00 - {hour:02d}:59:59"
+        return {field: values.get(field, "0") for field in self.fields + ([HOURLY_BREAKDOWN] if self.hours > 1 else [])}
+
+
+def _campaign_id(account: int, campaign: int) -> str:
+    return f"23{account:09d}{campaign:04d}"
+
+
+def _ad_id(account: int, campaign: int, ad: int) -> str:
+    return f"24{account:09d}{campaign:04d}{ad:03d}"
+
+
+def _ad_object(account: int, campaign: int, ad: int, fields: list) -> dict:
+    values = {
+        "id": _ad_id(account, campaign, ad),
+        "name": f"Anúncio {campaign}.{ad}",
+        "campaign_id": _campaign_id(account, campaign),
+        "adset_id": _campaign_id(account, campaign) + "1",
+        "status": "ACTIVE",
+    }
+    result = {"id": values["id"]}
+    for field in fields:
+        name = field.split("{", 1)[0]
+        if name == "creative":
+            result["creative"] = {"id": f"25{account:09d}{campaign:04d}{ad:03d}", "name": f"Criativo {campaign}.{ad}"}
+        else:
+            result[name] = values.get(name, "0")
+    return result
+
+
+def campaign_object(account: int, campaign: int, fields: list) -> dict:
+    values = {
+        "id": _campaign_id(account, campaign),
+        "name": f"Campanha {campaign}",
+        "campaign_id": _campaign_id(account, campaign),
+        "daily_budget": str(5_000 + campaign * 100),
+        "lifetime_budget": "0",
+        "stop_time": None,
+        "status": "ACTIVE",
+        "updated_time": UPDATED_TIME,
+    }
+    return {field: values.get(field, "0") for field in fields or ["id", "name"]}
+
+
+def _matches(obj: dict, filters: list) -> bool:
+    """Filtros ``filtering`` usados pelos scripts (``IN`` e ``GREATER_THAN`` em ``updated_time``)."""
+    for f in filters:
+        if f.get("operator") == "IN" and str(obj.get(f.get("field"), obj.get("id"))) not in map(str, f["value"]):
+            return False
+        if f.get("operator") == "GREATER_THAN" and f.get("field") == "updated_time":
+            # A marca d'água vem em epoch; o stub nunca altera campanhas depois de UPDATED_TIME
+            return False
+    return True
+
+
+class GraphAPIStub:
+    """Aplicação aiohttp com contadores; ``run()`` sobe o servidor e fica no ar."""
+
+    def __init__(self, error_rates: dict | None = None, seed: int = STUB_SEED):
+        self.error_rates = parse_error_rates(STUB_ERRORS) if error_rates is None else error_rates
+        self.random = random.Random(seed)
+        self.reports = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.stats = {"requests": 0, "rows": 0, "bytes": 0, "errors": {kind: 0 for kind in ERROR_KINDS},
+                      "by_endpoint": {}}
+
+    # -- respostas -------------------------------------------------------------
+    def _headers(self, account_id: str | None) -> dict:
+        headers = {"X-App-Usage": json.dumps({"call_count": STUB_USAGE_PCT, "total_time": STUB_USAGE_PCT,
+                                              "total_cputime": STUB_USAGE_PCT})}
+        if account_id:
+            headers["X-Ad-Account-Usage"] = json.dumps({"acc_id_util_pct": STUB_USAGE_PCT, "reset_time_duration": 0})
+        return headers
+
+    def _json(self, body, account_id: str | None = None, status: int = 200, rows: int = 0) -> web.Response:
+        text = json.dumps(body, ensure_ascii=False)
+        self.stats["rows"] += rows
+        self.stats["bytes"] += len(text)
+        return web.Response(text=text, status=status, content_type="application/json",
+                            headers=self._headers(account_id))
+
+    def _error(self, kind: str, account_id: str | None) -> web.Response:
+        self.stats["errors"][kind] += 1
+        status, error = _ERROR_RESPONSES[kind]
+        return self._json({"error": {**error, "fbtrace_id": "stub"}}, account_id, status=status)
+
+    def _page(self, total: int, params: dict, make_row, account_id: str | None) -> web.Response:
+        """Página ``[after, after + limit)`` com cursores no formato da Graph API."""
+        limit = int(params.get("limit", 25))
+        start = int(params.get("after") or 0)
+        end = min(start + limit, total)
+        body = {"data": [make_row(i) for i in range(start, end)],
+                "paging": {"cursors": {"before": str(start), "after": str(end)}}}
+        if end < total:
+            body["paging"]["next"] = f"stub://next?after={end}"
+        response = self._json(body, account_id, rows=end - start)
+        response["rows"] = end - start
+        return response
+
+    # -- endpoints -------------------------------------------------------------
+    def _insights(self, account_id: str, params: dict) -> web.Response:
+        shape = InsightsShape(account_id, params)
+        return self._page(shape.total, params, shape.row, account_id)
+
+    def _edge(self, account_id: str, edge: str, params: dict) -> web.Response:
+        account = _account_number(account_id)
+        fields = parse_fields(params.get("fields", ""))
+        filters = json.loads(params.get("filtering") or "[]")
+        if edge == "ads":
+            objects = [_ad_object(account, c, a, fields)
+                       for c in range(STUB_CAMPAIGNS) for a in range(STUB_ADS_PER_CAMPAIGN)]
+        elif edge == "adsets":
+            objects = [{**campaign_object(account, c, fields), "id": _campaign_id(account, c) + "1"}
+                       for c in range(STUB_CAMPAIGNS)]
+        else:
+            objects = [campaign_object(account, c, fields) for c in range(STUB_CAMPAIGNS)]
+        objects = [obj for obj in objects if _matches(obj, filters)]
+        return self._page(len(objects), params, objects.__getitem__, account_id)
+
+    def _node(self, node_id: str, params: dict):
+        """Objeto avulso: relatório assíncrono ou anúncio (``GET /<id>`` e sub-requisições do batch)."""
+        if node_id in self.reports:
+            return {"id": node_id, "async_status": "Job Completed", "async_percent_completion": 100}
+        digits = node_id[2:]
+        if node_id.startswith("24") and len(digits) == 16:
+            return _ad_object(int(digits[:9]), int(digits[9:13]), int(digits[13:]),
+                              parse_fields(params.get("fields", "")))
+        return None
+
+    def _accounts(self, params: dict) -> web.Response:
+        fields = parse_fields(params.get("fields", "id"))
+        accounts = {}
+        for account_id in filter(None, params.get("ids", "").split(",")):
+            values = {"id": account_id, "name": f"Conta {_account_number(account_id)}", "account_status": 1,
+                      "currency": "BRL", "timezone_name": "America/Sao_Paulo"}
+            accounts[account_id] = {field: values.get(field, "0") for field in fields}
+        return self._json(accounts)
+
+    def _batch(self, data) -> web.Response:
+        responses = []
+        for sub_request in json.loads(data.get("batch", "[]")):
+            path, _, query = sub_request.get("relative_url", "").partition("?")
+            params = dict(part.partition("=")[::2] for part in query.split("&") if part)
+            body = self._node(path.strip("/"), params)
+            responses.append({"code": 200 if body else 404,
+                              "body": json.dumps(body if body else {"error": {"code": 100, "message": "not found"}})})
+        return self._json(responses)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.path == "/__stats":
+            return web.json_response({**self.stats, "elapsed_seconds": time.time() - self.started})
+        if request.path == "/__reset":
+            self.reset()
+            return web.json_response({"ok": True})
+
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        # /v24.0/act_1/insights → ["act_1", "insights"]
+        parts = [p for p in request.path.split("/") if p][1:]
+        account_id = parts[0] if parts and parts[0].startswith("act_") else None
+        endpoint = "/".join("act_X" if p.startswith("act_") else p for p in parts[:2]) or "/"
+        if parts and parts[0] in self.reports:
+            endpoint = "report" + ("/insights" if len(parts) > 1 else "")
+        self.stats["requests"] += 1
+        self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+
+        await asyncio.sleep((STUB_LATENCY_MS + self.random.random() * STUB_JITTER_MS) / 1000)
+        # "reduce the amount of data" só no GET síncrono de insights (o único com limit adaptativo)
+        sync_insights = endpoint == "act_X/insights" and request.method == "GET"
+        roll = self.random.random()
+        for kind, rate in self.error_rates.items():
+            if roll < rate:
+                if kind != "reduce" or sync_insights:
+                    return self._error(kind, account_id)
+                break
+            roll -= rate
+        if sync_insights and STUB_REDUCE_ABOVE and int(params.get("limit", 0)) > STUB_REDUCE_ABOVE:
+            return self._error("reduce", account_id)
+
+        if not parts:
+            return self._batch(params) if request.method == "POST" else self._accounts(params)
+        if account_id and len(parts) > 1 and parts[1] == "insights":
+            if request.method == "POST":
+                report_run_id = f"{len(self.reports) + 1:015d}"
+                self.reports[report_run_id] = (account_id, params)
+                return self._json({"report_run_id": report_run_id}, account_id)
+            response = self._insights(account_id, params)
+        elif account_id and len(parts) > 1:
+            response = self._edge(account_id, parts[1], params)
+        elif parts[0] in self.reports and len(parts) > 1:
+            report_account, report_params = self.reports[parts[0]]
+            response = self._insights(report_account, {**report_params, **params})
+        else:
+            body = self._node(parts[0], params)
+            response = self._json(body) if body else self._error_not_found()
+        # Custo de montar páginas grandes (o servidor real também demora mais)
+        if STUB_MS_PER_ROW and response.get("rows"):
+            await asyncio.sleep(response["rows"] * STUB_MS_PER_ROW / 1000)
+        return response
+
+    def _error_not_found(self) -> web.Response:
+        return web.json_response({"error": {"code": 803, "message": "Some of the aliases you requested do not exist"}},
+                                 status=404)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        return app
+
+    def run(self, host: str = STUB_HOST, port: int = STUB_PORT) -> None:
+        logger.info("🧪 Graph API local em http://%s:%s (latência %sms ± %sms, erros %s)",
+                    host, port, STUB_LATENCY_MS, STUB_JITTER_MS, self.error_rates or "-")
+        web.run_app(self.app(), host=host, port=port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+    GraphAPIStub().run()
@@ -12,11 +12,33 @@ SOBRESCREVE os dados no BigQuery (WRITE_TRUNCATE)
 """
 
 import os
+import sys
 import json
 import time
 import logging
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from functools import partial
+from concurrent.futures import as_completed
+
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.bq_tables import ensure_table  # noqa: E402
+from utils.profiling import profiled  # noqa: E402
+from utils.run_metrics import RunMeter, metered_run, save_run_metrics  # noqa: E402
+from utils.graph_api import ERROR_REDUCE_DATA, GraphAPIError, get_graph_client  # noqa: E402
+from utils.work_queue import HANDOFF_ERRORS, TokenWorkQueue  # noqa: E402
+from utils.run_scheduler import get_run_scheduler, run_groups  # noqa: E402
+from utils.account_access import verify_accounts  # noqa: E402
+from utils.creative_cache import (  # noqa: E402
+    CREATIVE_CACHE_BQ_WARM_START, DYNAMIC_CREATIVE_ID, get_creative_cache,
+)
+from utils.insights_report import fetch_insights_report  # noqa: E402
+from utils.schemas import FACEBOOK_ADS_PERFORMANCE  # noqa: E402
+from utils.arrow_sink import ArrowTableSink  # noqa: E402
+from utils.page_size import (  # noqa: E402
+    GRAPH_PAGE_SIZE_START, PAGE_SIZE_FAIL_FAST, AdaptivePageSize, get_page_size_memory,
+)
 
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
@@ -211,20 +233,36 @@ GROUPS = {
 # ------------------------------------------------------------------------------
 # CONFIG PARA THREADS
 # ------------------------------------------------------------------------------
-# Número máximo de workers rodando em paralelo (threads)
-MAX_WORKERS = int(os.getenv("MAX_WORKERS", "15"))  # Aumentado para 15 para velocidade 
+# Requisições simultâneas na execução inteira, somando todos os grupos
+# (agendador global em utils/run_scheduler.py)
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "15"))
 # Número máximo de tentativas de checagem do relatório no GAM
 MAX_CHECKS = int(os.getenv("MAX_CHECKS", "8"))
 # Tempo (em segundos) entre cada checagem
 SLEEP_SECONDS = int(os.getenv("SLEEP_SECONDS", "5"))
-# Delay entre requisições para evitar rate limiting (em segundos)
-REQUEST_DELAY = float(os.getenv("REQUEST_DELAY", "0.2"))  # Reduzido para 0.2s para velocidade
-# Delay entre contas para distribuir a carga (em segundos)
-ACCOUNT_DELAY = float(os.getenv("ACCOUNT_DELAY", "0.5"))  # Reduzido para 0.5s para velocidade
-# Delay extra para rate limit (em segundos)
+# Delays fixos opcionais (em segundos). O ritmo normal vem do governador de
+# rate limit (utils/rate_limit.py), que lê os headers de uso de cada resposta
+REQUEST_DELAY = float(os.getenv("REQUEST_DELAY", "0"))
+ACCOUNT_DELAY = float(os.getenv("ACCOUNT_DELAY", "0"))
+# Pausa em rate limit quando a API não informa o tempo de recuperação (em segundos)
 RATE_LIMIT_DELAY = float(os.getenv("RATE_LIMIT_DELAY", "30.0"))  # Mantido em 30s
 # Delay entre grupos para evitar application rate limit
 GROUP_DELAY = float(os.getenv("GROUP_DELAY", "3.0"))  # Reduzido para 3 segundos entre grupos
+# Contas processadas em paralelo por token nos grupos com múltiplos tokens
+TOKEN_WORKERS = int(os.getenv("TOKEN_WORKERS", "5"))
+
+# Cliente único da Graph API: todas as threads e grupos reutilizam as mesmas
+# conexões keep-alive com graph.facebook.com
+GRAPH_CLIENT = get_graph_client(
+    max_retries=MAX_CHECKS,
+    backoff_seconds=SLEEP_SECONDS,
+    rate_limit_delay=RATE_LIMIT_DELAY,
+    request_delay=REQUEST_DELAY,
+)
+# Último tamanho de página bom por conta (persistido entre execuções)
+PAGE_SIZES = get_page_size_memory(os.path.basename(os.path.dirname(os.path.abspath(__file__))))
+# Pool único da execução: limite global, faixa por token e rodízio entre grupos
+SCHEDULER = get_run_scheduler(max_concurrency=MAX_WORKERS)
 
 # ------------------------------------------------------------------------------
 # FACEBOOK API HELPERS
@@ -241,127 +279,21 @@ PROBLEMATIC_ACCOUNTS = {
     "act_1727835544421228",  # Dados excessivos - Cloud 010
 }
 
-def fb_get(url: str, params: dict, retries: int = 0):
-    """GET com back-off exponencial melhorado para rate limiting."""
-    import requests
-    
-    if retries == 0:
-        retries = MAX_CHECKS
-    
-    # Delay inicial para evitar sobrecarregar a API
-    time.sleep(REQUEST_DELAY)
-    
-    for attempt in range(retries):
-        try:
-            resp = requests.get(url, params=params, timeout=60)
-            
-            if resp.ok:
-                return resp.json()
-            
-            # Logs específicos para diferentes tipos de erro
-            if resp.status_code == 400:
-                error_data = resp.json() if resp.text else {}
-                error_code = error_data.get("error", {}).get("code")
-                
-                if error_code == 17:  # User request limit reached
-                    logger.warning("🚫 Rate limit atingido (código 17) - aguardando %s segundos...", RATE_LIMIT_DELAY)
-                    time.sleep(RATE_LIMIT_DELAY)
-                    continue
-                else:
-                    logger.error("Erro 400 - Parâmetros inválidos: %s", resp.text)
-                    
-            elif resp.status_code == 401:
-                logger.error("Erro 401 - Token inválido ou expirado: %s", resp.text)
-                return None  # Não retry para token inválido
-                
-            elif resp.status_code == 403:
-                logger.error("Erro 403 - Sem permissão para acessar esta conta: %s", resp.text)
-                return None  # Não retry para permissão negada
-                
-            elif resp.status_code == 404:
-                logger.error("Erro 404 - Recurso não encontrado: %s", resp.text)
-                return None  # Não retry para recurso não encontrado
-                
-            elif resp.status_code == 429:
-                logger.warning("Erro 429 - Rate limit atingido, aguardando...: %s", resp.text)
-                time.sleep(RATE_LIMIT_DELAY)
-                continue
-            elif resp.status_code == 403:
-                error_data = resp.json() if resp.text else {}
-                error_code = error_data.get("error", {}).get("code")
-                error_subcode = error_data.get("error", {}).get("error_subcode")
-                
-                if error_code == 4 and error_subcode == 1504022:  # Application request limit
-                    logger.warning("🚫 Application rate limit atingido (código 4, subcódigo 1504022) - aguardando %s segundos...", RATE_LIMIT_DELAY)
-                    time.sleep(RATE_LIMIT_DELAY)  # Aguardar tempo normal
-                    continue
-                else:
-                    logger.error("Erro 403 - Sem permissão para acessar esta conta: %s", resp.text)
-                    return None  # Não retry para permissão negada
-                
-            elif resp.status_code == 500:
-                error_data = resp.json() if resp.text else {}
-                error_msg = error_data.get("error", {}).get("message", "")
-                
-                if "reduce the amount of data" in error_msg.lower():
-                    # Extrair o nome do grupo da URL para identificar qual grupo está com problema
-                    group_name = "desconhecido"
-                    account_id = "desconhecido"
-                    if "/act_" in url:
-                        account_id = url.split("/act_")[1].split("/")[0] if "/act_" in url else "desconhecido"
-                        # Encontrar o grupo que contém esta conta
-                        for g_name, g_config in GROUPS.items():
-                            if account_id in g_config.get("accounts", []):
-                                group_name = g_name
-                                break
-                    
-                    # Log detalhado do erro
-                    logger.error("🚨 [GRUPO: %s] DADOS EXCESSIVOS na conta %s", group_name, account_id)
-                    logger.error("🚨 URL: %s", url)
-                    logger.error("🚨 Parâmetros: %s", params)
-                    logger.error("🚨 Tentativa: %s/%s", attempt + 1, retries)
-                    
-                    # Aguardar mais tempo para este erro específico
-                    logger.info("[GRUPO: %s] Aguardando %s segundos antes da próxima tentativa...", group_name, RATE_LIMIT_DELAY * 2)
-                    time.sleep(RATE_LIMIT_DELAY * 2)
-                    continue
-                else:
-                    # Extrair o nome do grupo da URL para identificar qual grupo está com problema
-                    group_name = "desconhecido"
-                    if "/act_" in url:
-                        account_id = url.split("/act_")[1].split("/")[0] if "/act_" in url else "desconhecido"
-                        # Encontrar o grupo que contém esta conta
-                        for g_name, g_config in GROUPS.items():
-                            if account_id in g_config.get("accounts", []):
-                                group_name = g_name
-                                break
-                    
-                    logger.warning("[GRUPO: %s] Erro 500 – tentativa %s/%s: %s",
-                                   group_name, attempt + 1, retries, resp.text)
-            else:
-                logger.warning("Erro %s – tentativa %s/%s: %s",
-                               resp.status_code, attempt + 1, retries, resp.text)
-            
-            # Back-off exponencial com delay mínimo
-            delay = max(SLEEP_SECONDS * (2 ** attempt), 5)  # Mínimo 5 segundos
-            logger.info("Aguardando %s segundos antes da próxima tentativa...", delay)
-            time.sleep(delay)
-            
-        except requests.exceptions.Timeout:
-            logger.warning("Timeout na tentativa %s/%s", attempt + 1, retries)
-            time.sleep(SLEEP_SECONDS * (2 ** attempt))
-        except requests.exceptions.RequestException as e:
-            logger.warning("Erro de conexão na tentativa %s/%s: %s", attempt + 1, retries, str(e))
-            time.sleep(SLEEP_SECONDS * (2 ** attempt))
-    
-    logger.error("❌ Todas as tentativas falharam para: %s", url)
-    return None
+# Relatórios assíncronos (POST /act_X/insights + download em bloco):
+#   auto → contas problemáticas e contas que respondem "reduce the amount of data"
+#   all  → todas as contas
+#   off  → apenas paginação síncrona
+INSIGHTS_ASYNC_MODE = os.getenv("INSIGHTS_ASYNC_MODE", "auto").lower()
+
+def fb_get(url: str, params: dict, retries: int = 0, context: str = "", fail_fast: tuple = ()):
+    """GET via cliente compartilhado da Graph API (pool keep-alive + retry classificado)."""
+    retries = retries or MAX_CHECKS
+    return GRAPH_CLIENT.get(url, params, retries=retries, context=context, max_rate_limit_retries=retries,
+                            fail_fast=fail_fast)
 
 # ---------- INSIGHTS DE ANÚNCIOS ----------------------------------------------------------
-def get_ads_insights_page(account_id: str, token: str, after: str | None = None, use_smaller_limit: bool = False):
-    import pytz
-    tz = pytz.timezone("America/Sao_Paulo")
-    now = datetime.now(tz)
+def build_ads_insights_params(account_id: str, token: str):
+    """URL e parâmetros da consulta de insights de anúncios (sem paginação)."""
     url = f"https://graph.facebook.com/v24.0/{account_id}/insights"
     
     params = {
@@ -370,354 +302,306 @@ def get_ads_insights_page(account_id: str, token: str, after: str | None = None,
         "time_increment": "1",
         "date_preset": "yesterday",  # Dados de ontem
         "level": "ad",  # Nível de anúncio
-        "limit": 25 if use_smaller_limit else 50,
     }
+    return url, params
+
+def get_ads_insights_page(account_id: str, token: str, after: str | None = None, limit: int = GRAPH_PAGE_SIZE_START,
+                          fail_fast: tuple = ()):
+    url, params = build_ads_insights_params(account_id, token)
+    params["limit"] = limit
     if after:
         params["after"] = after
-    return fb_get(url, params)
+    # "reduce the amount of data" e 5xx voltam na hora para o AdaptivePageSize reduzir o limit
+    return fb_get(url, params, context=account_id, fail_fast=PAGE_SIZE_FAIL_FAST + tuple(fail_fast))
 
-def fetch_ads_insights_all_accounts(accounts: list, token: str):
-    rows = []
+def get_ads_insights_report(account_id: str, token: str):
+    """Insights de anúncios via relatório assíncrono (poucas chamadas para contas pesadas)."""
+    url, params = build_ads_insights_params(account_id, token)
+    return fetch_insights_report(GRAPH_CLIENT, url, params, context=account_id)
 
-    def process_account(acc):
-        acc_rows = []
-        after = None
-        
-        # Delay entre contas para evitar sobrecarregar a API
+def fetch_account_ads_insights(acc: str, token: str, fail_fast: tuple = ()):
+    """Busca todos os insights de anúncios de uma conta.
+
+    Args:
+        fail_fast: Tipos de erro levantados na hora (ex: HANDOFF_ERRORS para
+            a fila multi-token repassar a conta a outro token)
+    """
+    acc_rows = []
+    
+    if ACCOUNT_DELAY:
         time.sleep(ACCOUNT_DELAY)
-        logger.info("🔄 [ADS INSIGHTS] Processando insights de anúncios da conta %s...", acc)
-        
-        # Começar com limite pequeno para evitar dados excessivos
-        use_smaller_limit = True
-        while True:
-            data = get_ads_insights_page(acc, token, after, use_smaller_limit=use_smaller_limit)
-            if not data:
-                break
+    logger.info("🔄 [ADS INSIGHTS] Processando insights de anúncios da conta %s...", acc)
+    
+    if INSIGHTS_ASYNC_MODE == "all" or (INSIGHTS_ASYNC_MODE == "auto" and acc in PROBLEMATIC_ACCOUNTS):
+        return get_ads_insights_report(acc, token)
+    
+    pager = AdaptivePageSize(acc, PAGE_SIZES, backoff_seconds=SLEEP_SECONDS)
+    try:
+        # Páginas grandes, reduzidas pela metade só quando a API pede
+        # A próxima página já é buscada enquanto a atual é processada
+        pages = GRAPH_CLIENT.paginate(
+            lambda after: pager.fetch(
+                lambda limit: get_ads_insights_page(acc, token, after, limit=limit, fail_fast=fail_fast)
+            ),
+            token=token,
+        )
+        for data in pages:
             acc_rows.extend(data.get("data", []))
-            after = data.get("paging", {}).get("cursors", {}).get("after")
-            if not after:
-                break
-            # Se a primeira página funcionou, continuar com limite pequeno para ser conservador
-            use_smaller_limit = True
-        
-        return acc_rows
-
-    # Processar contas em lotes maiores para velocidade
-    batch_size = 15  # Aumentado para 15 contas por vez para velocidade
-    for i in range(0, len(accounts), batch_size):
-        batch = accounts[i:i + batch_size]
-        logger.info("Processando lote %s/%s: %s contas", 
-                   (i // batch_size) + 1, (len(accounts) + batch_size - 1) // batch_size, len(batch))
-        
-        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batch))) as executor:
-            futures = {executor.submit(process_account, acc): acc for acc in batch}
-            for future in as_completed(futures):
-                acc = futures[future]
-                try:
-                    result = future.result()
-                    rows.extend(result)
-                    logger.info("✅ [ADS INSIGHTS] Conta %s: %s registros de anúncios processados", acc, len(result))
-                except Exception as e:
-                    logger.error("Erro na conta %s: %s", acc, str(e))
-        
-        # Delay entre lotes para distribuir carga
-        if i + batch_size < len(accounts):
-            logger.info("Aguardando %s segundos antes do próximo lote...", ACCOUNT_DELAY)
+        pager.finish()
+    except GraphAPIError as e:
+        if e.kind != ERROR_REDUCE_DATA or INSIGHTS_ASYNC_MODE == "off":
+            raise
+        logger.warning("📦 [ADS INSIGHTS] Conta %s pediu menos dados – usando relatório assíncrono", acc)
+        acc_rows = get_ads_insights_report(acc, token)
+    
+    return acc_rows
+
+def stream_account_ads_insights(acc: str, token: str, sink: ArrowTableSink, fail_fast: tuple = ()) -> int:
+    """Busca os insights da conta e grava no sink já com creative_id e os tipos da tabela.
+
+    As linhas da conta viram um RecordBatch assim que a conta termina, então a
+    memória não acumula as contas já processadas.
+
+    Returns:
+        Número de registros gravados
+    """
+    import pandas as pd
+
+    acc_rows = fetch_account_ads_insights(acc, token, fail_fast)
+    if not acc_rows:
+        return 0
+    df_account = attach_creative_ids(pd.DataFrame(acc_rows), token)
+    df_account["imported_at"] = sink.imported_at
+    return sink.write_frame(df_account)
+
+def fetch_ads_insights_all_accounts(accounts: list, token: str, sink: ArrowTableSink) -> int:
+    total = 0
+
+    def process_account(acc):
+        # Delay fixo por conta (opcional)
+        if ACCOUNT_DELAY:
             time.sleep(ACCOUNT_DELAY)
+        return stream_account_ads_insights(acc, token, sink)
+
+    # Sem lotes fixos: o agendador global limita quantas contas rodam ao mesmo tempo
+    futures = SCHEDULER.map(process_account, accounts, token=token)
+    for future in as_completed(futures):
+        acc = futures[future]
+        try:
+            count = future.result()
+            total += count
+            logger.info("✅ [ADS INSIGHTS] Conta %s: %s registros de anúncios processados", acc, count)
+        except Exception as e:
+            logger.error("Erro na conta %s: %s", acc, str(e))
 
-    return rows
+    return total
 
 # ------------------------------------------------------------------------------
 # PROCESSAMENTO COMPLETO
 # ------------------------------------------------------------------------------
-def is_dynamic_creative_campaign(campaign_id: str, token: str) -> bool:
-    """Detecta se uma campanha usa criativos dinâmicos verificando apenas o primeiro creative."""
-    try:
-        # Buscar apenas alguns anúncios da campanha para análise rápida
-        url = f"https://graph.facebook.com/v24.0/{campaign_id}/ads"
-        params = {"access_token": token, "fields": "id,name,creative", "limit": 5}  # Apenas 5 anúncios
-        
-        data = fb_get(url, params, retries=1)  # Reduzido retries
-        if data and "data" in data:
-            ads = data["data"]
-            
-            if len(ads) == 0:
-                return False
-            
-            # Verificar apenas o primeiro creative para velocidade
-            first_ad = ads[0]
-            creative = first_ad.get("creative", {})
-            creative_id = creative.get("id", "")
-            
-            if creative_id:
-                is_dynamic = check_creative_for_dynamic_features(creative_id, token)
-                if is_dynamic:
-                    logger.info(f"🎯 Campanha {campaign_id} usa criativos dinâmicos")
-                    return True
-            
-            return False
-        
-        return False
-    except Exception as e:
-        logger.warning(f"Erro ao verificar criativos dinâmicos para campanha {campaign_id}: {e}")
-        return False
+# Campos do anúncio usados para resolver o creative_id (o creative vem expandido
+# na mesma chamada, sem uma requisição extra por creative)
+AD_CREATIVE_FIELDS = "id,campaign_id,creative{id,asset_feed_spec,name}"
+# Palavras no nome do creative que indicam criativo dinâmico
+DYNAMIC_CREATIVE_KEYWORDS = ["dynamic", "dinâmico", "auto", "template"]
 
-def check_creative_for_dynamic_features(creative_id: str, token: str) -> bool:
-    """Verifica se um creative específico tem características de criativo dinâmico (versão otimizada)."""
-    try:
-        # Buscar apenas campos essenciais para velocidade
-        url = f"https://graph.facebook.com/v24.0/{creative_id}"
-        params = {"access_token": token, "fields": "asset_feed_spec,name"}  # Apenas campos essenciais
-        
-        data = fb_get(url, params, retries=1)  # Reduzido retries
-        if not data:
-            return False
-        
-        # Verificação rápida: apenas asset_feed_spec e nome
-        # 1. Verificar se tem asset_feed_spec (indicador mais confiável)
-        if "asset_feed_spec" in data and data["asset_feed_spec"]:
-            return True
-        
-        # 2. Verificar nome do creative (verificação rápida)
-        creative_name = data.get("name", "").lower()
-        if any(keyword in creative_name for keyword in ["dynamic", "dinâmico", "auto", "template"]):
-            return True
-        
-        return False
-        
-    except Exception as e:
-        logger.warning(f"Erro ao verificar creative {creative_id}: {e}")
+# Contas com pelo menos N anúncios novos são listadas em /act_X/ads; abaixo
+# disso os anúncios novos vão pela batch API
+CREATIVE_LISTING_THRESHOLD = int(os.getenv("CREATIVE_LISTING_THRESHOLD", "200"))
+
+# ad_id → creative_id e veredito de criativo dinâmico por campanha, persistidos
+# entre execuções (utils/creative_cache.py)
+CREATIVE_CACHE = get_creative_cache()
+_CREATIVE_WARM_START_LOCK = threading.Lock()
+_creative_warm_start_done = False
+
+def warm_start_creative_cache():
+    """Preenche o cache vazio a partir do BigQuery (uma vez por processo, se habilitado)."""
+    global _creative_warm_start_done
+    with _CREATIVE_WARM_START_LOCK:
+        if _creative_warm_start_done or not CREATIVE_CACHE_BQ_WARM_START:
+            return
+        _creative_warm_start_done = True
+        try:
+            CREATIVE_CACHE.warm_start_from_bigquery(get_bq_client(), TABLE_ID)
+        except Exception as e:
+            logger.warning("⚠️ Não foi possível pré-carregar o cache de creatives do BigQuery: %s", e)
+
+def has_dynamic_features(creative) -> bool:
+    """Verifica se um creative tem características de criativo dinâmico."""
+    if not isinstance(creative, dict):
         return False
+    # 1. asset_feed_spec é o indicador mais confiável
+    if creative.get("asset_feed_spec"):
+        return True
+    # 2. Nome do creative
+    creative_name = (creative.get("name") or "").lower()
+    return any(keyword in creative_name for keyword in DYNAMIC_CREATIVE_KEYWORDS)
 
-def get_creative_id_for_ad(ad_id: str, token: str, campaign_id: str = None) -> str:
-    """Busca o creative_id de um ad_id específico, considerando criativos dinâmicos."""
-    try:
-        # Se temos campaign_id, verificar se usa criativos dinâmicos primeiro
-        if campaign_id:
-            if is_dynamic_creative_campaign(campaign_id, token):
-                logger.info(f"🎯 Campanha {campaign_id} usa criativos dinâmicos - retornando dynamic_creative")
-                return "dynamic_creative"
-        
-        # Se não é dinâmico ou não temos campaign_id, buscar creative_id normal
-        url = f"https://graph.facebook.com/v24.0/{ad_id}"
-        params = {"access_token": token, "fields": "creative"}
-        
-        data = fb_get(url, params, retries=2)
-        if data and "creative" in data:
-            creative_data = data["creative"]
-            if isinstance(creative_data, dict) and "id" in creative_data:
-                return creative_data["id"]
-            elif isinstance(creative_data, str):
-                return creative_data
-        
-        return ""
-    except Exception as e:
-        logger.warning(f"Erro ao buscar creative_id para ad_id {ad_id}: {e}")
-        return ""
+def fetch_account_ads_creatives(account_id: str, token: str) -> list:
+    """Lista os anúncios da conta já com campaign_id e creative expandido."""
+    url = f"https://graph.facebook.com/v24.0/{account_id}/ads"
+    params = {"access_token": token, "fields": AD_CREATIVE_FIELDS, "limit": 500}
+    return GRAPH_CLIENT.fetch_all(url, params, context=account_id)
 
-def process_all(accounts: list, token: str):
-    import pandas as pd
-    import pytz
-    
+def fetch_ads_creatives_batch(ad_ids: list, token: str) -> list:
+    """Busca anúncios avulsos via Graph batch API (50 por requisição)."""
+    sub_requests = [
+        {"method": "GET", "relative_url": f"{ad_id}?fields={AD_CREATIVE_FIELDS}"}
+        for ad_id in ad_ids
+    ]
+    return [ad for ad in GRAPH_CLIENT.batch(sub_requests, token, context="creatives") if ad]
+
+def creative_id_of(ad: dict) -> str:
+    """creative_id de um anúncio da Graph API (creative expandido ou só o id)."""
+    creative = ad.get("creative")
+    if isinstance(creative, dict):
+        return creative.get("id", "")
+    if isinstance(creative, str):
+        return creative
+    return ""
+
+def fetch_new_ads_creatives(new_ads, token: str) -> list:
+    """Busca na API os anúncios fora do cache (``new_ads``: DataFrame ad_id/account_id).
+
+    Contas com muitos anúncios novos são listadas inteiras (todos os anúncios
+    listados entram no cache); os demais anúncios vão em batch.
+
+    Roda dentro da tarefa da conta no ``SCHEDULER``, por isso a listagem é feita
+    aqui mesmo: submeter ao agendador e esperar os futures ocuparia a faixa do
+    token com tarefas bloqueadas e travaria a execução.
+    """
+    per_account = new_ads.groupby("account_id")["ad_id"].apply(list)
+    accounts = sorted(f"act_{acc}" for acc, ids in per_account.items() if len(ids) >= CREATIVE_LISTING_THRESHOLD)
+
+    ads = []
+    for acc in accounts:
+        try:
+            ads.extend(fetch_account_ads_creatives(acc, token))
+        except Exception as e:
+            logger.warning("Erro ao listar anúncios da conta %s: %s", acc, e)
+
+    missing = sorted(set(new_ads["ad_id"]) - {str(ad.get("id")) for ad in ads})
+    if missing:
+        logger.info("🔍 %s anúncios novos – buscando em batch...", len(missing))
+        ads.extend(fetch_ads_creatives_batch(missing, token))
+    return ads
+
+def resolve_creative_ids(df_ads_insights, token: str) -> dict:
+    """Resolve o creative_id de cada ad_id dos insights.
+
+    Anúncios já vistos vêm do cache persistente; só os novos vão para a
+    Graph API. Campanhas cujo primeiro anúncio visto tem creative dinâmico
+    recebem "dynamic_creative" em todos os anúncios.
+
+    Returns:
+        dict ad_id -> creative_id (anúncios não encontrados ficam de fora)
+    """
+    warm_start_creative_cache()
+
+    pairs = df_ads_insights[["ad_id", "account_id"]].astype(str).drop_duplicates("ad_id")
+    resolved = CREATIVE_CACHE.lookup(pairs["ad_id"])
+    new_ads = pairs[~pairs["ad_id"].isin(resolved)]
+    logger.info("💾 Creatives: %s anúncios em cache, %s novos", len(resolved), len(new_ads))
+
+    ads = fetch_new_ads_creatives(new_ads, token) if not new_ads.empty else []
+    for ad in ads:
+        resolved[str(ad.get("id"))] = (creative_id_of(ad), str(ad.get("campaign_id") or ""))
+
+    # Veredito por campanha: o primeiro anúncio visto decide e fica no cache
+    verdicts = CREATIVE_CACHE.dynamic_campaigns({campaign_id for _, campaign_id in resolved.values()})
+    new_verdicts = {}
+    for ad in ads:
+        campaign_id = str(ad.get("campaign_id") or "")
+        if campaign_id and campaign_id not in verdicts and campaign_id not in new_verdicts:
+            new_verdicts[campaign_id] = has_dynamic_features(ad.get("creative"))
+            if new_verdicts[campaign_id]:
+                logger.info(f"🎯 Campanha {campaign_id} usa criativos dinâmicos")
+    if ads:
+        CREATIVE_CACHE.store(
+            [(ad.get("id"), creative_id_of(ad), ad.get("campaign_id")) for ad in ads if ad.get("id")],
+            new_verdicts,
+        )
+    verdicts.update(new_verdicts)
+
+    wanted = set(pairs["ad_id"])
+    return {
+        ad_id: DYNAMIC_CREATIVE_ID if verdicts.get(campaign_id) else creative_id
+        for ad_id, (creative_id, campaign_id) in resolved.items() if ad_id in wanted
+    }
+
+@profiled()
+def process_all(accounts: list, token: str, sink: ArrowTableSink) -> int:
+    """Grava no sink os anúncios das contas; devolve o número de registros."""
     # -- Métricas de Anúncios --------------------------------------------------------------
-    ads_insights_raw = fetch_ads_insights_all_accounts(accounts, token)
-    df_ads_insights = pd.DataFrame(ads_insights_raw)
-    
+    return fetch_ads_insights_all_accounts(accounts, token, sink)
+
+def attach_creative_ids(df_ads_insights, token: str):
+    """Adiciona a coluna creative_id (resolvida com o token que buscou os insights)."""
     # Buscar creative_id para cada ad_id
     if not df_ads_insights.empty and 'ad_id' in df_ads_insights.columns:
         logger.info("🔍 Buscando creative_id para %s anúncios...", len(df_ads_insights))
         
-        # Buscar creative_ids em paralelo para melhor performance
-        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, 8)) as executor:
-            # Criar futures para buscar creative_id de cada ad_id com campaign_id
-            future_to_ad_data = {}
-            for _, row in df_ads_insights.iterrows():
-                ad_id = row['ad_id']
-                campaign_id = row.get('campaign_id', '')
-                future = executor.submit(get_creative_id_for_ad, ad_id, token, campaign_id)
-                future_to_ad_data[future] = ad_id
-            
-            # Criar mapeamento ad_id -> creative_id
+        try:
+            ad_to_creative = resolve_creative_ids(df_ads_insights, token)
+        except Exception as e:
+            logger.warning(f"Erro ao buscar creative_ids: {e}")
             ad_to_creative = {}
-            for future in as_completed(future_to_ad_data):
-                ad_id = future_to_ad_data[future]
-                try:
-                    creative_id = future.result()
-                    ad_to_creative[ad_id] = creative_id
-                except Exception as e:
-                    logger.warning(f"Erro ao buscar creative_id para {ad_id}: {e}")
-                    ad_to_creative[ad_id] = ""
         
         # Aplicar o mapeamento ao DataFrame
-        df_ads_insights['creative_id'] = df_ads_insights['ad_id'].map(ad_to_creative).fillna("")
+        df_ads_insights['creative_id'] = df_ads_insights['ad_id'].astype(str).map(ad_to_creative).fillna("")
         
         # Contar quantos são dinâmicos
-        dynamic_count = (df_ads_insights['creative_id'] == 'dynamic_creative').sum()
+        dynamic_count = (df_ads_insights['creative_id'] == DYNAMIC_CREATIVE_ID).sum()
         logger.info("✅ Creative_ids obtidos para %s anúncios (%s dinâmicos)", len(df_ads_insights), dynamic_count)
-
-    # Se não há insights, criar um DataFrame vazio com o schema correto
-    if df_ads_insights.empty:
-        logger.warning("Nenhum dado de insights de anúncios retornado. Criando tabela vazia.")
-        df_ads_insights = pd.DataFrame({
-            "account_id": pd.Series(dtype='string'),
-            "account_name": pd.Series(dtype='string'),
-            "campaign_id": pd.Series(dtype='string'),
-            "campaign_name": pd.Series(dtype='string'),
-            "ad_id": pd.Series(dtype='string'),
-            "ad_name": pd.Series(dtype='string'),
-            "creative_id": pd.Series(dtype='string'),
-            "date_start": pd.Series(dtype='datetime64[ns]'),
-            "date_stop": pd.Series(dtype='datetime64[ns]'),
-            "spend": pd.Series(dtype='float64'),
-            "impressions": pd.Series(dtype='int64'),
-            "clicks": pd.Series(dtype='int64'),
-            "ctr": pd.Series(dtype='float64'),
-            "cpm": pd.Series(dtype='float64')
-        })
-
-    tz = pytz.timezone("America/Sao_Paulo")
-    df_ads_insights["imported_at"] = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-
-    # Garantir que todas as colunas do schema estejam presentes
-    expected_columns = [
-        "date_start", "ad_id", "campaign_id", "campaign_name", "account_id", "account_name", "creative_id",
-        "impressions", "clicks", "spend", "ctr", "cpm", "ad_name", "date_stop", "imported_at"
-    ]
-    
-    # Adicionar colunas que podem estar faltando
-    for col in expected_columns:
-        if col not in df_ads_insights.columns:
-            if col in ["spend", "ctr", "cpm"]:
-                df_ads_insights[col] = 0.0
-            elif col in ["impressions", "clicks"]:
-                df_ads_insights[col] = 0
-            elif col in ["date_start", "date_stop", "imported_at"]:
-                df_ads_insights[col] = None
-            else:
-                df_ads_insights[col] = ""
-    
-    # Reorganizar colunas na ordem correta
-    df_ads_insights = df_ads_insights[expected_columns]
-    
-    # Converter tipos de dados para corresponder ao schema
-    # STRING fields
-    string_fields = ["ad_id", "campaign_id", "campaign_name", "account_id", "account_name", "creative_id", "ad_name"]
-    for field in string_fields:
-        if field in df_ads_insights.columns:
-            df_ads_insights[field] = df_ads_insights[field].astype(str)
-    
-    # DATETIME fields
-    datetime_fields = ["date_start", "date_stop"]
-    for field in datetime_fields:
-        if field in df_ads_insights.columns:
-            df_ads_insights[field] = pd.to_datetime(df_ads_insights[field], errors='coerce')
-    
-    # TIMESTAMP field
-    if "imported_at" in df_ads_insights.columns:
-        df_ads_insights["imported_at"] = pd.to_datetime(df_ads_insights["imported_at"], errors='coerce')
-    
-    # FLOAT fields
-    float_fields = ["spend", "ctr", "cpm"]
-    for field in float_fields:
-        if field in df_ads_insights.columns:
-            df_ads_insights[field] = pd.to_numeric(df_ads_insights[field], errors='coerce').fillna(0.0)
-    
-    # INTEGER fields
-    integer_fields = ["impressions", "clicks"]
-    for field in integer_fields:
-        if field in df_ads_insights.columns:
-            df_ads_insights[field] = pd.to_numeric(df_ads_insights[field], errors='coerce').fillna(0).astype(int)
-
-    logger.info("Linhas finais: %s", len(df_ads_insights))
-    logger.info("Colunas finais: %s", list(df_ads_insights.columns))
-    
     return df_ads_insights
 
 def verify_account_access(accounts: list, token: str, group_name: str):
-    """Verifica o acesso às contas de anúncio e token."""
-    logger.info("Verificando acesso para o grupo: %s", group_name)
-    
-    # Verificar se o token é válido testando uma conta
-    if accounts:
-        test_account = accounts[0]
-        url = f"https://graph.facebook.com/v24.0/{test_account}"
-        params = {"access_token": token, "fields": "id,name"}
-        
-        # Usar fb_get para ter retry automático
-        data = fb_get(url, params, retries=3)
-        if data is None:
-            logger.error("❌ TOKEN INVÁLIDO ou SEM PERMISSÃO para o grupo %s", group_name)
-            return False
-        else:
-            logger.info("✅ Token válido para o grupo: %s", group_name)
-    
-    # Verificar acesso a cada conta (limitado a 5 para não sobrecarregar)
-    accessible_accounts = []
-    inaccessible_accounts = []
-    
-    # Verificar apenas as primeiras 5 contas para economizar API calls
-    accounts_to_check = accounts[:5]
-    
-    for account in accounts_to_check:
-        url = f"https://graph.facebook.com/v24.0/{account}"
-        params = {"access_token": token, "fields": "id,name"}
-        
-        data = fb_get(url, params, retries=2)
-        if data is not None:
-            accessible_accounts.append(account)
-        else:
-            inaccessible_accounts.append(account)
-            logger.warning("⚠️ Problema com conta %s no grupo %s", account, group_name)
-    
-    # Assumir que as outras contas são acessíveis se pelo menos uma foi verificada
-    if accessible_accounts:
-        remaining_accounts = [acc for acc in accounts if acc not in accounts_to_check]
-        accessible_accounts.extend(remaining_accounts)
-    
-    logger.info("📊 Resumo de acesso para grupo %s:", group_name)
-    logger.info("   ✅ Contas acessíveis: %s/%s", len(accessible_accounts), len(accounts))
-    logger.info("   ❌ Contas inacessíveis: %s/%s", len(inaccessible_accounts), len(accounts))
-    
-    if inaccessible_accounts:
-        logger.warning("   📋 Contas inacessíveis: %s", inaccessible_accounts)
-    
-    return len(accessible_accounts) > 0
+    """Verifica o token e as contas do grupo com uma consulta ``?ids=`` por token.
+
+    O resultado fica em cache por token (``ACCOUNT_ACCESS_TTL``), então as
+    execuções seguintes não consultam de novo as contas já verificadas.
 
-def process_group(group_name: str, group_config: dict):
-    """Processa um grupo específico de contas e retorna os dados sem fazer upload."""
+    Returns:
+        Contas acessíveis (lista vazia = grupo não pode ser processado)
+    """
+    return verify_accounts(GRAPH_CLIENT, accounts, token, group_name)
+
+@profiled()
+def process_group(group_name: str, group_config: dict, sink: ArrowTableSink):
+    """Processa um grupo específico de contas, gravando os dados no sink (sem upload)."""
     logger.info("Iniciando processamento do grupo: %s", group_name)
     start_time = time.time()
     
     # Verificar se é um grupo com múltiplos tokens
     if "tokens" in group_config:
         logger.info("🔄 Grupo %s usa múltiplos tokens - dividindo contas...", group_name)
-        return process_group_with_multiple_tokens(group_name, group_config)
+        return process_group_with_multiple_tokens(group_name, group_config, sink)
     
     # Processamento normal com um token
     token = group_config["token"]
     
-    # Verificar acesso antes de processar
-    has_access = verify_account_access(group_config["accounts"], token, group_name)
+    # Verificar acesso antes de processar (só as contas acessíveis seguem)
+    accounts = verify_account_access(group_config["accounts"], token, group_name)
     
-    if not has_access:
+    if not accounts:
         end_time = time.time()
         execution_time = end_time - start_time
         logger.error("❌ Grupo %s não pode ser processado - problemas de acesso", group_name)
-        return {"group": group_name, "records": 0, "time": execution_time, "status": "access_denied", "data": None}
+        return {"group": group_name, "records": 0, "time": execution_time, "status": "access_denied"}
     
-    df_final = process_all(group_config["accounts"], token)
+    total_records = process_all(accounts, token, sink)
     end_time = time.time()
     execution_time = end_time - start_time
     
-    if df_final is not None and not df_final.empty:
+    if total_records:
         logger.info("✅ Grupo %s processado com sucesso em %.2f segundos", group_name, execution_time)
-        logger.info("Performance: %.2f registros/segundo", len(df_final) / execution_time)
+        logger.info("Performance: %.2f registros/segundo", total_records / execution_time)
         return {
             "group": group_name, 
-            "records": len(df_final), 
+            "records": total_records, 
             "time": execution_time, 
             "status": "success",
-            "data": df_final,
             "table_id": TABLE_ID
         }
     else:
@@ -727,66 +611,45 @@ def process_group(group_name: str, group_config: dict):
             "records": 0, 
             "time": execution_time, 
             "status": "no_data",
-            "data": df_final,
             "table_id": TABLE_ID
         }
 
-def process_group_with_multiple_tokens(group_name: str, group_config: dict):
-    """Processa um grupo dividindo as contas entre múltiplos tokens."""
+def process_group_with_multiple_tokens(group_name: str, group_config: dict, sink: ArrowTableSink):
+    """Processa um grupo com múltiplos tokens a partir de uma fila única de contas.
+
+    Cada token puxa a próxima conta quando tem folga de rate limit; contas de
+    tokens bloqueados, inválidos ou sem permissão passam para os outros
+    tokens. O grupo termina no tempo do token mais rápido, não na soma.
+    """
     tokens = group_config["tokens"]
     accounts = group_config["accounts"]
+    start_time = time.time()
     
-    # Dividir contas entre tokens
-    accounts_per_token = len(accounts) // len(tokens)
-    remainder = len(accounts) % len(tokens)
+    logger.info("📊 Fila compartilhada: %s contas entre %s tokens (%s por token em paralelo)",
+                len(accounts), len(tokens), TOKEN_WORKERS)
     
-    logger.info("📊 Dividindo %s contas entre %s tokens:", len(accounts), len(tokens))
+    # A fila só decide qual token pega cada conta (nesta thread do grupo); a
+    # conta roda direto no agendador global, na faixa do token, sem threads
+    # extras por token. Creative_ids são resolvidos com o mesmo token que
+    # buscou os insights da conta, e a conta só é gravada no sink depois de
+    # buscada por inteiro (uma conta repassada a outro token não gera linhas duplicadas)
+    queue = TokenWorkQueue(accounts, tokens, workers_per_token=TOKEN_WORKERS, name=group_name,
+                           submit=partial(SCHEDULER.submit, group=group_name))
+    results, failures = queue.run(
+        lambda acc, token: stream_account_ads_insights(acc, token, sink, HANDOFF_ERRORS)
+    )
     
-    all_dataframes = []
     total_records = 0
-    total_time = 0
+    for acc, (token, count) in results.items():
+        logger.info("✅ [ADS INSIGHTS] Conta %s: %s registros de anúncios processados", acc, count)
+        total_records += count
+    total_time = time.time() - start_time
     
-    start_idx = 0
-    for i, token in enumerate(tokens):
-        # Calcular quantas contas este token vai processar
-        if i < remainder:
-            num_accounts = accounts_per_token + 1
-        else:
-            num_accounts = accounts_per_token
-        
-        end_idx = start_idx + num_accounts
-        token_accounts = accounts[start_idx:end_idx]
-        
-        logger.info("   Token %s: %s contas (%s a %s)", i + 1, len(token_accounts), start_idx + 1, end_idx)
-        
-        # Verificar acesso para este token
-        has_access = verify_account_access(token_accounts, token, f"{group_name}_token_{i+1}")
-        
-        if not has_access:
-            logger.warning("⚠️ Token %s do grupo %s não tem acesso - pulando", i + 1, group_name)
-            start_idx = end_idx
-            continue
-        
-        # Processar contas deste token
-        token_start_time = time.time()
-        df_token = process_all(token_accounts, token)
-        token_end_time = time.time()
-        token_execution_time = token_end_time - token_start_time
-        
-        if df_token is not None and not df_token.empty:
-            all_dataframes.append(df_token)
-            total_records += len(df_token)
-            logger.info("   ✅ Token %s: %s registros em %.2f segundos", i + 1, len(df_token), token_execution_time)
-        else:
-            logger.info("   ⚠️ Token %s: 0 registros em %.2f segundos", i + 1, token_execution_time)
-        
-        total_time += token_execution_time
-        start_idx = end_idx
+    if failures:
+        logger.warning("⚠️ Grupo %s: %s contas sem nenhum token disponível: %s",
+                       group_name, len(failures), sorted(failures))
     
-    # Combinar todos os DataFrames
-    if all_dataframes:
-        import pandas as pd
-        df_final = pd.concat(all_dataframes, ignore_index=True)
+    if total_records:
         logger.info("✅ Grupo %s processado com sucesso em %.2f segundos", group_name, total_time)
         logger.info("Performance: %.2f registros/segundo", total_records / total_time if total_time > 0 else 0)
         return {
@@ -794,9 +657,11 @@ def process_group_with_multiple_tokens(group_name: str, group_config: dict):
             "records": total_records, 
             "time": total_time, 
             "status": "success",
-            "data": df_final,
             "table_id": TABLE_ID
         }
+    elif not results:
+        logger.error("❌ Grupo %s não pode ser processado - nenhum token com acesso", group_name)
+        return {"group": group_name, "records": 0, "time": total_time, "status": "access_denied"}
     else:
         logger.warning("⚠️ Grupo %s processado - sem dados em %.2f segundos", group_name, total_time)
         return {
@@ -804,15 +669,13 @@ def process_group_with_multiple_tokens(group_name: str, group_config: dict):
             "records": 0, 
             "time": total_time, 
             "status": "no_data",
-            "data": pd.DataFrame(),
             "table_id": TABLE_ID
         }
 
-def consolidate_and_upload_by_table(results: list):
-    """Consolida dados de todos os grupos e faz upload para a tabela única."""
+@profiled()
+def consolidate_and_upload_by_table(results: list, sink: ArrowTableSink):
+    """Fecha o Parquet do sink (dados de todos os grupos) e faz upload para a tabela única."""
     import pandas as pd
-    from google.cloud import bigquery
-    from google.oauth2 import service_account
     
     logger.info("🔍 [DEBUG] Consolidando dados para tabela única: %s", TABLE_ID)
     logger.info(f"🔍 [DEBUG] Total de resultados: {len(results)}")
@@ -821,70 +684,38 @@ def consolidate_and_upload_by_table(results: list):
         logger.info(f"🔍 [DEBUG] Resultado {i+1}: grupo={result.get('group')}, status={result.get('status')}, records={result.get('records')}")
     
     # Filtrar apenas grupos com dados
-    groups_with_data = [r for r in results if r["status"] == "success" and r["data"] is not None and not r["data"].empty]
+    groups_with_data = [r for r in results if r["status"] == "success" and r["records"] > 0]
     
-    if groups_with_data:
-        # Concatenar todos os DataFrames
-        dfs_to_merge = [r["data"] for r in groups_with_data]
-        
-        # Garantir que todos os DataFrames tenham os mesmos tipos de dados antes da concatenação
-        for i, df in enumerate(dfs_to_merge):
-            if not df.empty:
-                # Converter tipos de dados para corresponder ao schema
-                # STRING fields
-                string_fields = ["ad_id", "campaign_id", "campaign_name", "account_id", "account_name", "creative_id", "ad_name"]
-                for field in string_fields:
-                    if field in df.columns:
-                        df[field] = df[field].astype(str)
-                
-                # DATETIME fields
-                datetime_fields = ["date_start", "date_stop"]
-                for field in datetime_fields:
-                    if field in df.columns:
-                        df[field] = pd.to_datetime(df[field], errors='coerce')
-                
-                # TIMESTAMP field
-                if "imported_at" in df.columns:
-                    df["imported_at"] = pd.to_datetime(df["imported_at"], errors='coerce')
-                
-                # FLOAT fields
-                float_fields = ["spend", "ctr", "cpm"]
-                for field in float_fields:
-                    if field in df.columns:
-                        df[field] = pd.to_numeric(df[field], errors='coerce').fillna(0.0)
-                
-                # INTEGER fields
-                integer_fields = ["impressions", "clicks"]
-                for field in integer_fields:
-                    if field in df.columns:
-                        df[field] = pd.to_numeric(df[field], errors='coerce').fillna(0).astype(int)
-        
-        consolidated_df = pd.concat(dfs_to_merge, ignore_index=True)
-        
-        logger.info("Consolidando %s grupos com %s registros totais para %s", 
-                   len(groups_with_data), len(consolidated_df), TABLE_ID)
-        
-        # Fazer upload consolidado
-        upload_to_bigquery(consolidated_df, TABLE_ID)
-        
-        return [{
-            "table_id": TABLE_ID,
-            "groups": [r["group"] for r in groups_with_data],
-            "total_records": len(consolidated_df),
-            "status": "success"
-        }]
-    else:
-        # Se nenhum grupo tem dados, criar tabela vazia
-        logger.info("Nenhum grupo com dados, criando tabela vazia: %s", TABLE_ID)
-        empty_df = pd.DataFrame()
-        upload_to_bigquery(empty_df, TABLE_ID)
-        
-        return [{
-            "table_id": TABLE_ID,
-            "groups": [r["group"] for r in results],
-            "total_records": 0,
-            "status": "table_cleared"
-        }]
+    # Os grupos já gravaram suas linhas no mesmo arquivo: não há concat em memória
+    parquet_path = sink.close()
+    try:
+        if parquet_path:
+            logger.info("Consolidando %s grupos com %s registros totais para %s", 
+                       len(groups_with_data), sink.num_rows, TABLE_ID)
+            
+            # Fazer upload consolidado direto do Parquet
+            upload_parquet_to_bigquery(parquet_path, TABLE_ID)
+            
+            return [{
+                "table_id": TABLE_ID,
+                "groups": [r["group"] for r in groups_with_data],
+                "total_records": sink.num_rows,
+                "status": "success"
+            }]
+    finally:
+        sink.discard()
+
+    # Se nenhum grupo tem dados, criar tabela vazia
+    logger.info("Nenhum grupo com dados, criando tabela vazia: %s", TABLE_ID)
+    empty_df = pd.DataFrame()
+    upload_to_bigquery(empty_df, TABLE_ID)
+    
+    return [{
+        "table_id": TABLE_ID,
+        "groups": [r["group"] for r in results],
+        "total_records": 0,
+        "status": "table_cleared"
+    }]
 
 # ------------------------------------------------------------------------------
 # BIGQUERY
@@ -930,49 +761,13 @@ def upload_to_bigquery(df, table_id: str):
         logger.error(f"❌ bq_client is None: {bq_client is None}")
         return
     
-    # Definir schema explícito para garantir tipos corretos sempre
-    schema = [
-        bigquery.SchemaField("date_start", "DATETIME"),
-        bigquery.SchemaField("ad_id", "STRING"),
-        bigquery.SchemaField("campaign_id", "STRING"),
-        bigquery.SchemaField("campaign_name", "STRING"),
-        bigquery.SchemaField("account_id", "STRING"),
-        bigquery.SchemaField("account_name", "STRING"),
-        bigquery.SchemaField("creative_id", "STRING"),
-        bigquery.SchemaField("impressions", "INTEGER"),
-        bigquery.SchemaField("clicks", "INTEGER"),
-        bigquery.SchemaField("spend", "FLOAT"),
-        bigquery.SchemaField("ctr", "FLOAT"),
-        bigquery.SchemaField("cpm", "FLOAT"),
-        bigquery.SchemaField("ad_name", "STRING"),
-        bigquery.SchemaField("date_stop", "DATETIME"),
-        bigquery.SchemaField("imported_at", "DATETIME")
-    ]
+    # Schema explícito, gerado do mesmo registro usado na conversão de tipos
+    schema = FACEBOOK_ADS_PERFORMANCE.bigquery_schema()
     
     # Aceitar DataFrames vazios para zerar a tabela
     if df.empty:
         logger.info("DataFrame vazio - zerando tabela %s", table_id)
-        # Criar um DataFrame com schema explícito para garantir tipos corretos
-        import pandas as pd
-        schema_df = pd.DataFrame({
-            "date_start": [pd.Timestamp.now()],
-            "ad_id": [""],
-            "campaign_id": [""],
-            "campaign_name": [""],
-            "account_id": [""],
-            "account_name": [""],
-            "creative_id": [""],
-            "impressions": [0],
-            "clicks": [0],
-            "spend": [0.0],
-            "ctr": [0.0],
-            "cpm": [0.0],
-            "ad_name": [""],
-            "date_stop": [pd.Timestamp.now()],
-            "imported_at": [pd.Timestamp.now()]
-        })
-        # Remover a linha de dados, mantendo apenas o schema
-        df = schema_df.iloc[0:0]
+        df = FACEBOOK_ADS_PERFORMANCE.empty_frame()
     
     # Sempre usar schema explícito para garantir tipos corretos
     job_cfg = bigquery.LoadJobConfig(
@@ -982,8 +777,25 @@ def upload_to_bigquery(df, table_id: str):
     
     try:
         logger.info("Enviando %s registros para %s...", len(df), table_id)
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_cfg)
-        job.result()
+        job = load_to_bigquery(df, table_id, client=bq_client, job_config=job_cfg)
+        logger.info("Adicionados %s registros para %s", job.output_rows, table_id)
+    except Exception as e:
+        logger.error("Erro ao adicionar dados ao BigQuery: %s", str(e))
+        raise
+
+def upload_parquet_to_bigquery(path: str, table_id: str):
+    """Carrega no BigQuery o Parquet gravado pelo ArrowTableSink (sem passar por DataFrame)."""
+    bq_client = get_bq_client()
+    if bq_client is None:
+        logger.error("❌ BigQuery não configurado.")
+        return
+    
+    schema = FACEBOOK_ADS_PERFORMANCE.bigquery_schema()
+    try:
+        # Na primeira carga a tabela já nasce particionada por dia e clusterizada
+        ensure_table(table_id, schema, FACEBOOK_ADS_PERFORMANCE.partition_field,
+                     FACEBOOK_ADS_PERFORMANCE.clustering_fields, client=bq_client)
+        job = load_to_bigquery(path, table_id, schema=schema, write_disposition="WRITE_APPEND", client=bq_client)
         logger.info("Adicionados %s registros para %s", job.output_rows, table_id)
     except Exception as e:
         logger.error("Erro ao adicionar dados ao BigQuery: %s", str(e))
@@ -996,6 +808,7 @@ import functions_framework
 from flask import Request
 
 @functions_framework.http
+@metered_run("cloud_facebook_adsperformance")
 def facebook_ads_today(request: Request):
     """
     Cloud Function HTTP entrypoint para processar dados de anúncios do Facebook de ontem.
@@ -1034,25 +847,22 @@ def facebook_ads_today(request: Request):
         logger.info("📊 Grupos: %s", ", ".join([name for name, _ in all_groups]))
         
         # Processar todos os grupos em paralelo
-        with ThreadPoolExecutor(max_workers=len(all_groups)) as executor:
-            futures = {executor.submit(process_group, group_name, group_config): group_name 
-                      for group_name, group_config in all_groups}
-            
-            for future in as_completed(futures):
-                group_name = futures[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
-                    logger.info("%s Grupo %s processado: %s registros em %.2f segundos", 
-                               status_emoji, result["group"], result["records"], result["time"])
-                except Exception as e:
-                    logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
-                    results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
+        # Todas as contas gravam no mesmo Parquet; o upload lê direto dele
+        sink = ArrowTableSink(FACEBOOK_ADS_PERFORMANCE)
+        for group_name, future in run_groups(GROUPS, partial(process_group, sink=sink)):
+            try:
+                result = future.result()
+                results.append(result)
+                status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
+                logger.info("%s Grupo %s processado: %s registros em %.2f segundos", 
+                           status_emoji, result["group"], result["records"], result["time"])
+            except Exception as e:
+                logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
+                results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
 
         # Consolidar e fazer upload por tabela
         logger.info("Iniciando consolidação e upload por tabela...")
-        upload_results = consolidate_and_upload_by_table(results)
+        upload_results = consolidate_and_upload_by_table(results, sink)
         
         # Calcular estatísticas finais
         total_records = sum(r["records"] for r in results)
@@ -1088,6 +898,7 @@ def facebook_ads_today(request: Request):
         }, 500
 
 # Mantendo compatibilidade com Cloud Functions 1st generation (se necessário)
+@metered_run("cloud_facebook_adsperformance")
 def execute_notebook(event, context):
     """Entrypoint para Cloud Functions 1st generation (mantido para compatibilidade)"""
     import base64
@@ -1102,25 +913,22 @@ def execute_notebook(event, context):
     logger.info("📊 Grupos: %s", ", ".join([name for name, _ in all_groups]))
     
     # Processar todos os grupos em paralelo
-    with ThreadPoolExecutor(max_workers=len(all_groups)) as executor:
-        futures = {executor.submit(process_group, group_name, group_config): group_name 
-                  for group_name, group_config in all_groups}
-        
-        for future in as_completed(futures):
-            group_name = futures[future]
-            try:
-                result = future.result()
-                results.append(result)
-                status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
-                logger.info("%s Grupo %s processado: %s registros em %.2f segundos", 
-                           status_emoji, result["group"], result["records"], result["time"])
-            except Exception as e:
-                logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
-                results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
+    # Todas as contas gravam no mesmo Parquet; o upload lê direto dele
+    sink = ArrowTableSink(FACEBOOK_ADS_PERFORMANCE)
+    for group_name, future in run_groups(GROUPS, partial(process_group, sink=sink)):
+        try:
+            result = future.result()
+            results.append(result)
+            status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
+            logger.info("%s Grupo %s processado: %s registros em %.2f segundos", 
+                       status_emoji, result["group"], result["records"], result["time"])
+        except Exception as e:
+            logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
+            results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
 
     # Consolidar e fazer upload por tabela
     logger.info("Iniciando consolidação e upload por tabela...")
-    upload_results = consolidate_and_upload_by_table(results)
+    upload_results = consolidate_and_upload_by_table(results, sink)
     
     logger.info("Todos os grupos processados e consolidados por tabela.")
     return "Execução concluída."
@@ -1130,6 +938,7 @@ def execute_notebook(event, context):
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
     start_time = time.time()
+    meter = RunMeter("cloud_facebook_adsperformance").start()
     logger.info("Iniciando execução local do script (DADOS DE ANÚNCIOS DE ONTEM)...")
     logger.info("Configuração: MAX_WORKERS=%s, REQUEST_DELAY=%s, ACCOUNT_DELAY=%s", 
                 MAX_WORKERS, REQUEST_DELAY, ACCOUNT_DELAY)
@@ -1142,25 +951,22 @@ if __name__ == "__main__":
     logger.info("📊 Grupos: %s", ", ".join([name for name, _ in all_groups]))
     
     # Processar todos os grupos em paralelo
-    with ThreadPoolExecutor(max_workers=len(all_groups)) as executor:
-        futures = {executor.submit(process_group, group_name, group_config): group_name 
-                  for group_name, group_config in all_groups}
-        
-        for future in as_completed(futures):
-            group_name = futures[future]
-            try:
-                result = future.result()
-                results.append(result)
-                status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
-                logger.info("%s Grupo %s processado: %s registros em %.2f segundos (Status: %s)", 
-                           status_emoji, result["group"], result["records"], result["time"], result["status"])
-            except Exception as e:
-                logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
-                results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
+    # Todas as contas gravam no mesmo Parquet; o upload lê direto dele
+    sink = ArrowTableSink(FACEBOOK_ADS_PERFORMANCE)
+    for group_name, future in run_groups(GROUPS, partial(process_group, sink=sink)):
+        try:
+            result = future.result()
+            results.append(result)
+            status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
+            logger.info("%s Grupo %s processado: %s registros em %.2f segundos (Status: %s)", 
+                       status_emoji, result["group"], result["records"], result["time"], result["status"])
+        except Exception as e:
+            logger.error("❌ Erro no grupo %s: %s", group_name, str(e))
+            results.append({"group": group_name, "records": 0, "time": 0, "status": "error"})
 
     # Consolidar e fazer upload por tabela
     logger.info("Iniciando consolidação e upload por tabela...")
-    upload_results = consolidate_and_upload_by_table(results)
+    upload_results = consolidate_and_upload_by_table(results, sink)
     
     end_time = time.time()
     execution_time = end_time - start_time
@@ -1222,4 +1028,6 @@ if __name__ == "__main__":
             logger.info("   🗑️ %s: tabela zerada (%s grupos)", 
                        upload_result["table_id"], len(upload_result["groups"]))
     
-    logger.info("=" * 80)
\ No newline at end of file
+    save_run_metrics("cloud_facebook_adsperformance", meter.started_at, meter.finish(),
+                     "error" if error_groups or access_denied_groups else "success")
+    logger.info("=" * 80)
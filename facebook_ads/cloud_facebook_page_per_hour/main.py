@@ -1,7 +1,7 @@
 import functions_framework
 import os
+import sys
 import asyncio
-import aiohttp
 import pandas as pd
 from datetime import datetime
 import logging
@@ -13,6 +13,15 @@ import json
 import base64
 from concurrent.futures import ThreadPoolExecutor
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_write_stream import write_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run  # noqa: E402
+from utils.graph_api import AsyncGraphAPIClient  # noqa: E402
+from utils.hourly import (  # noqa: E402
+    HOURLY_BREAKDOWN, campaign_category, first_action_value, hour_from_interval,
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -61,9 +70,10 @@ GROUPS = load_groups_config()
 
 # Configurações de paralelismo
 MAX_WORKERS = 15
-REQUEST_DELAY = 0.35
-ACCOUNT_DELAY = 0.7
-RATE_LIMIT_DELAY = 30.0
+# Delays fixos desligados: o ritmo vem do governador de rate limit
+# (utils/rate_limit.py), que lê os headers de uso de cada resposta
+REQUEST_DELAY = 0.0
+ACCOUNT_DELAY = 0.0
 
 # Configurar credenciais do BigQuery
 # As credenciais são carregadas de variável de ambiente ou secret do GitHub
@@ -110,45 +120,18 @@ async def get_insights_async(session, account_id, access_token, after_cursor=Non
     if after_cursor:
         params["after"] = after_cursor
 
-    try:
-        async with session.get(base_url, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data
-            else:
-                logger.error(f"Error fetching insights for account {account_id}: HTTP {response.status}")
-                return None
-    except Exception as e:
-        logger.error(f"Error fetching insights for account {account_id}: {e}")
-        return None
+    # Retry classificado (rate limit, 5xx, timeout) fica a cargo do cliente compartilhado
+    return await session.get(base_url, params=params, context=account_id)
 
 async def fetch_all_pages_async(session, account_id, access_token):
     """Função async para buscar todas as páginas de insights"""
     all_data = []
-    after_cursor = None
-    retries = 3
-
-    while True:
-        response_data = None
-        for attempt in range(retries):
-            response_data = await get_insights_async(session, account_id, access_token, after_cursor)
-            if response_data is not None:
-                break
-            logger.info(f"Retrying... ({attempt + 1}/{retries})")
-            await asyncio.sleep(2 ** attempt)  # Exponential backoff
-
-        if response_data is None:
-            logger.error(f"Failed to fetch data for account {account_id} after {retries} retries.")
-            break
 
+    # A próxima página já é buscada enquanto a atual é processada
+    pages = session.paginate(lambda after: get_insights_async(session, account_id, access_token, after))
+    async for response_data in pages:
         all_data.extend(response_data.get('data', []))
 
-        paging_info = response_data.get('paging', {})
-        after_cursor = paging_info.get('cursors', {}).get('after')
-
-        if not after_cursor:
-            break
-
     return all_data
 
 async def fetch_all_groups_async():
@@ -157,11 +140,8 @@ async def fetch_all_groups_async():
     
     all_data = []
     
-    # Criar sessão aiohttp com configurações otimizadas
-    connector = aiohttp.TCPConnector(limit=100, limit_per_host=30)
-    timeout = aiohttp.ClientTimeout(total=60)
-    
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+    # Cliente compartilhado da Graph API (aiohttp com conexões keep-alive)
+    async with AsyncGraphAPIClient(limit=100, limit_per_host=30, timeout=60) as session:
         # Processar cada grupo em paralelo
         tasks = []
         
@@ -212,8 +192,8 @@ async def process_group_async(session, group_name, group_config):
             else:
                 all_data.extend(result)
         
-        # Delay entre lotes para evitar rate limiting
-        if i + batch_size < len(accounts):
+        # Delay fixo entre lotes (opcional)
+        if ACCOUNT_DELAY and i + batch_size < len(accounts):
             await asyncio.sleep(ACCOUNT_DELAY)
     
     logger.info(f"✅ [{group_name}] Processamento concluído: {len(all_data)} registros")
@@ -226,71 +206,38 @@ def process_hourly_data(all_data):
             return pd.DataFrame()
 
         # Cria o DataFrame inicial
-        df = pd.DataFrame(all_data)
+        df = pd.DataFrame(all_data).reset_index(drop=True)
         logger.info(f"Initial data contains {df.shape[0]} rows.")
 
-        processed_data = []
-
-        for _, row in df.iterrows():
-            hourly_stats = row.get('hourly_stats_aggregated_by_advertiser_time_zone', None)
-            campaign_name = row.get('campaign_name', '')
-
-            # Processa category (tudo antes do terceiro "_")
-            parts = campaign_name.split('_')
-            category = '_'.join(parts[:3]) if len(parts) >= 3 else campaign_name
-
-            # Extrai account_name e account_id
-            account_name = row.get('account_name', 'N/A')
-            account_id = row.get('account_id', 'N/A')
-
-            # Processa country (entre o primeiro "_" e o segundo "_")
-           # try:
-           #     country_segment = campaign_name.split("_")[1]
-           #     country = country_segment.lower() if len(country_segment) == 2 and country_segment.isalpha() else "br"
-           # except IndexError:
-           #     country = "br"
-
-            # Extrai cliques no link do campo `actions`
-            actions = row.get('actions', [])
-            if actions and isinstance(actions, list):
-                link_clicks = next((int(action['value']) for action in actions if action.get('action_type') == 'link_click'), 0)
-            else:
-                link_clicks = 0
-
-            # Extrai data do campo `date_start`
-            date = row.get('date_start', 'N/A')
-
-            # Processa intervalos horários
-            if isinstance(hourly_stats, str):
-                processed_row = {
-                    "category": category,
-                    "account_name": account_name,
-                    "account_id": account_id,
-                    #"country": country,
-                    "date": date,
-                    "time_interval": hourly_stats,
-                    "impressions": int(row.get('impressions', 0)),  # Força conversão para int
-                    "spend": float(row.get('spend', 0.0)),          # Força conversão para float
-                    "link_clicks": int(link_clicks),               # Garante que link_clicks é int
-                }
-                processed_data.append(processed_row)
-            else:
-                logger.warning(f"Unexpected format for 'hourly_stats_aggregated_by_advertiser_time_zone': {hourly_stats}")
-                continue
-
-        # Cria um DataFrame com os dados processados
-        processed_df = pd.DataFrame(processed_data)
+        # Só linhas com o intervalo horário em texto (ex: "13:00:00 - 13:59:59")
+        intervals = df[HOURLY_BREAKDOWN] if HOURLY_BREAKDOWN in df.columns else pd.Series(None, index=df.index)
+        valid = intervals.map(lambda value: isinstance(value, str))
+        if (~valid).any():
+            logger.warning(f"Unexpected format for '{HOURLY_BREAKDOWN}' in {int((~valid).sum())} rows - skipped")
+        df = df[valid]
+
+        def column(name, default):
+            return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+        # Transformação por coluna (sem iterrows)
+        processed_df = pd.DataFrame({
+            # category: tudo antes do terceiro "_" do campaign_name
+            "category": campaign_category(column("campaign_name", "")),
+            "account_name": column("account_name", "N/A").fillna("N/A"),
+            "account_id": column("account_id", "N/A").fillna("N/A"),
+            "date": column("date_start", "N/A").fillna("N/A"),
+            "time_interval": intervals[valid],
+            "impressions": pd.to_numeric(column("impressions", 0), errors="coerce").fillna(0).astype(int),
+            "spend": pd.to_numeric(column("spend", 0.0), errors="coerce").fillna(0.0).astype(float),
+            # Cliques no link: primeira ação link_click de `actions`
+            "link_clicks": first_action_value(column("actions", None), "link_click").astype(int),
+        })
         logger.info(f"Processed data contains {processed_df.shape[0]} rows.")
 
         # Remove duplicatas antes da agregação
         processed_df.drop_duplicates(inplace=True)
         logger.info(f"Data after removing duplicates contains {processed_df.shape[0]} rows.")
 
-        # Garante que os formatos estão corretos
-        processed_df['impressions'] = processed_df['impressions'].astype(int)
-        processed_df['spend'] = processed_df['spend'].astype(float)
-        processed_df['link_clicks'] = processed_df['link_clicks'].astype(int)
-
         # Realiza a agregação
         aggregated_df = processed_df.groupby(
             ["category", "account_name", "account_id", "date", "time_interval"], as_index=False
@@ -300,6 +247,9 @@ def process_hourly_data(all_data):
             "link_clicks": "sum",
         })
 
+        # Hora do dia como inteiro (0-23), além do intervalo em texto
+        aggregated_df["hour"] = hour_from_interval(aggregated_df["time_interval"])
+
         logger.info(f"Aggregated data contains {aggregated_df.shape[0]} rows.")
         logger.info(f"Aggregated DataFrame sample:\n{aggregated_df.head()}")
 
@@ -318,25 +268,16 @@ def process_hourly_data(all_data):
         return pd.DataFrame()
 
 
-
-
-
-def split_dataframe(df, chunk_size):
-    for start in range(0, len(df), chunk_size):
-        yield df.iloc[start:start + chunk_size]
-
-def upload_to_bigquery(df, table_id, chunk_size=5000):
+def upload_to_bigquery(df, table_id):
     if df is None or df.empty:
         logger.error("Dataframe is empty or None, skipping upload.")
         return
 
     try:
-        for i, chunk in enumerate(split_dataframe(df, chunk_size)):
-            logger.info(f"Uploading chunk {i + 1} to BigQuery...")
-            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
-            job = client.load_table_from_dataframe(chunk, table_id, job_config=job_config)
-            job.result()  # Wait for the job to complete
-            logger.info(f"Chunk {i + 1} uploaded successfully.")
+        # Uma única sessão da Storage Write API (colunas novas, ex: hour, são
+        # acrescentadas à tabela antes da gravação)
+        rows = write_to_bigquery(df, table_id, client=client, truncate=False)
+        logger.info(f"{rows} rows uploaded to {table_id}.")
     except Exception as e:
         logger.error(f"Error uploading to BigQuery: {e}")
 
@@ -350,6 +291,7 @@ def execute_notebook(event):
 
     return 'Execution completed.'
 
+@metered_run("cloud_facebook_page_per_hour")
 async def main():
     """Função principal async para execução local"""
     logger.info("BigQuery client configurado com credenciais padrão!")
@@ -4,11 +4,10 @@ Facebook → BigQuery (Cloud Function) - DADOS DE ANTEONTEM (HISTÓRICO)
 ─────────────────────────────────────────────────────────────────────
 Coleta:
 1. Métricas diárias (/insights) – nível campaign
-2. daily_budget nas campanhas (CBO)
-3. daily_budget somado dos adsets (quando não é CBO)
+2. daily_budget / lifetime_budget das campanhas que aparecem nos insights
 
 Resultado final = métricas + orçamento (já convertido de centavos p/ moeda)
-ADICIONA os dados no BigQuery (WRITE_APPEND) - acumula histórico completo
+Grava no BigQuery via MERGE (MERGE_KEYS) - acumula histórico completo sem duplicar dias
 """
 
 import os
@@ -17,14 +16,32 @@ import json
 import time
 import logging
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 
-import requests
 import pandas as pd
 import pytz
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.bq_upsert import upsert_to_bigquery  # noqa: E402
+from utils.graph_api import ERROR_REDUCE_DATA, GraphAPIError, get_graph_client  # noqa: E402
+from utils.account_access import verify_accounts  # noqa: E402
+from utils.campaign_budgets import fetch_campaign_budgets, get_budget_snapshot  # noqa: E402
+from utils.hourly import HOURLY_BREAKDOWN, first_list_value, hour_from_interval  # noqa: E402
+from utils.insights_report import fetch_insights_report  # noqa: E402
+from utils.profiling import export_profiles, profiled  # noqa: E402
+from utils.rate_limit import token_key  # noqa: E402
+from utils.run_metrics import RunMeter, resource_schema  # noqa: E402
+from utils.run_scheduler import get_run_scheduler, run_groups  # noqa: E402
+from utils.schemas import FACEBOOK_CAMPAIGNS_UTC  # noqa: E402
+from utils.tracing import export_spans, span, traced  # noqa: E402
+from utils.page_size import (  # noqa: E402
+    GRAPH_PAGE_SIZE_START, PAGE_SIZE_FAIL_FAST, AdaptivePageSize, get_page_size_memory,
+)
+
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
 # ------------------------------------------------------------------------------
@@ -87,6 +104,8 @@ except Exception as e:
 
 # Tabela do BigQuery onde todos os dados serão salvos
 BIGQUERY_TABLE_ID = "data-v1-423414.test.cloud_facebook_historical_utc_adjustments"
+# Chaves naturais de uma linha: o MERGE atualiza em vez de duplicar
+MERGE_KEYS = ["date_start", "account_id", "campaign_id", "hour"]
 
 # Dados sempre agrupados por campanha + hora do dia
 INCLUDE_HOURLY = True
@@ -94,16 +113,31 @@ INCLUDE_HOURLY = True
 # ------------------------------------------------------------------------------
 # CONFIG PARA THREADS
 # ------------------------------------------------------------------------------
-# Número máximo de workers rodando em paralelo (threads)
+# Requisições simultâneas na execução inteira, somando todos os grupos
+# (agendador global em utils/run_scheduler.py)
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", "20"))
 # Número máximo de tentativas de checagem do relatório no GAM
 MAX_CHECKS = int(os.getenv("MAX_CHECKS", "18"))
 # Tempo (em segundos) entre cada checagem
 SLEEP_SECONDS = int(os.getenv("SLEEP_SECONDS", "3"))
-# Delay entre requisições para evitar rate limiting (em segundos)
-REQUEST_DELAY = float(os.getenv("REQUEST_DELAY", "1.0"))
-# Delay entre contas para distribuir a carga (em segundos)
-ACCOUNT_DELAY = float(os.getenv("ACCOUNT_DELAY", "1.5"))
+# Delays fixos opcionais (em segundos). O ritmo normal vem do governador de
+# rate limit (utils/rate_limit.py), que lê os headers de uso de cada resposta
+REQUEST_DELAY = float(os.getenv("REQUEST_DELAY", "0"))
+ACCOUNT_DELAY = float(os.getenv("ACCOUNT_DELAY", "0"))
+
+# Cliente único da Graph API: todas as threads e grupos reutilizam as mesmas
+# conexões keep-alive com graph.facebook.com
+GRAPH_CLIENT = get_graph_client(
+    max_retries=MAX_CHECKS,
+    backoff_seconds=SLEEP_SECONDS,
+    request_delay=REQUEST_DELAY,
+)
+# Último tamanho de página bom por conta (persistido entre execuções)
+PAGE_SIZES = get_page_size_memory(os.path.basename(os.path.dirname(os.path.abspath(__file__))))
+# Pool único da execução: limite global, faixa por token e rodízio entre grupos
+SCHEDULER = get_run_scheduler(max_concurrency=MAX_WORKERS)
+# Orçamentos de campanha já lidos + marca d'água de updated_time por conta
+BUDGET_SNAPSHOT = get_budget_snapshot()
 
 # ------------------------------------------------------------------------------
 # FACEBOOK API HELPERS
@@ -130,9 +164,16 @@ PROBLEMATIC_ACCOUNTS = {
     "act_1230275922480187",  # Rate limit frequente
 }
 
+# Relatórios assíncronos (POST /act_X/insights + download em bloco):
+#   auto → contas problemáticas e contas que respondem "reduce the amount of data"
+#   all  → todas as contas
+#   off  → apenas paginação síncrona
+INSIGHTS_ASYNC_MODE = os.getenv("INSIGHTS_ASYNC_MODE", "auto").lower()
+
 
-def fb_get(url: str, params: dict, retries: int = 0, context: str = "", max_rate_limit_retries: int = 3):
-    """GET com back-off exponencial simples.
+def fb_get(url: str, params: dict, retries: int = 0, context: str = "", max_rate_limit_retries: int = 3,
+           fail_fast: tuple = ()):
+    """GET via cliente compartilhado da Graph API (pool keep-alive + retry classificado).
     
     Args:
         url: URL da requisição
@@ -140,70 +181,15 @@ def fb_get(url: str, params: dict, retries: int = 0, context: str = "", max_rate
         retries: Número de tentativas (0 = usar MAX_CHECKS)
         context: Contexto adicional para logs (ex: account_id)
         max_rate_limit_retries: Máximo de tentativas para rate limit (padrão: 3)
+        fail_fast: Tipos de erro repassados ao chamador em vez de novas tentativas
     """
-    if retries == 0:
-        retries = MAX_CHECKS
-    
-    # Delay inicial para evitar sobrecarregar a API
-    time.sleep(REQUEST_DELAY)
-    
-    context_prefix = f"[{context}] " if context else ""
-    rate_limit_attempts = 0
-    
-    for attempt in range(retries):
-        resp = requests.get(url, params=params, timeout=60)
-        if resp.ok:
-            return resp.json()
-        
-        # Verificar se é rate limit
-        is_rate_limit = False
-        if resp.status_code == 400:
-            error_msg = resp.text
-            if "User request limit reached" in error_msg or "error_subcode" in error_msg:
-                is_rate_limit = True
-                rate_limit_attempts += 1
-                logger.error("%sErro 400 - Rate limit atingido na conta (tentativa %s/%s): %s", 
-                           context_prefix, rate_limit_attempts, max_rate_limit_retries, error_msg)
-                
-                # Se excedeu o limite de tentativas para rate limit, retornar None
-                if rate_limit_attempts >= max_rate_limit_retries:
-                    logger.warning("%sRate limit persistente após %s tentativas. Pulando esta requisição.", 
-                                 context_prefix, max_rate_limit_retries)
-                    return None
-            else:
-                logger.error("%sErro 400 - Parâmetros inválidos: %s", context_prefix, resp.text)
-        elif resp.status_code == 401:
-            logger.error("%sErro 401 - Token inválido ou expirado: %s", context_prefix, resp.text)
-        elif resp.status_code == 403:
-            logger.error("%sErro 403 - Sem permissão para acessar esta conta: %s", context_prefix, resp.text)
-        elif resp.status_code == 404:
-            logger.error("%sErro 404 - Recurso não encontrado: %s", context_prefix, resp.text)
-        elif resp.status_code == 429:
-            is_rate_limit = True
-            rate_limit_attempts += 1
-            logger.warning("%sErro 429 - Rate limit atingido (tentativa %s/%s), aguardando...: %s", 
-                         context_prefix, rate_limit_attempts, max_rate_limit_retries, resp.text)
-            
-            # Se excedeu o limite de tentativas para rate limit, retornar None
-            if rate_limit_attempts >= max_rate_limit_retries:
-                logger.warning("%sRate limit persistente após %s tentativas. Pulando esta requisição.", 
-                             context_prefix, max_rate_limit_retries)
-                return None
-        else:
-            logger.warning("%sErro %s – tentativa %s/%s: %s",
-                           context_prefix, resp.status_code, attempt + 1, retries, resp.text)
-        
-        # Back-off exponencial, com delay maior para rate limit
-        if is_rate_limit:
-            time.sleep(SLEEP_SECONDS * (2 ** attempt) * 2)  # Delay maior para rate limit
-        else:
-            time.sleep(SLEEP_SECONDS * (2 ** attempt))
-    
-    return None
+    return GRAPH_CLIENT.get(url, params, retries=retries or MAX_CHECKS, context=context,
+                            max_rate_limit_retries=max_rate_limit_retries, fail_fast=fail_fast)
 
 
 # ---------- INSIGHTS ----------------------------------------------------------
-def get_insights_page(account_id: str, token: str, after: str | None = None, is_lifetime: bool = False, use_smaller_limit: bool = False):
+def build_insights_params(account_id: str, token: str, is_lifetime: bool = False):
+    """URL e parâmetros da consulta de insights da conta (sem paginação)."""
     tz = pytz.timezone("UTC")  # Contas UTC (COINIS) — usar fuso UTC para datas
     now = datetime.now(tz)
 
@@ -231,38 +217,57 @@ def get_insights_page(account_id: str, token: str, after: str | None = None, is_
         "time_range": time_range_json,  # Dados de anteontem
         "level": "campaign",
         "breakdowns": "hourly_stats_aggregated_by_advertiser_time_zone",  # Sempre incluir dados por hora
-        "limit": 25 if use_smaller_limit else 50,  # Reduzido drasticamente: 50 para 25, 500 para 50
     }
-    
+    return url, params
+
+
+def get_insights_page(account_id: str, token: str, after: str | None = None, is_lifetime: bool = False, limit: int = GRAPH_PAGE_SIZE_START):
+    url, params = build_insights_params(account_id, token, is_lifetime)
+    params["limit"] = limit
     if after:
         params["after"] = after
-    return fb_get(url, params, context=account_id)
+    # "reduce the amount of data" e 5xx voltam na hora para o AdaptivePageSize reduzir o limit
+    return fb_get(url, params, context=account_id, fail_fast=PAGE_SIZE_FAIL_FAST)
+
+
+def get_insights_report(account_id: str, token: str, is_lifetime: bool = False):
+    """Insights da conta via relatório assíncrono (poucas chamadas para contas pesadas)."""
+    url, params = build_insights_params(account_id, token, is_lifetime)
+    return fetch_insights_report(GRAPH_CLIENT, url, params, context=account_id)
 
 
 def fetch_insights_all_accounts(accounts: list, token: str, is_lifetime: bool = False):
     rows = []
 
+    @traced("account.insights", "account_id")
     def process_account(acc):
         acc_rows = []
-        after = None
         
-        # Delay entre contas para evitar sobrecarregar a API
-        time.sleep(ACCOUNT_DELAY)
+        if ACCOUNT_DELAY:
+            time.sleep(ACCOUNT_DELAY)
         logger.info("🔄 [INSIGHTS] Processando insights da conta %s...", acc)
         
         try:
-            # Começar com limite pequeno para evitar dados excessivos
-            use_smaller_limit = True
-            while True:
-                data = get_insights_page(acc, token, after, is_lifetime, use_smaller_limit=use_smaller_limit)
-                if not data:
-                    break
-                acc_rows.extend(data.get("data", []))
-                after = data.get("paging", {}).get("cursors", {}).get("after")
-                if not after:
-                    break
-                # Se a primeira página funcionou, continuar com limite pequeno para ser conservador
-                use_smaller_limit = True
+            if INSIGHTS_ASYNC_MODE == "all" or (INSIGHTS_ASYNC_MODE == "auto" and acc in PROBLEMATIC_ACCOUNTS):
+                return get_insights_report(acc, token, is_lifetime)
+            pager = AdaptivePageSize(acc, PAGE_SIZES, backoff_seconds=SLEEP_SECONDS)
+            try:
+                # Páginas grandes, reduzidas pela metade só quando a API pede
+                # A próxima página já é buscada enquanto a atual é processada
+                pages = GRAPH_CLIENT.paginate(
+                    lambda after: pager.fetch(
+                        lambda limit: get_insights_page(acc, token, after, is_lifetime, limit=limit)
+                    ),
+                    token=token,
+                )
+                for data in pages:
+                    acc_rows.extend(data.get("data", []))
+                pager.finish()
+            except GraphAPIError as e:
+                if e.kind != ERROR_REDUCE_DATA or INSIGHTS_ASYNC_MODE == "off":
+                    raise
+                logger.warning("📦 [INSIGHTS] Conta %s pediu menos dados – usando relatório assíncrono", acc)
+                acc_rows = get_insights_report(acc, token, is_lifetime)
         except Exception as e:
             logger.error("❌ [INSIGHTS] Erro ao processar conta %s: %s. Continuando com outras contas...", acc, str(e))
             # Retornar lista vazia para não quebrar o processamento
@@ -270,94 +275,95 @@ def fetch_insights_all_accounts(accounts: list, token: str, is_lifetime: bool =
         
         return acc_rows
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_account, acc): acc for acc in accounts}
-        for future in as_completed(futures):
-            acc = futures[future]
-            try:
-                result = future.result()
-                rows.extend(result)
-                if len(result) > 0:
-                    logger.info("✅ [INSIGHTS] Conta %s: %s registros de insights processados", acc, len(result))
-                else:
-                    logger.warning("⚠️ [INSIGHTS] Conta %s: nenhum dado processado (pode ter tido erros)", acc)
-            except Exception as e:
-                logger.error("❌ [INSIGHTS] Erro na conta %s: %s. Continuando com outras contas...", acc, str(e))
+    futures = SCHEDULER.map(process_account, accounts, token=token)
+    for future in as_completed(futures):
+        acc = futures[future]
+        try:
+            result = future.result()
+            rows.extend(result)
+            if len(result) > 0:
+                logger.info("✅ [INSIGHTS] Conta %s: %s registros de insights processados", acc, len(result))
+            else:
+                logger.warning("⚠️ [INSIGHTS] Conta %s: nenhum dado processado (pode ter tido erros)", acc)
+        except Exception as e:
+            logger.error("❌ [INSIGHTS] Erro na conta %s: %s. Continuando com outras contas...", acc, str(e))
 
     return rows
 
 
 # ---------- BUDGETS -----------------------------------------------------------
-def get_campaign_budgets(account_id: str, token: str):
-    url = f"https://graph.facebook.com/v24.0/{account_id}/campaigns"
-    params = {
-        "access_token": token,
-        "fields": "id,name,daily_budget,lifetime_budget,stop_time,status",
-        "limit": 50,  # Reduzido drasticamente de 500 para 50
-    }
-    data = fb_get(url, params, context=account_id) or {}
-    return data.get("data", [])
+def campaign_ids_by_account(df_insights: pd.DataFrame) -> dict:
+    """``{act_<account_id>: [campaign_id, ...]}`` das campanhas que aparecem nos insights."""
+    if df_insights.empty or not {"account_id", "campaign_id"} <= set(df_insights.columns):
+        return {}
+    pairs = df_insights[["account_id", "campaign_id"]].dropna().astype(str).drop_duplicates()
+    return {f"act_{acc}": sorted(ids) for acc, ids in pairs.groupby("account_id")["campaign_id"]}
 
 
-def get_adset_budgets(account_id: str, token: str):
-    url = f"https://graph.facebook.com/v24.0/{account_id}/adsets"
-    params = {
-        "access_token": token,
-        "fields": "id,name,campaign_id,daily_budget",
-        "limit": 50,  # Reduzido drasticamente de 500 para 50
-    }
-    data = fb_get(url, params, context=account_id) or {}
-    return data.get("data", [])
+def get_campaign_budgets(account_id: str, token: str, campaign_ids: list):
+    """Orçamentos das campanhas ``campaign_ids`` da conta.
+
+    Vêm do snapshot persistido (utils/campaign_budgets.py); a API só é
+    consultada para campanhas alteradas desde a última execução ou ainda
+    fora do snapshot.
+    """
+    return fetch_campaign_budgets(GRAPH_CLIENT, account_id, token, campaign_ids, BUDGET_SNAPSHOT)
 
 
-def fetch_budgets_all_accounts(accounts: list, token: str):
-    camp_rows, adset_rows = [], []
+def fetch_budgets_all_accounts(campaign_ids: dict, token: str):
+    """Orçamentos das campanhas por conta (``campaign_ids_by_account``)."""
+    camp_rows = []
 
+    @traced("account.budgets", "account_id")
     def process_account(acc):
-        # Delay entre contas para evitar sobrecarregar a API
-        time.sleep(ACCOUNT_DELAY)
+        if ACCOUNT_DELAY:
+            time.sleep(ACCOUNT_DELAY)
         
         try:
-            logger.info("🔄 [BUDGETS] Processando campanhas da conta %s...", acc)
-            campaigns = get_campaign_budgets(acc, token)
+            logger.info("🔄 [BUDGETS] Processando %s campanhas da conta %s...", len(campaign_ids[acc]), acc)
+            campaigns = get_campaign_budgets(acc, token, campaign_ids[acc])
             logger.info("✅ [BUDGETS] Conta %s: %s campanhas processadas", acc, len(campaigns))
-            
-            logger.info("🔄 [BUDGETS] Processando adsets da conta %s...", acc)
-            adsets = get_adset_budgets(acc, token)
-            logger.info("✅ [BUDGETS] Conta %s: %s adsets processados", acc, len(adsets))
-            
-            return campaigns, adsets
+            return campaigns
         except Exception as e:
             logger.error("❌ [BUDGETS] Erro ao processar conta %s: %s. Continuando com outras contas...", acc, str(e))
-            # Retornar listas vazias para não quebrar o processamento
-            return [], []
+            # Retornar lista vazia para não quebrar o processamento
+            return []
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_account, acc): acc for acc in accounts}
-        for future in as_completed(futures):
-            acc = futures[future]
-            try:
-                camps, adsets = future.result()
-                camp_rows.extend(camps)
-                adset_rows.extend(adsets)
-                if len(camps) > 0 or len(adsets) > 0:
-                    logger.info("Conta %s: %s campanhas, %s adsets",
-                                acc, len(camps), len(adsets))
-                else:
-                    logger.warning("⚠️ [BUDGETS] Conta %s: nenhum dado processado (pode ter tido erros)", acc)
-            except Exception as e:
-                logger.error("❌ [BUDGETS] Erro na conta %s: %s. Continuando com outras contas...", acc, str(e))
+    futures = SCHEDULER.map(process_account, list(campaign_ids), token=token)
+    for future in as_completed(futures):
+        acc = futures[future]
+        try:
+            camps = future.result()
+            camp_rows.extend(camps)
+            if len(camps) < len(campaign_ids[acc]):
+                logger.warning("⚠️ [BUDGETS] Conta %s: %s de %s campanhas com orçamento",
+                               acc, len(camps), len(campaign_ids[acc]))
+        except Exception as e:
+            logger.error("❌ [BUDGETS] Erro na conta %s: %s. Continuando com outras contas...", acc, str(e))
 
-    return pd.DataFrame(camp_rows), pd.DataFrame(adset_rows)
+    BUDGET_SNAPSHOT.save()
+    return pd.DataFrame(camp_rows)
 
 
 # ------------------------------------------------------------------------------
 # PROCESSAMENTO COMPLETO
 # ------------------------------------------------------------------------------
+@profiled()
 def process_all(accounts: list, token: str):
+    # -- Métricas --------------------------------------------------------------
+    insights_raw = fetch_insights_all_accounts(accounts, token, is_lifetime=False)
+    df_insights = pd.DataFrame(insights_raw)
+
     # -- Orçamentos ------------------------------------------------------------
-    df_camp, df_adset = fetch_budgets_all_accounts(accounts, token)
+    # Só as campanhas que apareceram nos insights (filtro no servidor)
+    df_camp = fetch_budgets_all_accounts(campaign_ids_by_account(df_insights), token)
+    return transform_campaigns(df_insights, df_camp)
 
+
+@traced("transform")
+@profiled()
+def transform_campaigns(df_insights: pd.DataFrame, df_camp: pd.DataFrame) -> pd.DataFrame:
+    """Junta insights e orçamentos no formato final da tabela."""
     if not df_camp.empty:
         df_camp["daily_budget"] = pd.to_numeric(df_camp.get("daily_budget", 0), errors="coerce")
         df_camp["daily_budget"] = df_camp["daily_budget"].fillna(0)
@@ -379,10 +385,6 @@ def process_all(accounts: list, token: str):
         else:
             df_camp["campaign_end_time"] = pd.to_datetime(df_camp["campaign_end_time"], errors='coerce')
 
-    # -- Métricas --------------------------------------------------------------
-    insights_raw = fetch_insights_all_accounts(accounts, token, is_lifetime=False)
-    df_insights = pd.DataFrame(insights_raw)
-
     # Se não há insights, criar um DataFrame vazio com o schema correto
     if df_insights.empty:
         logger.warning("Nenhum dado de insights retornado. Criando tabela vazia.")
@@ -409,40 +411,20 @@ def process_all(accounts: list, token: str):
     # Processar dados horários (sempre habilitado)
     if not df_insights.empty:
         logger.info("🕐 Processando dados por hora do dia...")
-        expanded_rows = []
-        
-        for _, row in df_insights.iterrows():
-            hourly_stats = row.get("hourly_stats_aggregated_by_advertiser_time_zone")
-            
-            # Se não há breakdown por hora, usar o registro original
-            if not hourly_stats or pd.isna(hourly_stats):
-                # Criar uma cópia do registro sem o campo hourly_stats
-                row_dict = row.to_dict()
-                row_dict.pop("hourly_stats_aggregated_by_advertiser_time_zone", None)
-                row_dict["hour"] = None  # Sem informação de hora
-                expanded_rows.append(row_dict)
-            else:
-                # Se há breakdown por hora, criar um registro para cada hora
-                # O campo hourly_stats_aggregated_by_advertiser_time_zone é uma string
-                # que representa o intervalo de hora (ex: "00:00-01:00")
-                row_dict = row.to_dict()
-                row_dict.pop("hourly_stats_aggregated_by_advertiser_time_zone", None)
-                row_dict["hour"] = str(hourly_stats)  # Manter a string do intervalo
-                expanded_rows.append(row_dict)
-        
-        if expanded_rows:
-            df_insights = pd.DataFrame(expanded_rows)
-            logger.info("✅ Dados expandidos por hora: %s registros", len(df_insights))
+        # O breakdown vem como intervalo em texto (ex: "00:00:00 - 00:59:59"):
+        # `hour` mantém o texto e `hour_of_day` traz a hora inteira (0-23)
+        if HOURLY_BREAKDOWN in df_insights.columns:
+            intervals = df_insights.pop(HOURLY_BREAKDOWN)
+            intervals = intervals.where(intervals.notna() & (intervals != ""), None)
         else:
-            logger.warning("⚠️ Nenhum dado horário expandido")
+            intervals = pd.Series(None, index=df_insights.index, dtype="object")
+        df_insights["hour"] = intervals
+        df_insights["hour_of_day"] = hour_from_interval(intervals)
+        logger.info("✅ Dados expandidos por hora: %s registros", len(df_insights))
 
     # conversions → pega primeiro valor da lista
-    def _first_val(lst):
-        if isinstance(lst, list) and lst and isinstance(lst[0], dict):
-            return float(lst[0].get("value", 0))
-        return None
     if "conversions" in df_insights.columns:
-        df_insights["conversions"] = df_insights["conversions"].apply(_first_val)
+        df_insights["conversions"] = first_list_value(df_insights["conversions"])
 
     # -- Merge final -----------------------------------------------------------
     if not df_camp.empty:
@@ -483,60 +465,8 @@ def process_all(accounts: list, token: str):
     if "amount_spent" not in df_final.columns:
         df_final["amount_spent"] = df_final.get("spend", 0)
     
-    # Garantir que todas as colunas do schema estejam presentes
-    expected_columns = [
-        "account_name", "account_id", "campaign_id", "campaign_name", 
-        "date_start", "date_stop", "conversions", "spend", "objective", 
-        "cpc", "ctr", "frequency", "impressions", "reach", "imported_at", 
-        "daily_budget", "lifetime_budget", "amount_spent", "campaign_end_time", "campaign_status",
-        "hour"  # Sempre incluir coluna de hora
-    ]
-    
-    # Adicionar colunas que podem estar faltando
-    for col in expected_columns:
-        if col not in df_final.columns:
-            if col in ["daily_budget", "lifetime_budget", "amount_spent", "spend", "conversions", "cpc", "ctr", "frequency", "impressions", "reach"]:
-                df_final[col] = 0.0
-            elif col in ["date_start", "date_stop", "campaign_end_time", "imported_at"]:
-                df_final[col] = None
-            elif col == "hour":
-                df_final[col] = None  # Coluna de hora pode ser None se não houver breakdown
-            else:
-                df_final[col] = ""
-    
-    # Reorganizar colunas na ordem correta
-    df_final = df_final[expected_columns]
-    
-    # Converter tipos de dados para corresponder ao schema
-    # STRING fields
-    string_fields = ["account_name", "account_id", "campaign_id", "campaign_name", "objective", "campaign_status", "hour"]
-    for field in string_fields:
-        if field in df_final.columns:
-            df_final[field] = df_final[field].astype(str)
-    
-    # DATETIME fields
-    datetime_fields = ["date_start", "date_stop", "campaign_end_time"]
-    for field in datetime_fields:
-        if field in df_final.columns:
-            df_final[field] = pd.to_datetime(df_final[field], errors='coerce')
-    
-    # TIMESTAMP field
-    if "imported_at" in df_final.columns:
-        df_final["imported_at"] = pd.to_datetime(df_final["imported_at"], errors='coerce')
-    
-    # FLOAT fields
-    float_fields = ["conversions", "spend", "cpc", "ctr", "frequency", "daily_budget", "lifetime_budget", "amount_spent"]
-    for field in float_fields:
-        if field in df_final.columns:
-            df_final[field] = pd.to_numeric(df_final[field], errors='coerce')
-            df_final[field] = df_final[field].fillna(0.0)
-    
-    # INTEGER fields
-    integer_fields = ["impressions", "reach"]
-    for field in integer_fields:
-        if field in df_final.columns:
-            df_final[field] = pd.to_numeric(df_final[field], errors='coerce')
-            df_final[field] = df_final[field].fillna(0).astype(int)
+    # Colunas, ordem e tipos do schema da tabela (utils/schemas.py), numa única passada
+    df_final = FACEBOOK_CAMPAIGNS_UTC.coerce(df_final)
 
     logger.info("Linhas finais: %s", len(df_final))
     logger.info("Colunas finais: %s", list(df_final.columns))
@@ -544,70 +474,34 @@ def process_all(accounts: list, token: str):
 
 
 def verify_account_access(accounts: list, token: str, group_name: str):
-    """Verifica o acesso às contas de anúncio e token."""
-    logger.info("Verificando acesso para o grupo: %s", group_name)
-    
-    # Verificar se o token é válido testando uma conta
-    if accounts:
-        test_account = accounts[0]
-        url = f"https://graph.facebook.com/v24.0/{test_account}"
-        params = {"access_token": token, "fields": "id,name"}
-        
-        resp = requests.get(url, params=params, timeout=30)
-        if resp.status_code == 401:
-            logger.error("❌ TOKEN INVÁLIDO para o grupo %s - Erro 401: %s", group_name, resp.text)
-            return False
-        elif resp.status_code == 403:
-            logger.error("❌ SEM PERMISSÃO para acessar contas do grupo %s - Erro 403: %s", group_name, resp.text)
-            return False
-        elif resp.status_code == 200:
-            logger.info("✅ Token válido para o grupo: %s", group_name)
-        else:
-            logger.warning("⚠️ Problema desconhecido com token do grupo %s - Status: %s", group_name, resp.status_code)
-    
-    # Verificar acesso a cada conta
-    accessible_accounts = []
-    inaccessible_accounts = []
-    
-    for account in accounts:
-        url = f"https://graph.facebook.com/v24.0/{account}"
-        params = {"access_token": token, "fields": "id,name"}
-        
-        resp = requests.get(url, params=params, timeout=30)
-        if resp.status_code == 200:
-            accessible_accounts.append(account)
-        elif resp.status_code == 403:
-            inaccessible_accounts.append(account)
-            logger.warning("⚠️ Sem acesso à conta %s no grupo %s", account, group_name)
-        else:
-            inaccessible_accounts.append(account)
-            logger.warning("⚠️ Problema com conta %s no grupo %s - Status: %s", account, group_name, resp.status_code)
-    
-    logger.info("📊 Resumo de acesso para grupo %s:", group_name)
-    logger.info("   ✅ Contas acessíveis: %s/%s", len(accessible_accounts), len(accounts))
-    logger.info("   ❌ Contas inacessíveis: %s/%s", len(inaccessible_accounts), len(accounts))
-    
-    if inaccessible_accounts:
-        logger.warning("   📋 Contas inacessíveis: %s", inaccessible_accounts)
-    
-    return len(accessible_accounts) > 0
+    """Verifica o token e as contas do grupo com uma consulta ``?ids=`` por token.
+
+    O resultado fica em cache por token (``ACCOUNT_ACCESS_TTL``), então as
+    execuções seguintes não consultam de novo as contas já verificadas.
+
+    Returns:
+        Contas acessíveis (lista vazia = grupo não pode ser processado)
+    """
+    return verify_accounts(GRAPH_CLIENT, accounts, token, group_name)
 
 
+@profiled()
 def process_group(group_name: str, group_config: dict):
     """Processa um grupo específico de contas e retorna os dados sem fazer upload."""
     logger.info("Iniciando processamento do grupo: %s", group_name)
     start_time = time.time()
     
-    # Verificar acesso antes de processar
-    has_access = verify_account_access(group_config["accounts"], group_config["token"], group_name)
+    # Verificar acesso antes de processar (só as contas acessíveis seguem)
+    accounts = verify_account_access(group_config["accounts"], group_config["token"], group_name)
     
-    if not has_access:
+    if not accounts:
         end_time = time.time()
         execution_time = end_time - start_time
         logger.error("❌ Grupo %s não pode ser processado - problemas de acesso", group_name)
         return {"group": group_name, "records": 0, "time": execution_time, "status": "access_denied", "data": None}
     
-    df_final = process_all(group_config["accounts"], group_config["token"])
+    with span("token", token=token_key(group_config["token"]), accounts=len(accounts)):
+        df_final = process_all(accounts, group_config["token"])
     end_time = time.time()
     execution_time = end_time - start_time
     
@@ -634,6 +528,7 @@ def process_group(group_name: str, group_config: dict):
         }
 
 
+@profiled()
 def consolidate_and_upload_by_table(results: list):
     """Consolida dados por tabela e faz upload consolidado."""
     logger.info("Consolidando dados por tabela...")
@@ -753,82 +648,36 @@ def upload_to_bigquery(df: pd.DataFrame, table_id: str):
         logger.error("DataFrame nulo ou BigQuery não configurado.")
         return
     
-    # Definir schema explícito para o BigQuery SEMPRE
-    # Isso garante que os tipos sejam consistentes em todas as tabelas
-    schema = [
-        bigquery.SchemaField("account_name", "STRING"),
-        bigquery.SchemaField("account_id", "STRING"),
-        bigquery.SchemaField("campaign_id", "STRING"),
-        bigquery.SchemaField("campaign_name", "STRING"),
-        bigquery.SchemaField("date_start", "DATETIME"),
-        bigquery.SchemaField("date_stop", "DATETIME"),
-        bigquery.SchemaField("conversions", "FLOAT"),
-        bigquery.SchemaField("spend", "FLOAT"),
-        bigquery.SchemaField("objective", "STRING"),
-        bigquery.SchemaField("cpc", "FLOAT"),
-        bigquery.SchemaField("ctr", "FLOAT"),
-        bigquery.SchemaField("frequency", "FLOAT"),
-        bigquery.SchemaField("impressions", "INTEGER"),
-        bigquery.SchemaField("reach", "INTEGER"),
-        bigquery.SchemaField("imported_at", "DATETIME"),
-        bigquery.SchemaField("daily_budget", "FLOAT"),
-        bigquery.SchemaField("lifetime_budget", "FLOAT"),
-        bigquery.SchemaField("amount_spent", "FLOAT"),
-        bigquery.SchemaField("campaign_end_time", "TIMESTAMP"),
-        bigquery.SchemaField("campaign_status", "STRING"),
-        bigquery.SchemaField("hour", "STRING")  # Sempre incluir coluna de hora
-    ]
+    # Schema explícito SEMPRE, gerado do mesmo registro usado na conversão de tipos
+    schema = FACEBOOK_CAMPAIGNS_UTC.bigquery_schema()
     
-    # Aceitar DataFrames vazios para zerar a tabela
     if df.empty:
-        logger.info("DataFrame vazio - zerando tabela %s", table_id)
-        # Criar um DataFrame com schema explícito para garantir tipos corretos
-        schema_df = pd.DataFrame({
-            "account_name": [""],
-            "account_id": [""],
-            "campaign_id": [""],
-            "campaign_name": [""],
-            "date_start": [pd.Timestamp.now()],
-            "date_stop": [pd.Timestamp.now()],
-            "conversions": [0.0],
-            "spend": [0.0],
-            "objective": [""],
-            "cpc": [0.0],
-            "ctr": [0.0],
-            "frequency": [0.0],
-            "impressions": [0],
-            "reach": [0],
-            "imported_at": [pd.Timestamp.now()],
-            "daily_budget": [0.0],
-            "lifetime_budget": [0.0],
-            "amount_spent": [0.0],
-            "campaign_end_time": [pd.Timestamp.now()],
-            "campaign_status": [""],
-            "hour": [None]  # Sempre incluir coluna de hora
-        })
-        # Remover a linha de dados, mantendo apenas o schema
-        df = schema_df.iloc[0:0]
-    
-    # Usar schema explícito SEMPRE para garantir consistência
-    job_cfg = bigquery.LoadJobConfig(
-        write_disposition="WRITE_APPEND",
-        schema=schema
-    )
-    
+        logger.info("DataFrame vazio - nada a gravar em %s", table_id)
+        return
+
     try:
         logger.info("Enviando %s registros para %s...", len(df), table_id)
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_cfg)
-        job.result()
-        logger.info("Adicionados %s registros para %s", job.output_rows, table_id)
+        # MERGE pelas chaves naturais: rodar o mesmo dia de novo atualiza as
+        # linhas em vez de duplicá-las
+        result = upsert_to_bigquery(df, table_id, keys=MERGE_KEYS, date_column="date_start", schema=schema,
+                                    clustering_fields=FACEBOOK_CAMPAIGNS_UTC.clustering_fields, client=bq_client)
+        logger.info("Gravados %s registros em %s (%s novos, %s atualizados)",
+                    result["rows"], table_id, result["inserted"], result["updated"])
     except Exception as e:
-        logger.error("Erro ao adicionar dados ao BigQuery: %s", str(e))
+        logger.error("Erro ao gravar dados no BigQuery: %s", str(e))
         raise
 
 
-def upload_execution_metadata(results: list, execution_time: float, script_name: str):
-    """Salva metadados da execução na tabela cloud_facebook_executions."""
+def upload_execution_metadata(results: list, execution_time: float, script_name: str,
+                              resources: dict | None = None):
+    """Salva metadados da execução na tabela cloud_facebook_executions.
+
+    ``resources`` são as métricas de ``RunMeter.finish()`` (CPU, memória, HTTP, esperas).
+    """
     if bq_client is None:
         logger.warning("BigQuery não configurado - pulando upload de metadados")
+        export_spans(script_name, upload=False)
+        export_profiles(script_name)
         return
     
     tz = pytz.timezone("America/Sao_Paulo")
@@ -873,7 +722,8 @@ def upload_execution_metadata(results: list, execution_time: float, script_name:
         "total_records": total_records,
         "execution_time_seconds": execution_time,
         "status": status,
-        "error_summary": error_summary
+        "error_summary": error_summary,
+        **(resources or {}),
     }])
     
     # Schema da tabela de execuções
@@ -889,30 +739,36 @@ def upload_execution_metadata(results: list, execution_time: float, script_name:
         bigquery.SchemaField("execution_time_seconds", "FLOAT"),
         bigquery.SchemaField("status", "STRING"),
         bigquery.SchemaField("error_summary", "STRING")
-    ]
+    ] + resource_schema()
     
-    # Configurar job para APPEND (acumular histórico)
+    # Configurar job para APPEND (acumular histórico); as colunas de recursos entram na primeira carga
     job_cfg = bigquery.LoadJobConfig(
         write_disposition="WRITE_APPEND",
-        schema=schema
+        schema=schema,
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
     )
     
     executions_table_id = "data-v1-423414.test.cloud_facebook_executions"
     
     try:
         logger.info("Salvando metadados de execução em %s...", executions_table_id)
-        job = bq_client.load_table_from_dataframe(metadata_df, executions_table_id, job_config=job_cfg)
-        job.result()
+        load_to_bigquery(metadata_df, executions_table_id, client=bq_client, job_config=job_cfg)
         logger.info("✅ Metadados de execução salvos com sucesso")
     except Exception as e:
         logger.error("Erro ao salvar metadados de execução: %s", str(e))
         # Não fazer raise para não interromper o fluxo principal
 
+    # Spans da execução (grupo, conta, requisição, esperas, cargas) em cloud_facebook_spans
+    export_spans(script_name, execution_id, client=bq_client)
+    # Perfis das etapas (só com PROFILE_MODE), ao lado do JSONL dos spans
+    export_profiles(script_name, execution_id)
+
 
 # ------------------------------------------------------------------------------
 # ENTRYPOINT – Cloud Function
 # ------------------------------------------------------------------------------
 def execute_notebook(event, context):
+    meter = RunMeter("cloud_facebook_historical_utc_complete").start()
     import base64
     msg = base64.b64decode(event["data"]).decode("utf-8")
     logger.info("Mensagem recebida: %s", msg)
@@ -925,27 +781,24 @@ def execute_notebook(event, context):
 
     # Processar todos os grupos em paralelo
     results = []
-    with ThreadPoolExecutor(max_workers=len(GROUPS)) as executor:
-        futures = {executor.submit(process_group, group_name, group_config): group_name 
-                  for group_name, group_config in GROUPS.items()}
-        
-        for future in as_completed(futures):
-            group_name = futures[future]
-            try:
-                result = future.result()
-                results.append(result)
-                logger.info("Grupo %s processado: %s registros", result["group"], result["records"])
-            except Exception as e:
-                logger.error("Erro no grupo %s: %s", group_name, str(e))
-                results.append({"group": group_name, "records": 0, "time": 0, "status": "error", "table_id": BIGQUERY_TABLE_ID})
+    for group_name, future in run_groups(GROUPS, process_group):
+        try:
+            result = future.result()
+            results.append(result)
+            logger.info("Grupo %s processado: %s registros", result["group"], result["records"])
+        except Exception as e:
+            logger.error("Erro no grupo %s: %s", group_name, str(e))
+            results.append({"group": group_name, "records": 0, "time": 0, "status": "error", "table_id": BIGQUERY_TABLE_ID})
 
     # Consolidar e fazer upload por tabela
     logger.info("Iniciando consolidação e upload por tabela...")
     upload_results = consolidate_and_upload_by_table(results)
     
     # Calcular tempo de execução e salvar metadados
-    execution_time = sum(r.get("time", 0) for r in results)
-    upload_execution_metadata(results, execution_time, "cloud_facebook_historical_utc_complete")
+    # (tempo real: a soma dos tempos dos grupos contava várias vezes o que roda em paralelo)
+    resources = meter.finish()
+    upload_execution_metadata(results, resources["wall_time_seconds"], "cloud_facebook_historical_utc_complete",
+                              resources)
     
     logger.info("Todos os grupos processados e consolidados por tabela.")
     return "Execução concluída."
@@ -957,6 +810,7 @@ def execute_notebook(event, context):
 if __name__ == "__main__":
     try:
         start_time = time.time()
+        meter = RunMeter("cloud_facebook_historical_utc").start()
         logger.info("=" * 80)
         logger.info("🚀 Iniciando execução local do script (DADOS DE ANTEONTEM - HISTÓRICO - COM DADOS POR HORA)")
         logger.info("=" * 80)
@@ -1003,21 +857,16 @@ if __name__ == "__main__":
         
         # Processar todos os grupos em paralelo
         results = []
-        with ThreadPoolExecutor(max_workers=len(GROUPS)) as executor:
-            futures = {executor.submit(process_group, group_name, group_config): group_name 
-                      for group_name, group_config in GROUPS.items()}
-            
-            for future in as_completed(futures):
-                group_name = futures[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
-                    logger.info("%s Grupo %s processado: %s registros em %.2f segundos (Status: %s)", 
-                               status_emoji, result["group"], result["records"], result["time"], result["status"])
-                except Exception as e:
-                    logger.error("❌ Erro no grupo %s: %s", group_name, str(e), exc_info=True)
-                    results.append({"group": group_name, "records": 0, "time": 0, "status": "error", "table_id": BIGQUERY_TABLE_ID})
+        for group_name, future in run_groups(GROUPS, process_group):
+            try:
+                result = future.result()
+                results.append(result)
+                status_emoji = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "no_data" else "❌"
+                logger.info("%s Grupo %s processado: %s registros em %.2f segundos (Status: %s)", 
+                           status_emoji, result["group"], result["records"], result["time"], result["status"])
+            except Exception as e:
+                logger.error("❌ Erro no grupo %s: %s", group_name, str(e), exc_info=True)
+                results.append({"group": group_name, "records": 0, "time": 0, "status": "error", "table_id": BIGQUERY_TABLE_ID})
 
         # Consolidar e fazer upload por tabela
         logger.info("Iniciando consolidação e upload por tabela...")
@@ -1089,7 +938,7 @@ if __name__ == "__main__":
         
         # Salvar metadados de execução
         try:
-            upload_execution_metadata(results, execution_time, "cloud_facebook_historical_utc")
+            upload_execution_metadata(results, execution_time, "cloud_facebook_historical_utc", meter.finish())
         except Exception as e:
             logger.warning("⚠️ Erro ao salvar metadados de execução: %s", str(e))
         
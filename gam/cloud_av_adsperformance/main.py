@@ -15,12 +15,20 @@ import aiohttp
 import pandas as pd
 from datetime import datetime, timedelta
 import os
+import sys
 from pytz import timezone
 from collections import defaultdict
 import logging
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.bq_tables import partitioned_table  # noqa: E402
+from utils.profiling import profiled  # noqa: E402
+from utils.run_metrics import aiohttp_trace_config, metered_run, record_sleep  # noqa: E402
+
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
 # ------------------------------------------------------------------------------
@@ -71,7 +79,6 @@ def get_bq_client():
     if bq_client is None:
         try:
             from google.cloud import bigquery
-            from google.oauth2 import service_account
             
             # Verificar se estamos no GitHub Actions (variável de ambiente GOOGLE_APPLICATION_CREDENTIALS)
             if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
@@ -172,7 +179,7 @@ def aggregate_kvp_data(data):
     return result
 
 def create_gam_table(table_id: str):
-    """Cria a tabela no BigQuery se não existir."""
+    """Cria a tabela no BigQuery se não existir (particionada por dia em date, cluster por site/key)."""
     bq_client = get_bq_client()
     if not bq_client:
         logger.error("Cliente BigQuery não configurado")
@@ -194,7 +201,7 @@ def create_gam_table(table_id: str):
             bigquery.SchemaField("imported_at", "DATETIME")
         ]
         
-        table = bigquery.Table(table_id, schema=schema)
+        table = partitioned_table(table_id, schema, "date", ["site_name", "key"])
         table = bq_client.create_table(table, exists_ok=True)
         logger.info(f"Tabela {table_id} criada/verificada com sucesso")
         return True
@@ -244,8 +251,7 @@ def upload_to_bigquery(df: pd.DataFrame, table_id: str):
     
     try:
         logger.info("Enviando %s registros para %s...", len(df), table_id)
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_cfg)
-        job.result()
+        job = load_to_bigquery(df, table_id, client=bq_client, job_config=job_cfg)
         logger.info("✅ Adicionados %s registros para %s", job.output_rows, table_id)
     except Exception as e:
         logger.error("❌ Erro ao adicionar dados ao BigQuery: %s", str(e))
@@ -286,6 +292,7 @@ async def fetch_kvp_data_from_api_async(session, network_id, site_name, source="
                     if attempt < max_retries:
                         wait = 10 * attempt
                         logger.info(f"Retry em {wait}s...")
+                        record_sleep(wait)
                         await asyncio.sleep(wait)
                         continue
                     else:
@@ -308,6 +315,7 @@ async def fetch_kvp_data_from_api_async(session, network_id, site_name, source="
             if attempt < max_retries:
                 wait = 10 * attempt
                 logger.info(f"Retry em {wait}s...")
+                record_sleep(wait)
                 await asyncio.sleep(wait)
             else:
                 logger.error(f"FALHA timeout após {max_retries} tentativas para {site_name}")
@@ -316,12 +324,15 @@ async def fetch_kvp_data_from_api_async(session, network_id, site_name, source="
             logger.warning(f"Erro para {site_name} (attempt {attempt}/{max_retries}): {e}")
             if attempt < max_retries:
                 wait = 10 * attempt
+                record_sleep(wait)
                 await asyncio.sleep(wait)
             else:
                 logger.error(f"FALHA após {max_retries} tentativas para {site_name}: {e}")
                 return []
     return []
 
+@metered_run("cloud_av_adsperformance")
+@profiled()
 async def run_gam_collection():
     """
     Função principal assíncrona para buscar dados GAM com utm_content e salvar no BigQuery.
@@ -329,7 +340,7 @@ async def run_gam_collection():
     try:
         logger.info("🚀 Iniciando coleta de dados GAM com utm_content...")
         
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=[aiohttp_trace_config()]) as session:
             # Cria tasks para todos os sites
             tasks = [
                 fetch_kvp_data_from_api_async(session, site["network_id"], site["site"], site.get("source", "from-gam"))
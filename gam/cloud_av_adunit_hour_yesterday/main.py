@@ -16,6 +16,13 @@ import aiohttp
 from google.cloud import bigquery
 from datetime import datetime, timedelta
 import pytz
+import os
+import sys
+
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import get_bq_client, load_to_bigquery  # noqa: E402
+from utils.run_metrics import aiohttp_trace_config, metered_run  # noqa: E402
 
 
 # Configurações da API
@@ -170,14 +177,13 @@ def write_to_bigquery(data, table_name, schema):
         print(f"  Nenhum dado para {table_name}, pulando.")
         return
 
-    client = bigquery.Client()
+    client = get_bq_client()
     table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
     job_config = bigquery.LoadJobConfig(
         write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
         schema=schema,
     )
-    job = client.load_table_from_json(data, table_id, job_config=job_config)
-    job.result()
+    load_to_bigquery(data, table_id, client=client, job_config=job_config)
     print(f"  ✓ {len(data)} rows → {table_name}")
 
 
@@ -217,6 +223,7 @@ SCHEMA_RULES = [
 ]
 
 
+@metered_run("cloud_av_adunit_hour_yesterday")
 async def run_async():
     """Função principal assíncrona."""
     now_brt = datetime.now(BRT)
@@ -230,7 +237,7 @@ async def run_async():
     all_perf = []
     all_rules = []
 
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(trace_configs=[aiohttp_trace_config()]) as session:
         tasks = [
             fetch_site(session, s["network_id"], s["site"], yesterday)
             for s in GAM_SITES
@@ -3,6 +3,13 @@ import aiohttp
 from google.cloud import bigquery
 from datetime import datetime, timedelta
 import pytz
+import os
+import sys
+
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import get_bq_client, load_to_bigquery  # noqa: E402
+from utils.run_metrics import aiohttp_trace_config, metered_run  # noqa: E402
 
 
 # Configurações da API
@@ -69,7 +76,7 @@ async def fetch_all_sites_data_async():
     """
     Busca dados de todos os sites de forma assíncrona em paralelo.
     """
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(trace_configs=[aiohttp_trace_config()]) as session:
         # Cria todas as tasks em paralelo
         tasks = [
             fetch_hourly_data_from_api_async(
@@ -129,7 +136,7 @@ def write_to_bigquery(data):
     Insere os dados no BigQuery no modo WRITE_APPEND.
     """
     try:
-        client = bigquery.Client()
+        client = get_bq_client()
         table_id = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
         job_config = bigquery.LoadJobConfig(
             write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
@@ -146,13 +153,13 @@ def write_to_bigquery(data):
                 bigquery.SchemaField("site_name", "STRING"),
             ]
         )
-        job = client.load_table_from_json(data, table_id, job_config=job_config)
-        job.result()
+        load_to_bigquery(data, table_id, client=client, job_config=job_config)
         print(f"{len(data)} registros inseridos com sucesso no BigQuery.")
     except Exception as e:
         print(f"Erro ao gravar no BigQuery: {e}")
         raise RuntimeError(f"Erro ao gravar no BigQuery: {e}")
 
+@metered_run("cloud_gam_hour_yesterday")
 async def run_code_async(event, context):
     """
     Função principal assíncrona para a Cloud Function via Trigger de Evento.
@@ -24,6 +24,7 @@ no GitHub Actions. Implementamos as seguintes soluções:
 import json
 import time
 import os
+import sys
 from datetime import datetime, timedelta
 from google.oauth2 import service_account
 from google.ads.googleads.client import GoogleAdsClient
@@ -32,6 +33,12 @@ import pytz
 import pandas as pd
 import logging
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.bq_tables import partitioned_table  # noqa: E402
+from utils.run_metrics import grpc_interceptor, metered_run, record_sleep  # noqa: E402
+
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
 # ------------------------------------------------------------------------------
@@ -49,6 +56,8 @@ logger = logging.getLogger(__name__)
 
 # 🔹 Configuração do BigQuery
 BIGQUERY_TABLE_ID = "data-v1-423414.test.ca_googleads_historical"
+# Tabela particionada por dia em "date" e clusterizada por conta/campanha
+CLUSTER_FIELDS = ["account_id", "campaign_id"]
 sao_paulo_tz = pytz.timezone('America/Sao_Paulo')
 
 # Data de ANTEONTEM em São Paulo (2 dias atrás)
@@ -286,11 +295,8 @@ def check_table_exists():
         create_bigquery_table()
 
 def create_bigquery_table():
-    """Cria tabela no BigQuery."""
+    """Cria tabela no BigQuery (particionada por dia em date)."""
     bq_client = get_bq_client()
-    dataset_id, table_name = BIGQUERY_TABLE_ID.split(".")[1:]
-    dataset_ref = bq_client.dataset(dataset_id)
-    table_ref = dataset_ref.table(table_name)
 
     schema = [
         bigquery.SchemaField("account_name", "STRING"),
@@ -309,7 +315,7 @@ def create_bigquery_table():
         bigquery.SchemaField("cost_per_conversion", "FLOAT")
     ]
 
-    table = bigquery.Table(table_ref, schema=schema)
+    table = partitioned_table(BIGQUERY_TABLE_ID, schema, "date", CLUSTER_FIELDS)
     try:
         bq_client.create_table(table)
         logger.info("✅ Tabela %s criada.", BIGQUERY_TABLE_ID)
@@ -317,6 +323,43 @@ def create_bigquery_table():
     except Exception as e:
         logger.error("❌ Erro ao criar tabela: %s", e)
 
+def convert_rows(rows):
+    """
+    Converte um lote de linhas do GoogleAdsService no formato da tabela.
+    
+    Args:
+        rows: Linhas (GoogleAdsRow) de um lote do search_stream
+    
+    Returns:
+        Lista de dicionários
+    """
+    data = []
+    for row in rows:
+        budget = 0.0
+        try:
+            if hasattr(row, "campaign_budget") and hasattr(row.campaign_budget, "amount_micros"):
+                budget = float(row.campaign_budget.amount_micros) / 1_000_000
+        except Exception:
+            pass
+
+        data.append({
+            "account_name": row.customer.descriptive_name if hasattr(row.customer, "descriptive_name") else "",
+            "account_id": str(row.customer.id) if hasattr(row.customer, "id") else "",
+            "campaign_id": str(row.campaign.id) if hasattr(row.campaign, "id") else "",
+            "campaign_name": row.campaign.name if hasattr(row.campaign, "name") else "",
+            "date": str(row.segments.date) if hasattr(row.segments, "date") else "",
+            "moeda": row.customer.currency_code if hasattr(row.customer, "currency_code") else "",
+            "budget": budget,
+            "spend": float(row.metrics.cost_micros / 1_000_000) if hasattr(row.metrics, "cost_micros") else 0.0,
+            "clicks": int(row.metrics.clicks) if hasattr(row.metrics, "clicks") else 0,
+            "cpc": float(row.metrics.average_cpc / 1_000_000) if hasattr(row.metrics, "average_cpc") else 0.0,
+            "impressions": int(row.metrics.impressions) if hasattr(row.metrics, "impressions") else 0,
+            "ctr": float(row.metrics.ctr) if hasattr(row.metrics, "ctr") else 0.0,
+            "conversions": float(row.metrics.conversions) if hasattr(row.metrics, "conversions") else 0.0,
+            "cost_per_conversion": float(row.metrics.cost_per_conversion / 1_000_000) if hasattr(row.metrics, "cost_per_conversion") else 0.0
+        })
+    return data
+
 def get_google_ads_data(client, customer_id, max_retries=3):
     """
     Busca dados do Google Ads para um customer_id com retry logic.
@@ -341,41 +384,22 @@ def get_google_ads_data(client, customer_id, max_retries=3):
         WHERE segments.date = '{anteontem}'
     """
 
-    ga_service = client.get_service("GoogleAdsService")
+    ga_service = client.get_service("GoogleAdsService", interceptors=[grpc_interceptor()])
     
     # Retry logic com backoff exponencial
     for attempt in range(1, max_retries + 1):
         try:
             logger.info(f"   🔄 Tentativa {attempt}/{max_retries} para customer_id {customer_id}")
             
-            response = ga_service.search(customer_id=customer_id, query=query)
+            # search_stream: o relatório inteiro da conta num único stream (o search
+            # pagina no servidor, com uma ida e volta por página). Cada lote é convertido
+            # assim que chega, enquanto o gRPC segue recebendo os próximos
+            stream = ga_service.search_stream(customer_id=customer_id, query=query)
 
             data = []
             
-            for row in response:
-                budget = 0.0
-                try:
-                    if hasattr(row, "campaign_budget") and hasattr(row.campaign_budget, "amount_micros"):
-                        budget = float(row.campaign_budget.amount_micros) / 1_000_000
-                except Exception:
-                    pass
-                
-                data.append({
-                    "account_name": row.customer.descriptive_name if hasattr(row.customer, "descriptive_name") else "",
-                    "account_id": str(row.customer.id) if hasattr(row.customer, "id") else "",
-                    "campaign_id": str(row.campaign.id) if hasattr(row.campaign, "id") else "",
-                    "campaign_name": row.campaign.name if hasattr(row.campaign, "name") else "",
-                    "date": str(row.segments.date) if hasattr(row.segments, "date") else "",
-                    "moeda": row.customer.currency_code if hasattr(row.customer, "currency_code") else "",
-                    "budget": budget,
-                    "spend": float(row.metrics.cost_micros / 1_000_000) if hasattr(row.metrics, "cost_micros") else 0.0,
-                    "clicks": int(row.metrics.clicks) if hasattr(row.metrics, "clicks") else 0,
-                    "cpc": float(row.metrics.average_cpc / 1_000_000) if hasattr(row.metrics, "average_cpc") else 0.0,
-                    "impressions": int(row.metrics.impressions) if hasattr(row.metrics, "impressions") else 0,
-                    "ctr": float(row.metrics.ctr) if hasattr(row.metrics, "ctr") else 0.0,
-                    "conversions": float(row.metrics.conversions) if hasattr(row.metrics, "conversions") else 0.0,
-                    "cost_per_conversion": float(row.metrics.cost_per_conversion / 1_000_000) if hasattr(row.metrics, "cost_per_conversion") else 0.0
-                })
+            for batch in stream:
+                data.extend(convert_rows(batch.results))
 
             logger.info(f"   ✅ Sucesso na tentativa {attempt}")
             return data
@@ -389,6 +413,7 @@ def get_google_ads_data(client, customer_id, max_retries=3):
             
             wait_time = 2 ** attempt
             logger.info(f"   ⏳ Aguardando {wait_time} segundos...")
+            record_sleep(wait_time)
             time.sleep(wait_time)
     
     return []
@@ -416,8 +441,7 @@ def save_to_bigquery(data):
 
     bq_client = get_bq_client()
     job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
-    job = bq_client.load_table_from_dataframe(df, BIGQUERY_TABLE_ID, job_config=job_config)
-    job.result()
+    load_to_bigquery(df, BIGQUERY_TABLE_ID, client=bq_client, job_config=job_config)
 
     logger.info("✅ Dados inseridos com sucesso no BigQuery!")
     logger.info(f"   📊 Registros inseridos: {len(df)}")
@@ -425,6 +449,7 @@ def save_to_bigquery(data):
 # ------------------------------------------------------------------------------
 # FUNÇÃO PRINCIPAL
 # ------------------------------------------------------------------------------
+@metered_run("cloud_googleads_beforeyesterday")
 def ca_google_ads_beforeyesterday(event=None, context=None):
     """
     Função principal para coleta de dados do Google Ads de ANTEONTEM.
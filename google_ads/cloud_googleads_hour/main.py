@@ -7,7 +7,7 @@ Coleta métricas horárias por campanha:
 - moeda, budget
 
 Resultado final = métricas por hora por campanha
-SOBRESCREVE os dados no BigQuery (WRITE_TRUNCATE)
+SOBRESCREVE os dados no BigQuery (WRITE_TRUNCATE da partição de hoje, tabela$AAAAMMDD)
 
 ⚠️ NOTAS SOBRE GRPC E GITHUB ACTIONS:
 ─────────────────────────────────────────────────────────────────
@@ -27,6 +27,7 @@ o script continua processando as outras contas e salva os dados que conseguiu co
 import json
 import time
 import os
+import sys
 from datetime import datetime, timedelta
 from google.oauth2 import service_account
 from google.ads.googleads.client import GoogleAdsClient
@@ -37,6 +38,12 @@ import logging
 from google.api_core import retry
 from google.api_core import exceptions as core_exceptions
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_tables import partitioned_table, replace_partitions  # noqa: E402
+from utils.profiling import profiled  # noqa: E402
+from utils.run_metrics import grpc_interceptor, metered_run, record_sleep  # noqa: E402
+
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
 # ------------------------------------------------------------------------------
@@ -55,6 +62,8 @@ logger = logging.getLogger(__name__)
 
 # 🔹 Configuração do BigQuery
 BIGQUERY_TABLE_ID = "data-v1-423414.test.cloud_googleads_hour"
+# Tabela particionada por dia em "date" e clusterizada por conta/campanha
+CLUSTER_FIELDS = ["account_id", "campaign_id"]
 sao_paulo_tz = pytz.timezone('America/Sao_Paulo')
 
 # Data de hoje em São Paulo
@@ -379,11 +388,8 @@ def check_table_exists():
         create_bigquery_table()
 
 def create_bigquery_table():
-    """Cria tabela no BigQuery."""
+    """Cria tabela no BigQuery (particionada por dia em date)."""
     bq_client = get_bq_client()
-    dataset_id, table_name = BIGQUERY_TABLE_ID.split(".")[1:]
-    dataset_ref = bq_client.dataset(dataset_id)
-    table_ref = dataset_ref.table(table_name)
 
     schema = [
         bigquery.SchemaField("account_name", "STRING"),
@@ -404,7 +410,7 @@ def create_bigquery_table():
         bigquery.SchemaField("imported_at", "TIMESTAMP")
     ]
 
-    table = bigquery.Table(table_ref, schema=schema)
+    table = partitioned_table(BIGQUERY_TABLE_ID, schema, "date", CLUSTER_FIELDS)
     try:
         bq_client.create_table(table)
         logger.info("✅ Tabela %s criada com sucesso.", BIGQUERY_TABLE_ID)
@@ -412,6 +418,47 @@ def create_bigquery_table():
     except Exception as e:
         logger.error("❌ Erro ao criar tabela: %s", e)
 
+def convert_rows(rows, imported_at):
+    """
+    Converte um lote de linhas do GoogleAdsService no formato da tabela.
+    
+    Args:
+        rows: Linhas (GoogleAdsRow) de um lote do search_stream
+        imported_at: Timestamp de importação (hora de São Paulo)
+    
+    Returns:
+        Lista de dicionários
+    """
+    data = []
+    for row in rows:
+        # ✅ Acesso seguro ao budget (pode não existir em algumas campanhas)
+        budget = 0.0
+        try:
+            if hasattr(row, "campaign_budget") and hasattr(row.campaign_budget, "amount_micros"):
+                budget = float(row.campaign_budget.amount_micros) / 1_000_000
+        except Exception:
+            pass
+
+        data.append({
+            "account_name": row.customer.descriptive_name if hasattr(row.customer, "descriptive_name") else "",
+            "account_id": str(row.customer.id) if hasattr(row.customer, "id") else "",
+            "campaign_id": str(row.campaign.id) if hasattr(row.campaign, "id") else "",
+            "campaign_name": row.campaign.name if hasattr(row.campaign, "name") else "",
+            "date": str(row.segments.date) if hasattr(row.segments, "date") else "",
+            "hour": int(row.segments.hour) if hasattr(row.segments, "hour") else 0,
+            "moeda": row.customer.currency_code if hasattr(row.customer, "currency_code") else "",
+            "budget": budget,
+            "spend": float(row.metrics.cost_micros / 1_000_000) if hasattr(row.metrics, "cost_micros") else 0.0,
+            "clicks": int(row.metrics.clicks) if hasattr(row.metrics, "clicks") else 0,
+            "cpc": float(row.metrics.average_cpc / 1_000_000) if hasattr(row.metrics, "average_cpc") else 0.0,
+            "impressions": int(row.metrics.impressions) if hasattr(row.metrics, "impressions") else 0,
+            "ctr": float(row.metrics.ctr) if hasattr(row.metrics, "ctr") else 0.0,
+            "conversions": float(row.metrics.conversions) if hasattr(row.metrics, "conversions") else 0.0,
+            "cost_per_conversion": float(row.metrics.cost_per_conversion / 1_000_000) if hasattr(row.metrics, "cost_per_conversion") else 0.0,
+            "imported_at": imported_at
+        })
+    return data
+
 def get_google_ads_data(client, customer_id, max_retries=3):
     """
     Busca dados do Google Ads para um customer_id com retry logic.
@@ -447,46 +494,24 @@ def get_google_ads_data(client, customer_id, max_retries=3):
         WHERE segments.date = '{hoje}'
     """
 
-    ga_service = client.get_service("GoogleAdsService")
+    ga_service = client.get_service("GoogleAdsService", interceptors=[grpc_interceptor()])
     
     # Retry logic com backoff exponencial
     for attempt in range(1, max_retries + 1):
         try:
             logger.info(f"   🔄 Tentativa {attempt}/{max_retries} para customer_id {customer_id}")
             
-            response = ga_service.search(customer_id=customer_id, query=query)
+            # search_stream: o relatório inteiro da conta num único stream (o search
+            # pagina no servidor, com uma ida e volta por página). Cada lote é convertido
+            # assim que chega, enquanto o gRPC segue recebendo os próximos
+            stream = ga_service.search_stream(customer_id=customer_id, query=query)
 
             data = []
             # Timestamp de importação (hora de São Paulo)
             imported_at = datetime.now(sao_paulo_tz)
             
-            for row in response:
-                # ✅ Acesso seguro ao budget (pode não existir em algumas campanhas)
-                budget = 0.0
-                try:
-                    if hasattr(row, "campaign_budget") and hasattr(row.campaign_budget, "amount_micros"):
-                        budget = float(row.campaign_budget.amount_micros) / 1_000_000
-                except Exception:
-                    pass
-                
-                data.append({
-                    "account_name": row.customer.descriptive_name if hasattr(row.customer, "descriptive_name") else "",
-                    "account_id": str(row.customer.id) if hasattr(row.customer, "id") else "",
-                    "campaign_id": str(row.campaign.id) if hasattr(row.campaign, "id") else "",
-                    "campaign_name": row.campaign.name if hasattr(row.campaign, "name") else "",
-                    "date": str(row.segments.date) if hasattr(row.segments, "date") else "",
-                    "hour": int(row.segments.hour) if hasattr(row.segments, "hour") else 0,
-                    "moeda": row.customer.currency_code if hasattr(row.customer, "currency_code") else "",
-                    "budget": budget,
-                    "spend": float(row.metrics.cost_micros / 1_000_000) if hasattr(row.metrics, "cost_micros") else 0.0,
-                    "clicks": int(row.metrics.clicks) if hasattr(row.metrics, "clicks") else 0,
-                    "cpc": float(row.metrics.average_cpc / 1_000_000) if hasattr(row.metrics, "average_cpc") else 0.0,
-                    "impressions": int(row.metrics.impressions) if hasattr(row.metrics, "impressions") else 0,
-                    "ctr": float(row.metrics.ctr) if hasattr(row.metrics, "ctr") else 0.0,
-                    "conversions": float(row.metrics.conversions) if hasattr(row.metrics, "conversions") else 0.0,
-                    "cost_per_conversion": float(row.metrics.cost_per_conversion / 1_000_000) if hasattr(row.metrics, "cost_per_conversion") else 0.0,
-                    "imported_at": imported_at
-                })
+            for batch in stream:
+                data.extend(convert_rows(batch.results, imported_at))
 
             logger.info(f"   ✅ Sucesso na tentativa {attempt}")
             return data
@@ -503,6 +528,7 @@ def get_google_ads_data(client, customer_id, max_retries=3):
             # Backoff exponencial: espera 2^attempt segundos (2, 4, 8...)
             wait_time = 2 ** attempt
             logger.info(f"   ⏳ Aguardando {wait_time} segundos antes da próxima tentativa...")
+            record_sleep(wait_time)
             time.sleep(wait_time)
     
     return []
@@ -553,11 +579,11 @@ def save_to_bigquery(data):
     for col in ['date', 'hour', 'imported_at']:
         logger.info(f"      - {col}: {df[col].dtype}")
 
-    # Enviar ao BigQuery (WRITE_TRUNCATE - sobrescreve dados existentes)
+    # Enviar ao BigQuery (WRITE_TRUNCATE só da partição de hoje; as demais
+    # partições são removidas, então a tabela continua com o dia corrente)
     bq_client = get_bq_client()
-    job_config = bigquery.LoadJobConfig(write_disposition="WRITE_TRUNCATE")
-    job = bq_client.load_table_from_dataframe(df, BIGQUERY_TABLE_ID, job_config=job_config)
-    job.result()
+    replace_partitions(df, BIGQUERY_TABLE_ID, schema=None, partition_field="date", clustering_fields=CLUSTER_FIELDS,
+                       days=[hoje], keep_only=True, client=bq_client)
 
     logger.info("✅ Dados inseridos com sucesso no BigQuery!")
     logger.info(f"   📋 Tabela: {BIGQUERY_TABLE_ID}")
@@ -566,6 +592,8 @@ def save_to_bigquery(data):
 # ------------------------------------------------------------------------------
 # FUNÇÃO PRINCIPAL
 # ------------------------------------------------------------------------------
+@metered_run("cloud_googleads_hour")
+@profiled()
 def ca_google_ads_today(event=None, context=None):
     """
     Função principal para coleta de dados do Google Ads.
@@ -22,6 +22,7 @@ Execução: GitHub Actions (diário)
 """
 
 import os
+import sys
 import logging
 import requests
 import pandas as pd
@@ -29,6 +30,11 @@ from datetime import datetime
 from pytz import timezone
 from google.cloud import bigquery
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run  # noqa: E402
+
 # ---- Logging ----
 logging.basicConfig(
     level=logging.INFO,
@@ -227,8 +233,7 @@ def upload_to_bigquery(df: pd.DataFrame, table_id: str):
 
     try:
         logger.info(f"Enviando {len(df)} registros para {table_id}...")
-        job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-        job.result()
+        job = load_to_bigquery(df, table_id, client=client, job_config=job_config)
         logger.info(f"{job.output_rows} registros salvos em {table_id}")
     except Exception as e:
         logger.error(f"Erro ao enviar dados para BigQuery: {e}")
@@ -268,6 +273,7 @@ def sync_accounts_pages():
         raise
 
 
+@metered_run("cloud_accounts_pages_helper")
 def main():
     """Função principal para execução via GitHub Actions."""
     logger.info("Iniciando Accounts Pages Helper (Supabase -> BigQuery)...")
@@ -282,6 +288,7 @@ def main():
 
 
 # === Entrypoint: CloudEvent de Pub/Sub (Gen2 / Cloud Run) ===
+@metered_run("cloud_accounts_pages_helper")
 def run_code(cloud_event):
     """
     Handler para Eventarc/Cloud Pub/Sub (CloudEvent).
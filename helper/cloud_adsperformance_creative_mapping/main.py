@@ -6,6 +6,7 @@ Usa REST API direto (requests) para evitar timeout do SDK supabase.
 """
 
 import os
+import sys
 import logging
 import requests
 import pandas as pd
@@ -13,6 +14,11 @@ from datetime import datetime
 from pytz import timezone
 from google.cloud import bigquery
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run  # noqa: E402
+
 logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
 logger = logging.getLogger(__name__)
 
@@ -77,11 +83,11 @@ def upload_to_bigquery(df):
         schema=SCHEMA,
     )
     logger.info(f"Enviando {len(df)} registros para {TABLE_ID}...")
-    job = client.load_table_from_dataframe(df, TABLE_ID, job_config=job_cfg)
-    job.result()
+    job = load_to_bigquery(df, TABLE_ID, client=client, job_config=job_cfg)
     logger.info(f"{job.output_rows} registros salvos em {TABLE_ID}")
 
 
+@metered_run("cloud_adsperformance_creative_mapping")
 def main():
     logger.info("Iniciando Creative Mapping Sync (Supabase -> BigQuery)...")
 
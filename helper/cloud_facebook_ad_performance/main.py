@@ -6,7 +6,7 @@ Busca spend/clicks/cpc por ad_id diário via Facebook Marketing API.
 Contas e tokens dinâmicos do Supabase (sem hardcode).
 Grava em: data-v1-423414.test.cloud_facebook_adsperformance_historical
 
-Write mode: DELETE range + WRITE_APPEND (dedup seguro).
+Write mode: MERGE por (date_start, ad_id) via tabela de staging (dedup seguro).
 
 Execução:
   - GitHub Actions (diário, 13:00 UTC / 10:00 BRT)
@@ -15,6 +15,7 @@ Execução:
 """
 
 import os
+import sys
 import json
 import logging
 import time
@@ -26,6 +27,11 @@ import requests
 from pytz import timezone
 from google.cloud import bigquery
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_upsert import upsert_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run, record_sleep  # noqa: E402
+
 # ------------------------------------------------------------------------------
 # CONFIGURAÇÕES
 # ------------------------------------------------------------------------------
@@ -51,6 +57,8 @@ BIGQUERY_PROJECT = "data-v1-423414"
 BIGQUERY_DATASET = "test"
 BIGQUERY_TABLE = "cloud_facebook_adsperformance_historical"
 TABLE_ID = f"{BIGQUERY_PROJECT}.{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
+# Natural key of a row: reruns update it instead of duplicating
+MERGE_KEYS = ["date_start", "ad_id"]
 
 # Lookback window (days) — default 1 = yesterday only
 LOOKBACK_DAYS = int(os.getenv("LOOKBACK_DAYS", "1"))
@@ -162,6 +170,7 @@ def fetch_ad_insights(account_id, token, currency, account_name, date_start, dat
             error = r.json().get("error", {})
             if error.get("code") == 17:  # Rate limit
                 logger.warning(f"Rate limited on {account_id}, waiting 120s...")
+                record_sleep(120, "rate_limit")
                 time.sleep(120)
                 continue
             logger.error(f"Facebook API error for {account_id}: {error.get('message', r.text[:200])}")
@@ -231,20 +240,8 @@ def process_data(all_rows):
     return df
 
 
-def delete_date_range(client, start_date, end_date):
-    """Delete existing rows in the date range before inserting new ones."""
-    query = f"""
-    DELETE FROM `{TABLE_ID}`
-    WHERE CAST(date_start AS DATE) BETWEEN '{start_date}' AND '{end_date}'
-    """
-    logger.info(f"Deleting existing data for {start_date} to {end_date}...")
-    job = client.query(query)
-    job.result()
-    logger.info(f"Deleted {job.num_dml_affected_rows} rows")
-
-
 def upload_to_bigquery(df, table_id):
-    """Upload DataFrame to BigQuery using DELETE+APPEND (dedup seguro)."""
+    """Upload DataFrame to BigQuery using MERGE on MERGE_KEYS (dedup seguro)."""
     if df is None or df.empty:
         logger.info("No data to upload")
         return
@@ -267,28 +264,19 @@ def upload_to_bigquery(df, table_id):
         bigquery.SchemaField("imported_at", "DATETIME"),
     ]
 
-    # Delete existing data in the range first
-    dates = df["date_start"].unique()
-    start = str(min(dates))[:10]
-    end = str(max(dates))[:10]
-    delete_date_range(client, start, end)
-
-    # Append new data (schema_update_options allows adding new columns like cpc, currency)
-    job_config = bigquery.LoadJobConfig(
-        write_disposition="WRITE_APPEND",
-        schema=schema,
-        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
-    )
-
+    # MERGE via staging table: reruns update rows instead of duplicating them,
+    # and only the date range of the data is scanned (new columns are added too)
     logger.info(f"Uploading {len(df)} rows to {table_id}...")
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-    job.result()
-    logger.info(f"Uploaded {job.output_rows} rows to {table_id}")
+    result = upsert_to_bigquery(df, table_id, keys=MERGE_KEYS, date_column="date_start", schema=schema,
+                                clustering_fields=["account_id", "ad_id"], client=client)
+    logger.info(f"Uploaded {result['rows']} rows to {table_id} "
+                f"({result['inserted']} inserted, {result['updated']} updated)")
 
 
 # ------------------------------------------------------------------------------
 # MAIN
 # ------------------------------------------------------------------------------
+@metered_run("cloud_facebook_ad_performance")
 def main():
     """Fetch ad-level performance from all accounts and upload to BigQuery."""
     logger.info("Starting Facebook Ad Performance sync (historical pipeline)...")
@@ -339,6 +327,7 @@ def main():
     logger.info("Facebook Ad Performance sync completed!")
 
 
+@metered_run("cloud_facebook_ad_performance")
 def run_code(cloud_event=None):
     """Cloud Function entrypoint."""
     main()
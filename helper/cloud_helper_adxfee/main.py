@@ -1,10 +1,16 @@
 import os
+import sys
 import json
 import logging
 import pandas as pd
 from google.cloud import bigquery
 from google.oauth2.service_account import Credentials
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run  # noqa: E402
+
 # ---- Logging ----
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -140,11 +146,11 @@ def upload_to_bigquery(df, table_id, client):
             bigquery.SchemaField("imported_at", "TIMESTAMP"),
         ],
     )
-    job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-    job.result()
+    job = load_to_bigquery(df, table_id, client=client, job_config=job_config)
     logger.info(f"BQ loaded {job.output_rows} rows into {table_id}")
 
 # === Entrypoint: CloudEvent de Pub/Sub (Gen2 / Cloud Run) ===
+@metered_run("cloud_helper_adxfee")
 def run_code(cloud_event):
     """
     Handler para Eventarc/Cloud Pub/Sub (CloudEvent).
@@ -170,6 +176,7 @@ def run_code(cloud_event):
 
 
 # === Execução local / GitHub Actions ===
+@metered_run("cloud_helper_adxfee")
 def main():
     """Função principal para execução local ou GitHub Actions."""
     try:
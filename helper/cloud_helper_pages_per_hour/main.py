@@ -13,6 +13,7 @@ SUBSTITUI os dados no BigQuery (WRITE_TRUNCATE) para manter sincronizado
 """
 
 import os
+import sys
 import logging
 import pandas as pd
 from datetime import datetime
@@ -20,6 +21,11 @@ from pytz import timezone
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+# Pacote compartilhado utils/ na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.bq_load import load_to_bigquery  # noqa: E402
+from utils.run_metrics import metered_run  # noqa: E402
+
 # Google Sheets
 try:
     import gspread
@@ -60,7 +66,6 @@ def get_bq_client():
     if bq_client is None:
         try:
             from google.cloud import bigquery
-            from google.oauth2 import service_account
             
             # Verificar se estamos no GitHub Actions (variável de ambiente GOOGLE_APPLICATION_CREDENTIALS)
             if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
@@ -199,8 +204,7 @@ def upload_to_bigquery(df: pd.DataFrame, table_id: str):
     
     try:
         logger.info(f"📤 Enviando {len(df)} registros para {table_id}...")
-        job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_cfg)
-        job.result()
+        job = load_to_bigquery(df, table_id, client=bq_client, job_config=job_cfg)
         logger.info(f"✅ {job.output_rows} registros salvos em {table_id}")
     except Exception as e:
         logger.error(f"❌ Erro ao adicionar dados ao BigQuery: {e}")
@@ -244,6 +248,7 @@ def sync_pages_per_hour():
         logger.error(f"❌ Erro durante sincronização: {e}")
         raise
 
+@metered_run("cloud_helper_pages_per_hour")
 def main():
     """
     Função principal para execução via GitHub Actions.
@@ -87,6 +87,9 @@ def main():
             if workflow.startswith("_"):
                 continue
 
+            if not settings.get("enabled", True):
+                continue
+
             run = False
             job_type = settings.get("type")
 
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Utilitários compartilhados entre as funções do repositório.
+
+Os scripts rodam a partir da própria pasta (``working-directory`` nos
+workflows), então cada ``main.py`` adiciona a raiz do repositório ao
+``sys.path`` antes de importar deste pacote.
+"""
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Verificação de acesso às contas com uma requisição por token
+─────────────────────────────────────────────────────────────
+O ``verify_account_access`` dos scripts fazia um GET ``/act_X?fields=id,name``
+por conta, em sequência, para cada grupo e a cada execução horária — antes
+de qualquer trabalho útil. Aqui as contas de um token são consultadas de uma
+vez com ``?ids=act_1,act_2,...`` e o resultado fica em cache por token
+(``utils.state``), valendo por ``ACCOUNT_ACCESS_TTL`` segundos.
+
+Quando alguma conta do lote não é acessível a Graph API recusa a requisição
+inteira; o lote é então dividido ao meio até isolar as contas sem acesso.
+Erros transitórios (rate limit, 5xx) não contam como recusa: as contas do
+lote seguem com os últimos dados conhecidos e são verificadas de novo na
+próxima execução.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from utils.graph_api import ERROR_AUTH, ERROR_REDUCE_DATA, GRAPH_BATCH_SIZE, RETRYABLE_ERRORS, GraphAPIError
+from utils.rate_limit import token_key
+from utils.state import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Campos lidos de cada conta
+ACCOUNT_FIELDS = "id,name,account_status,currency,timezone_name"
+# Validade do cache de contas acessíveis (segundos). Contas sem acesso são
+# consultadas de novo em toda execução
+ACCOUNT_ACCESS_TTL = int(os.getenv("ACCOUNT_ACCESS_TTL", "21600"))
+# Máximo de ids por requisição (limite da Graph API)
+ACCOUNT_IDS_PER_REQUEST = GRAPH_BATCH_SIZE
+# Arquivo de cache em FUNCTIONS_STATE_DIR
+ACCOUNT_ACCESS_FILE = "account_access.json"
+
+# account_status da Graph API: 1 = ativa; as demais (desativada, em análise,
+# pendente de pagamento...) continuam legíveis, mas ficam registradas no log
+ACCOUNT_STATUS_ACTIVE = 1
+
+
+class TokenInvalidError(Exception):
+    """O token foi recusado pela Graph API (401 / código 190)."""
+
+
+class AccountAccessCache:
+    """Dados das contas por token, com validade, persistidos entre execuções."""
+
+    def __init__(self, ttl: int = ACCOUNT_ACCESS_TTL, filename: str = ACCOUNT_ACCESS_FILE):
+        self.ttl = ttl
+        self.filename = filename
+        self._entries = load_json(filename, default={}) or {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str, account_id: str, now: float | None = None) -> dict | None:
+        """Dados da conta se ainda válidos no cache; None caso contrário."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(token_key(token), {}).get(account_id)
+        if entry and now - entry.get("checked_at", 0) < self.ttl:
+            return entry["account"]
+        return None
+
+    def last_known(self, token: str, account_id: str) -> dict | None:
+        """Últimos dados gravados da conta, mesmo vencidos; None se nunca foi vista."""
+        with self._lock:
+            entry = self._entries.get(token_key(token), {}).get(account_id)
+        return entry["account"] if entry else None
+
+    def update(self, token: str, accounts: dict, now: float | None = None) -> None:
+        """Grava as contas acessíveis (``{account_id: dados}``) do token."""
+        if not accounts:
+            return
+        now = now or time.time()
+        with self._lock:
+            entries = self._entries.setdefault(token_key(token), {})
+            for account_id, account in accounts.items():
+                entries[account_id] = {"checked_at": now, "account": account}
+            # Descarta o que já venceu para o arquivo não crescer sem limite
+            for key in list(self._entries):
+                self._entries[key] = {acc: e for acc, e in self._entries[key].items()
+                                      if now - e.get("checked_at", 0) < self.ttl}
+                if not self._entries[key]:
+                    del self._entries[key]
+            snapshot = {key: dict(value) for key, value in self._entries.items()}
+        save_json(self.filename, snapshot)
+
+
+def _lookup(client, account_ids: list, token: str, context: str) -> tuple:
+    """Consulta ``account_ids`` com ``?ids=``; divide o lote ao meio quando recusado.
+
+    Returns:
+        (acessíveis, recusadas): ``{conta: dados}`` e ``{conta: erro}``
+
+    Raises:
+        TokenInvalidError: token recusado
+        GraphAPIError: erro transitório (``RETRYABLE_ERRORS``) depois das tentativas do cliente
+    """
+    params = {"access_token": token, "ids": ",".join(account_ids), "fields": ACCOUNT_FIELDS}
+    try:
+        data = client.request("GET", "", params=params, retries=3, context=context) or {}
+    except GraphAPIError as e:
+        if e.kind == ERROR_AUTH:
+            raise TokenInvalidError(str(e)) from e
+        if e.kind in RETRYABLE_ERRORS and not (e.kind == ERROR_REDUCE_DATA and len(account_ids) > 1):
+            # Rate limit / 5xx não dizem nada sobre o acesso: não recusa (e "reduce
+            # the amount of data" só divide o lote)
+            raise
+        if len(account_ids) == 1:
+            return {}, {acc: e for acc in account_ids}
+        middle = len(account_ids) // 2
+        left_ok, left_denied = _lookup(client, account_ids[:middle], token, context)
+        right_ok, right_denied = _lookup(client, account_ids[middle:], token, context)
+        return {**left_ok, **right_ok}, {**left_denied, **right_denied}
+
+    accessible = {acc: data[acc] for acc in account_ids if isinstance(data.get(acc), dict)}
+    denied = {acc: "não retornada" for acc in account_ids if acc not in accessible}
+    return accessible, denied
+
+
+def lookup_accounts(client, account_ids: list, token: str, cache: AccountAccessCache | None = None,
+                    context: str = "") -> tuple:
+    """Dados das contas acessíveis pelo token, com uma requisição por lote de 50.
+
+    Contas válidas no cache não são consultadas de novo. Se um lote falha por
+    erro transitório, as contas dele seguem como acessíveis com os últimos
+    dados conhecidos (sem atualizar o cache).
+
+    Returns:
+        (acessíveis, recusadas): ``{conta: dados}`` e ``{conta: erro}``
+
+    Raises:
+        TokenInvalidError: token recusado pela Graph API
+    """
+    cache = cache or get_account_access_cache()
+    now = time.time()
+    accessible, denied = {}, {}
+    pending = []
+    for account_id in dict.fromkeys(account_ids):
+        cached = cache.get(token, account_id, now)
+        if cached is not None:
+            accessible[account_id] = cached
+        else:
+            pending.append(account_id)
+
+    if pending:
+        logger.info("🔎 [%s] Consultando %s contas (%s em cache)", context or token_key(token),
+                    len(pending), len(accessible))
+        fetched = {}
+        unverified = {}
+        for i in range(0, len(pending), ACCOUNT_IDS_PER_REQUEST):
+            batch = pending[i:i + ACCOUNT_IDS_PER_REQUEST]
+            try:
+                ok, refused = _lookup(client, batch, token, context)
+            except GraphAPIError as e:
+                if e.kind not in RETRYABLE_ERRORS:
+                    raise
+                logger.warning("⚠️ [%s] Erro transitório (%s) ao verificar %s contas – seguindo com os "
+                               "últimos dados conhecidos", context or token_key(token), e.kind, len(batch))
+                unverified.update({acc: cache.last_known(token, acc) or {"id": acc} for acc in batch})
+                continue
+            fetched.update(ok)
+            denied.update(refused)
+        cache.update(token, fetched, now)
+        accessible.update(fetched)
+        accessible.update(unverified)
+
+    return accessible, denied
+
+
+def verify_accounts(client, accounts: list, token: str, group_name: str) -> list:
+    """Verifica o token e as contas de um grupo e registra o resumo no log.
+
+    Returns:
+        Contas acessíveis, na ordem original (lista vazia = token inválido ou
+        nenhuma conta com acesso)
+    """
+    logger.info("Verificando acesso para o grupo: %s", group_name)
+    if not accounts:
+        return []
+
+    try:
+        accessible, denied = lookup_accounts(client, accounts, token, context=group_name)
+    except TokenInvalidError as e:
+        logger.error("❌ TOKEN INVÁLIDO para o grupo %s: %s", group_name, e)
+        return []
+
+    for account_id, error in denied.items():
+        logger.warning("⚠️ Sem acesso à conta %s no grupo %s: %s", account_id, group_name, error)
+    for account_id, account in accessible.items():
+        status = account.get("account_status")
+        if status is not None and status != ACCOUNT_STATUS_ACTIVE:
+            logger.warning("⚠️ Conta %s (%s) no grupo %s com account_status=%s",
+                           account_id, account.get("name", ""), group_name, status)
+
+    logger.info("📊 Resumo de acesso para grupo %s:", group_name)
+    logger.info("   ✅ Contas acessíveis: %s/%s", len(accessible), len(accounts))
+    logger.info("   ❌ Contas inacessíveis: %s/%s", len(denied), len(accounts))
+    if denied:
+        logger.warning("   📋 Contas inacessíveis: %s", sorted(denied))
+
+    return [acc for acc in accounts if acc in accessible]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_account_access_cache() -> AccountAccessCache:
+    """Cache compartilhado por todas as threads do processo."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AccountAccessCache()
+        return _cache
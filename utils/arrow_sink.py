@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Gravação em streaming de uma tabela em Parquet local
+─────────────────────────────────────────────────────
+As linhas de cada conta iam de ``acc_rows`` para ``rows``, depois para um
+DataFrame por grupo e, no fim, para um ``pd.concat`` de todos os grupos: o pico
+de memória era várias cópias do conjunto inteiro.
+
+Com o ``ArrowTableSink`` cada conta, assim que termina, vira um
+``pyarrow.RecordBatch`` já com os tipos do schema (``utils.schemas``). Os
+batches são acumulados até ``ARROW_BATCH_ROWS`` linhas e gravados como um row
+group de um arquivo Parquet temporário, que no fim vai direto para o load do
+BigQuery. A memória fica limitada ao batch em aberto mais as contas em
+andamento, e não cresce com o número de contas.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import pytz
+
+from utils.schemas import TableSchema
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Linhas acumuladas antes de gravar um row group no Parquet
+ARROW_BATCH_ROWS = int(os.getenv("ARROW_BATCH_ROWS", "50000"))
+
+
+class ArrowTableSink:
+    """Recebe DataFrames/RecordBatches de uma tabela e grava em Parquet por row group.
+
+    Uso::
+
+        sink = ArrowTableSink(FACEBOOK_ADS_PERFORMANCE)
+        sink.write_frame(df_conta)      # de várias threads
+        path = sink.close()             # None se nenhuma linha foi gravada
+    """
+
+    def __init__(self, schema: TableSchema, batch_rows: int = ARROW_BATCH_ROWS, directory: str | None = None):
+        """
+        Args:
+            schema: Schema da tabela; todo batch é convertido para ele
+            batch_rows: Linhas por row group
+            directory: Pasta do arquivo temporário (None = padrão do sistema)
+        """
+        self.schema = schema
+        self.arrow_schema = schema.arrow_schema()
+        self.batch_rows = max(1, batch_rows)
+        # imported_at único para todas as linhas da execução
+        self.imported_at = datetime.now(pytz.timezone("America/Sao_Paulo")).strftime("%Y-%m-%d %H:%M:%S")
+
+        fd, self.path = tempfile.mkstemp(prefix=f"{schema.name}_", suffix=".parquet", dir=directory)
+        os.close(fd)
+        self.num_rows = 0
+        self.row_groups = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def batch_from_frame(self, df):
+        """Converte ``df`` para o schema da tabela e devolve um ``RecordBatch``."""
+        import pyarrow as pa
+
+        return pa.RecordBatch.from_pandas(self.schema.coerce(df), schema=self.arrow_schema, preserve_index=False)
+
+    def write_frame(self, df) -> int:
+        """Grava as linhas de ``df`` (convertidas para o schema); devolve quantas."""
+        if df is None or df.empty:
+            return 0
+        return self.write_batch(self.batch_from_frame(df))
+
+    def write_batch(self, batch) -> int:
+        """Acrescenta um ``RecordBatch`` no schema da tabela; devolve o número de linhas."""
+        if batch.num_rows == 0:
+            return 0
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Sink {self.schema.name} já foi fechado")
+            self._pending.append(batch)
+            self._pending_rows += batch.num_rows
+            self.num_rows += batch.num_rows
+            if self._pending_rows >= self.batch_rows:
+                self._flush()
+        return batch.num_rows
+
+    def _flush(self) -> None:
+        """Grava os batches pendentes como um row group (chamado com o lock)."""
+        if not self._pending:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self.arrow_schema, compression="snappy")
+        table = pa.Table.from_batches(self._pending, schema=self.arrow_schema)
+        self._writer.write_table(table, row_group_size=max(self.batch_rows, table.num_rows))
+        self.row_groups += 1
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self) -> str | None:
+        """Grava o que falta e fecha o arquivo.
+
+        Returns:
+            Caminho do Parquet, ou None se nenhuma linha foi gravada
+        """
+        with self._lock:
+            if not self._closed:
+                self._flush()
+                if self._writer is not None:
+                    self._writer.close()
+                self._closed = True
+        if self.num_rows == 0:
+            return None
+        logger.info("📦 %s: %s linhas em %s row groups (%.1f MB) → %s", self.schema.name, self.num_rows,
+                    self.row_groups, os.path.getsize(self.path) / 1e6, self.path)
+        return self.path
+
+    def discard(self) -> None:
+        """Fecha (se preciso) e apaga o arquivo temporário."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Carga no BigQuery via Parquet
+──────────────────────────────
+Os ``upload_to_bigquery`` dos scripts usavam ``load_table_from_dataframe`` com
+a serialização padrão, e os scripts de GAM ``load_table_from_json``, que
+transforma cada linha em texto JSON. Cada script também criava o próprio
+``bigquery.Client`` (alguns, um por chamada).
+
+Aqui toda carga passa por ``load_to_bigquery``:
+
+- os dados (DataFrame, lista de dicts, ``pyarrow.Table`` ou um arquivo
+  Parquet já gravado) viram uma ``pyarrow.Table`` com os tipos do schema do
+  BigQuery
+- a tabela é gravada num buffer Parquet em memória, comprimido
+  (``BQ_PARQUET_COMPRESSION``), e enviada com ``source_format=PARQUET``
+- o cliente é único por projeto (``get_bq_client``)
+- cada carga registra linhas, bytes enviados e tempo de serialização e de
+  load; ``load_totals()`` soma tudo da execução, e cada uma vira um span
+  ``bigquery.load`` (``utils.tracing``)
+"""
+
+import io
+import os
+import time
+import logging
+import threading
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Compressão do Parquet enviado (zstd, snappy, gzip ou none)
+BQ_PARQUET_COMPRESSION = os.getenv("BQ_PARQUET_COMPRESSION", "zstd").lower()
+
+
+# ------------------------------------------------------------------------------
+# CLIENTE
+# ------------------------------------------------------------------------------
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_bq_client(project: str | None = None, credentials=None):
+    """``bigquery.Client`` compartilhado pelo processo (um por projeto).
+
+    As credenciais valem só na primeira chamada de cada projeto.
+    """
+    from google.cloud import bigquery
+
+    with _clients_lock:
+        client = _clients.get(project)
+        if client is None:
+            kwargs = {}
+            if project:
+                kwargs["project"] = project
+            if credentials is not None:
+                kwargs["credentials"] = credentials
+            client = bigquery.Client(**kwargs)
+            _clients[project] = client
+        return client
+
+
+# ------------------------------------------------------------------------------
+# CONVERSÃO PARA ARROW
+# ------------------------------------------------------------------------------
+def _arrow_type(bq_type: str):
+    import pyarrow as pa
+
+    return {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "INT64": pa.int64(),
+        "FLOAT": pa.float64(),
+        "FLOAT64": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "BOOL": pa.bool_(),
+        "DATE": pa.date32(),
+        "DATETIME": pa.timestamp("us"),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    }[bq_type.upper()]
+
+
+def arrow_schema(bq_schema: list):
+    """``pyarrow.Schema`` equivalente a uma lista de ``bigquery.SchemaField``."""
+    import pyarrow as pa
+
+    return pa.schema([pa.field(f.name, _arrow_type(f.field_type)) for f in bq_schema])
+
+
+def bigquery_type(arrow_type) -> str:
+    """Tipo do BigQuery para uma coluna sem schema declarado, a partir do tipo Arrow."""
+    import pyarrow as pa
+
+    if pa.types.is_boolean(arrow_type):
+        return "BOOLEAN"
+    if pa.types.is_integer(arrow_type):
+        return "INTEGER"
+    if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return "FLOAT"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP" if arrow_type.tz else "DATETIME"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    return "STRING"
+
+
+def _to_array(values, arrow_type):
+    """Converte uma coluna (Series ou lista) para ``arrow_type``.
+
+    Segue as mesmas regras do ``load_table_from_dataframe``: datas com fuso
+    gravadas em DATETIME ficam em UTC; texto sem fuso em TIMESTAMP é UTC.
+    """
+    import pyarrow as pa
+
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        # Coluna com tipos misturados (ex: números e textos): passa por texto
+        array = pa.array([None if v is None or v != v else str(v) for v in values], type=pa.string())
+    if array.type == arrow_type:
+        return array
+    try:
+        return array.cast(arrow_type, safe=False)
+    except pa.ArrowInvalid:
+        if not (pa.types.is_timestamp(arrow_type) and pa.types.is_string(array.type)):
+            raise
+        # Texto com e sem fuso na mesma coluna: o pandas interpreta valor a valor
+        import pandas as pd
+
+        parsed = pd.to_datetime(array.to_pandas(), format="mixed", utc=True, errors="coerce")
+        if not arrow_type.tz:
+            parsed = parsed.dt.tz_localize(None)
+        return pa.array(parsed, from_pandas=True).cast(arrow_type, safe=False)
+
+
+def to_arrow_table(data, schema: list | None = None):
+    """``pyarrow.Table`` com os tipos de ``schema`` (lista de ``bigquery.SchemaField``).
+
+    Args:
+        data: DataFrame, lista de dicts, ``pyarrow.Table`` ou ``RecordBatch``
+        schema: Colunas do schema saem na ordem e no tipo declarados; as demais
+            colunas seguem no final com o tipo inferido. None = só inferência
+    """
+    import pyarrow as pa
+
+    if isinstance(data, pa.RecordBatch):
+        data = pa.Table.from_batches([data])
+    if isinstance(data, pa.Table):
+        if not schema:
+            return data
+        columns = {name: data.column(name) for name in data.column_names}
+    elif isinstance(data, list):
+        names = list(dict.fromkeys(key for row in data for key in row))
+        columns = {name: [row.get(name) for row in data] for name in names}
+        num_rows = len(data)
+    else:
+        columns = {str(name): data[name] for name in data.columns}
+        num_rows = len(data)
+
+    arrays, fields = [], []
+    declared = {}
+    for field in schema or []:
+        declared[field.name] = _arrow_type(field.field_type)
+    for name, arrow_type in declared.items():
+        if name in columns:
+            values = columns[name]
+            if isinstance(values, (pa.Array, pa.ChunkedArray)):
+                array = values if values.type == arrow_type else values.cast(arrow_type, safe=False)
+            else:
+                array = _to_array(values, arrow_type)
+        else:
+            length = data.num_rows if isinstance(data, pa.Table) else num_rows
+            array = pa.nulls(length, type=arrow_type)
+        arrays.append(array)
+        fields.append(pa.field(name, arrow_type))
+    for name, values in columns.items():
+        if name in declared:
+            continue
+        array = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values, from_pandas=True)
+        arrays.append(array)
+        fields.append(pa.field(name, array.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+# ------------------------------------------------------------------------------
+# CARGA
+# ------------------------------------------------------------------------------
+_totals = {"loads": 0, "rows": 0, "bytes": 0, "serialize_seconds": 0.0, "load_seconds": 0.0}
+_totals_lock = threading.Lock()
+
+
+def load_totals() -> dict:
+    """Soma das cargas feitas pelo processo (loads, rows, bytes, serialize_seconds, load_seconds)."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def _parquet_buffer(table) -> io.BytesIO:
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    compression = None if BQ_PARQUET_COMPRESSION == "none" else BQ_PARQUET_COMPRESSION
+    pq.write_table(table, buffer, compression=compression)
+    buffer.seek(0)
+    return buffer
+
+
+def _column_names(data) -> set:
+    if isinstance(data, list):
+        return {key for row in data for key in row}
+    if hasattr(data, "column_names"):
+        return set(data.column_names)
+    return {str(name) for name in data.columns}
+
+
+def _destination_schema(client, table_id: str) -> list:
+    """Schema atual da tabela de destino (lista vazia se ela ainda não existe)."""
+    from google.api_core.exceptions import NotFound
+
+    try:
+        return list(client.get_table(table_id).schema)
+    except NotFound:
+        return []
+
+
+def add_columns(client, table_id: str, fields: list) -> list:
+    """Acrescenta à tabela as colunas de ``fields`` que ela ainda não tem.
+
+    Returns:
+        Schema completo da tabela depois da alteração
+    """
+    destination = client.get_table(table_id)
+    known = {f.name for f in destination.schema}
+    new_fields = [f for f in fields if f.name not in known]
+    if not new_fields:
+        return list(destination.schema)
+    destination.schema = list(destination.schema) + new_fields
+    client.update_table(destination, ["schema"])
+    logger.info("🧩 %s: colunas novas %s", table_id, [f.name for f in new_fields])
+    return list(destination.schema)
+
+
+def load_to_bigquery(data, table_id: str, schema: list | None = None, write_disposition: str = "WRITE_APPEND",
+                     client=None, job_config=None, schema_update_options: list | None = None):
+    """Carrega ``data`` em ``table_id`` via Parquet e espera o job terminar.
+
+    Args:
+        data: DataFrame, lista de dicts, ``pyarrow.Table``/``RecordBatch`` ou
+            caminho de um arquivo Parquet
+        schema: Lista de ``bigquery.SchemaField`` (também define os tipos do Parquet)
+        write_disposition: WRITE_APPEND / WRITE_TRUNCATE / WRITE_EMPTY
+        client: ``bigquery.Client``; None = ``get_bq_client()``
+        job_config: ``LoadJobConfig`` base (tem precedência sobre ``schema`` e
+            ``write_disposition``); o formato é sempre PARQUET
+        schema_update_options: ex: ``[SchemaUpdateOption.ALLOW_FIELD_ADDITION]``
+
+    Returns:
+        ``LoadJob`` concluído (``job.output_rows``)
+    """
+    from google.cloud import bigquery
+
+    client = client or get_bq_client()
+    if job_config is None:
+        job_config = bigquery.LoadJobConfig(write_disposition=write_disposition)
+        if schema:
+            job_config.schema = schema
+    schema = job_config.schema or schema
+    if not schema and not isinstance(data, str):
+        # Como o load_table_from_dataframe: sem schema explícito, os tipos das
+        # colunas que já existem na tabela de destino são mantidos
+        names = _column_names(data)
+        schema = [f for f in _destination_schema(client, table_id) if f.name in names]
+    job_config.source_format = bigquery.SourceFormat.PARQUET
+    if schema_update_options:
+        job_config.schema_update_options = schema_update_options
+
+    with span("bigquery.load", table=table_id, disposition=job_config.write_disposition) as current:
+        start = time.perf_counter()
+        if isinstance(data, str):
+            source = open(data, "rb")
+            num_rows = None
+        else:
+            table = to_arrow_table(data, schema)
+            num_rows = table.num_rows
+            source = _parquet_buffer(table)
+            del table
+        serialize_seconds = time.perf_counter() - start
+        size = os.fstat(source.fileno()).st_size if isinstance(data, str) else source.getbuffer().nbytes
+
+        try:
+            start = time.perf_counter()
+            job = client.load_table_from_file(source, table_id, job_config=job_config, rewind=True)
+            job.result()
+            load_seconds = time.perf_counter() - start
+        finally:
+            source.close()
+
+        rows = job.output_rows if num_rows is None else num_rows
+        current.set_attribute("rows", rows)
+        current.set_attribute("bytes", size)
+        current.set_attribute("serialize_ms", round(serialize_seconds * 1000, 1))
+        current.set_attribute("job_id", getattr(job, "job_id", None))
+
+    with _totals_lock:
+        _totals["loads"] += 1
+        _totals["rows"] += rows or 0
+        _totals["bytes"] += size
+        _totals["serialize_seconds"] += serialize_seconds
+        _totals["load_seconds"] += load_seconds
+    logger.info("📤 %s: %s linhas, %.1f KB em Parquet (%s), serialização %.3fs, load %.2fs",
+                table_id, rows, size / 1024, BQ_PARQUET_COMPRESSION, serialize_seconds, load_seconds)
+    return job
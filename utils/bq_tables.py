@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Tabelas particionadas por dia e substituição por partição
+──────────────────────────────────────────────────────────
+As tabelas eram criadas sem partição (``create_bigquery_table``,
+``create_gam_table`` ou implicitamente pelo primeiro load). "Substituir os
+dados de hoje" era um WRITE_TRUNCATE da tabela inteira (``cloud_facebook_today``,
+``cloud_googleads_hour``), e as consultas de baixo sempre liam a tabela toda.
+
+Aqui:
+
+- ``partitioned_table`` / ``ensure_table`` montam (e criam, se preciso) a
+  tabela particionada por dia numa coluna de data e clusterizada por conta,
+  campanha ou site
+- ``replace_partitions`` grava cada dia dos dados em ``tabela$AAAAMMDD`` com
+  WRITE_TRUNCATE: reescrever um dia custa só a partição dele, e rodar de novo
+  não duplica
+- ``keep_only=True`` apaga as demais partições, para tabelas que guardam só o
+  dia corrente (ex: ``cloud_facebook_today_ca``)
+
+Tabelas antigas, criadas sem partição, não podem receber decorador de
+partição: nelas o load cai no ``fallback_disposition`` de antes e o log mostra
+o SQL para recriar a tabela particionada.
+"""
+
+import logging
+from datetime import date, datetime
+
+from utils.bq_load import get_bq_client, load_to_bigquery, to_arrow_table
+from utils.tracing import current_span, traced
+
+logger = logging.getLogger(__name__)
+
+# Partições que não são dias (linhas com data nula / sem partição)
+_SPECIAL_PARTITIONS = {"__NULL__", "__UNPARTITIONED__"}
+
+
+def partitioned_table(table_id: str, schema: list, partition_field: str, clustering_fields: list | None = None,
+                      partition_expiration_days: int | None = None):
+    """``bigquery.Table`` particionada por dia em ``partition_field`` (DATE/DATETIME/TIMESTAMP)."""
+    from google.cloud import bigquery
+
+    table = bigquery.Table(table_id, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field=partition_field,
+        expiration_ms=partition_expiration_days * 86_400_000 if partition_expiration_days else None,
+    )
+    if clustering_fields:
+        table.clustering_fields = list(clustering_fields)
+    return table
+
+
+def is_partitioned_by(table, partition_field: str) -> bool:
+    """True se ``table`` é particionada por dia em ``partition_field``."""
+    partitioning = table.time_partitioning
+    return bool(partitioning) and partitioning.field == partition_field and partitioning.type_ == "DAY"
+
+
+def _recreate_hint(table_id: str, partition_field: str, clustering_fields: list | None) -> str:
+    cluster = f" CLUSTER BY {', '.join(clustering_fields)}" if clustering_fields else ""
+    return (f"CREATE OR REPLACE TABLE `{table_id}` PARTITION BY DATE({partition_field}){cluster} "
+            f"AS SELECT * FROM `{table_id}`")
+
+
+def ensure_table(table_id: str, schema: list, partition_field: str, clustering_fields: list | None = None,
+                 client=None, partition_expiration_days: int | None = None):
+    """Devolve a tabela, criando-a particionada e clusterizada se ainda não existir.
+
+    Uma tabela já existente sem a partição esperada é devolvida como está,
+    com um aviso no log.
+    """
+    from google.api_core.exceptions import NotFound
+
+    client = client or get_bq_client()
+    try:
+        table = client.get_table(table_id)
+    except NotFound:
+        table = client.create_table(
+            partitioned_table(table_id, schema, partition_field, clustering_fields, partition_expiration_days),
+            exists_ok=True,
+        )
+        logger.info("🆕 Tabela %s criada (partição diária em %s, cluster %s)",
+                    table_id, partition_field, clustering_fields or "-")
+        return table
+    if not is_partitioned_by(table, partition_field):
+        logger.warning("⚠️ %s não é particionada por %s; para migrar: %s",
+                       table_id, partition_field, _recreate_hint(table_id, partition_field, clustering_fields))
+    return table
+
+
+def partition_decorator(table_id: str, day) -> str:
+    """``tabela$AAAAMMDD`` do dia ``day`` (date, datetime ou "AAAA-MM-DD")."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    elif isinstance(day, datetime):
+        day = day.date()
+    return f"{table_id}${day:%Y%m%d}"
+
+
+def _split_by_day(table, partition_field: str):
+    """{date: pyarrow.Table} com as linhas de cada dia, mais a tabela das linhas sem data."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    column = table.column(partition_field)
+    days = column if pa.types.is_date(column.type) else column.cast(pa.date32(), safe=False)
+    parts = {}
+    for day in pc.unique(days).to_pylist():
+        if day is not None:
+            parts[day] = table.filter(pc.equal(days, pa.scalar(day, type=pa.date32())))
+    return parts, table.filter(pc.is_null(days))
+
+
+@traced("bigquery.replace_partitions")
+def replace_partitions(data, table_id: str, schema: list, partition_field: str,
+                       clustering_fields: list | None = None, days: list | None = None, keep_only: bool = False,
+                       fallback_disposition: str = "WRITE_TRUNCATE", client=None) -> dict:
+    """Substitui, dia a dia, as partições de ``table_id`` pelas linhas de ``data``.
+
+    Args:
+        data: DataFrame, lista de dicts ou ``pyarrow.Table``
+        table_id: "projeto.dataset.tabela"
+        schema: Lista de ``bigquery.SchemaField`` (também cria a tabela); None =
+            schema da tabela existente
+        partition_field: Coluna de data da partição
+        clustering_fields: Colunas de cluster na criação da tabela
+        days: Dias a substituir mesmo sem linhas (a partição fica vazia); os
+            dias presentes nos dados entram sempre
+        keep_only: Apaga as partições que não foram escritas nesta chamada
+        fallback_disposition: Disposição do load único quando a tabela
+            existente não é particionada (o comportamento anterior do script)
+        client: ``bigquery.Client``; None = ``get_bq_client()``
+
+    Returns:
+        {"rows", "partitions"}
+    """
+    from google.cloud import bigquery
+
+    client = client or get_bq_client()
+    current_span().set_attribute("table", table_id)
+    destination = ensure_table(table_id, schema, partition_field, clustering_fields, client=client)
+    schema = schema or list(destination.schema)
+    table = to_arrow_table(data, schema)
+
+    if not is_partitioned_by(destination, partition_field):
+        load_to_bigquery(table, table_id, schema=schema, write_disposition=fallback_disposition, client=client)
+        return {"rows": table.num_rows, "partitions": []}
+
+    parts, undated = _split_by_day(table, partition_field)
+    for day in days or []:
+        day = date.fromisoformat(day[:10]) if isinstance(day, str) else day
+        parts.setdefault(day, table.slice(0, 0))
+
+    # Colunas novas no schema precisam ser liberadas também em loads de partição
+    field_addition = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+    for day, part in sorted(parts.items()):
+        load_to_bigquery(part, partition_decorator(table_id, day), schema=schema, write_disposition="WRITE_TRUNCATE",
+                         client=client, schema_update_options=field_addition)
+    if undated.num_rows:
+        logger.warning("⚠️ %s: %s linhas sem %s vão para a partição __NULL__ (APPEND)",
+                       table_id, undated.num_rows, partition_field)
+        load_to_bigquery(undated, table_id, schema=schema, write_disposition="WRITE_APPEND", client=client,
+                         schema_update_options=field_addition)
+
+    written = {f"{day:%Y%m%d}" for day in parts}
+    current_span().set_attribute("partitions", len(written))
+    if keep_only:
+        for partition_id in client.list_partitions(table_id):
+            if partition_id not in written and partition_id not in _SPECIAL_PARTITIONS:
+                client.delete_table(f"{table_id}${partition_id}", not_found_ok=True)
+                logger.info("🗑️ %s: partição %s removida", table_id, partition_id)
+
+    logger.info("📅 %s: %s linhas em %s partições (%s)", table_id, table.num_rows, len(written),
+                ", ".join(sorted(written)) or "-")
+    return {"rows": table.num_rows, "partitions": sorted(written)}
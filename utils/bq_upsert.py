@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Upsert no BigQuery via tabela de staging + MERGE
+─────────────────────────────────────────────────
+Os históricos (``cloud_facebook_historical``, ``cloud_facebook_utc_historical``,
+``cloud_googleads_hour_historical``) gravavam com WRITE_APPEND: rodar o mesmo
+dia duas vezes duplicava o dia. O ``helper/cloud_facebook_ad_performance``
+evitava isso com um ``DELETE ... WHERE CAST(date_start AS DATE) BETWEEN``,
+que lê a tabela inteira antes do append.
+
+Com ``upsert_to_bigquery``:
+
+1. os dados vão por um load Parquet (``utils.bq_load``) para uma tabela de
+   staging no mesmo dataset, que expira sozinha em ``BQ_STAGING_EXPIRATION_MINUTES``
+2. um ``MERGE`` casa staging e destino pelas chaves naturais declaradas (ex:
+   ``date_start, account_id, campaign_id``): linhas existentes são
+   atualizadas, as novas inseridas
+3. o ``ON`` do MERGE leva o intervalo de datas dos dados como constante, então
+   o BigQuery só lê as partições desse intervalo
+4. a staging é apagada no fim
+
+Se o destino ainda não existe, ele é criado particionado por ``date_column``
+(``utils.bq_tables``) e recebe um load simples.
+
+Rodar de novo o mesmo intervalo não duplica nada. As chaves não podem ser nulas.
+Se os dados trazem chaves repetidas fica uma linha por chave, sempre a mesma:
+a de maior ``imported_at`` (ou das colunas de ``order_by``) e, no empate, a de
+maior conteúdo serializado.
+"""
+
+import os
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta, timezone
+
+from utils.bq_load import (
+    add_columns, bigquery_type, get_bq_client, load_to_bigquery, to_arrow_table, _column_names,
+    _destination_schema,
+)
+from utils.bq_tables import ensure_table
+from utils.tracing import current_span, traced
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Validade da tabela de staging (caso a execução morra antes de apagá-la)
+BQ_STAGING_EXPIRATION_MINUTES = int(os.getenv("BQ_STAGING_EXPIRATION_MINUTES", "60"))
+
+
+def _literal(value, bq_type: str) -> str:
+    """Constante SQL tipada para o filtro de partição."""
+    if bq_type == "DATE":
+        return f"DATE '{value.isoformat()}'"
+    if bq_type == "DATETIME":
+        return f"DATETIME '{value.isoformat(sep=' ')}'"
+    if bq_type == "TIMESTAMP":
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    raise ValueError(f"Coluna de data precisa ser DATE, DATETIME ou TIMESTAMP (recebido {bq_type})")
+
+
+def _date_range(table, column: str):
+    """(mínimo, máximo) de ``column`` na ``pyarrow.Table`` (None se só houver nulos)."""
+    import pyarrow.compute as pc
+
+    bounds = pc.min_max(table.column(column))
+    low, high = bounds["min"].as_py(), bounds["max"].as_py()
+    return None if low is None else (low, high)
+
+
+def build_merge(target_id: str, staging_id: str, columns: list, keys: list,
+                date_column: str | None = None, date_type: str | None = None, date_range=None,
+                order_by: list | None = None) -> str:
+    """Texto do MERGE de ``staging_id`` em ``target_id``.
+
+    Linhas repetidas na staging (mesmas chaves) entram uma vez só: a primeira
+    por ``order_by`` (decrescente) e, no empate, pelo JSON da linha, então uma
+    nova execução com os mesmos dados escolhe a mesma linha.
+    """
+    quoted_keys = ", ".join(f"`{k}`" for k in keys)
+    order = ", ".join([f"R.`{c}` DESC" for c in order_by or []] + ["TO_JSON_STRING(R) DESC"])
+    conditions = [f"T.`{k}` = S.`{k}`" for k in keys]
+    if date_column and date_range:
+        low, high = date_range
+        conditions.append(f"T.`{date_column}` BETWEEN {_literal(low, date_type)} AND {_literal(high, date_type)}")
+    updates = ", ".join(f"`{c}` = S.`{c}`" for c in columns if c not in keys)
+    names = ", ".join(f"`{c}`" for c in columns)
+    values = ", ".join(f"S.`{c}`" for c in columns)
+    matched = f"WHEN MATCHED THEN UPDATE SET {updates}\n" if updates else ""
+    return (
+        f"MERGE `{target_id}` T\n"
+        f"USING (\n"
+        f"  SELECT R.* FROM `{staging_id}` R\n"
+        f"  WHERE TRUE\n"
+        f"  QUALIFY ROW_NUMBER() OVER (PARTITION BY {quoted_keys} ORDER BY {order}) = 1\n"
+        f") S\n"
+        f"ON {' AND '.join(conditions)}\n"
+        f"{matched}"
+        f"WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})"
+    )
+
+
+@traced("bigquery.merge")
+def upsert_to_bigquery(data, table_id: str, keys: list, date_column: str | None = None,
+                       schema: list | None = None, clustering_fields: list | None = None, client=None,
+                       order_by: list | None = None) -> dict:
+    """Grava ``data`` em ``table_id`` atualizando as linhas que já existem com as mesmas ``keys``.
+
+    Args:
+        data: DataFrame, lista de dicts ou ``pyarrow.Table``
+        table_id: "projeto.dataset.tabela"
+        keys: Colunas que identificam uma linha (ex: ``["date_start", "ad_id"]``)
+        date_column: Coluna de data (DATE/DATETIME/TIMESTAMP) usada para limitar
+            o MERGE ao intervalo dos dados; normalmente a coluna de partição
+        schema: Lista de ``bigquery.SchemaField``; None = tipos da tabela de destino
+        clustering_fields: Colunas de cluster se a tabela for criada aqui
+        client: ``bigquery.Client``; None = ``get_bq_client()``
+        order_by: Colunas que decidem qual linha fica quando as chaves se repetem
+            (a maior vence); None = ``imported_at``, se existir
+
+    Returns:
+        {"rows", "inserted", "updated"}
+    """
+    from google.cloud import bigquery
+
+    client = client or get_bq_client()
+    current_span().set_attribute("table", table_id)
+    destination = _destination_schema(client, table_id)
+    if schema is None:
+        # Só as colunas presentes nos dados: as demais não são tocadas no UPDATE
+        names = _column_names(data)
+        schema = [f for f in destination if f.name in names]
+    table = to_arrow_table(data, schema)
+    declared = {f.name for f in schema}
+    staging_schema = list(schema) + [
+        bigquery.SchemaField(f.name, bigquery_type(f.type)) for f in table.schema if f.name not in declared
+    ]
+    if table.num_rows == 0:
+        logger.info("Nenhuma linha para %s", table_id)
+        return {"rows": 0, "inserted": 0, "updated": 0}
+    missing = [k for k in keys if k not in table.column_names]
+    if missing:
+        raise ValueError(f"Chaves ausentes nos dados de {table_id}: {missing}")
+    if order_by is None:
+        order_by = [c for c in ("imported_at",) if c in table.column_names]
+    duplicates = table.num_rows - table.group_by(keys).aggregate([]).num_rows
+    if duplicates:
+        logger.warning("⚠️ %s: %s linhas com chaves repetidas (%s) – fica uma por chave",
+                       table_id, duplicates, ", ".join(keys))
+
+    if not destination:
+        # Tabela nova: não há o que casar, um load simples basta
+        if date_column:
+            ensure_table(table_id, staging_schema, date_column, clustering_fields, client=client)
+        job = load_to_bigquery(table, table_id, schema=staging_schema, client=client)
+        return {"rows": table.num_rows, "inserted": job.output_rows or table.num_rows, "updated": 0}
+
+    project, dataset, name = table_id.split(".")
+    staging_id = f"{project}.{dataset}._staging_{name}_{uuid.uuid4().hex[:8]}"
+    start = time.perf_counter()
+    try:
+        load_to_bigquery(table, staging_id, schema=staging_schema, write_disposition="WRITE_TRUNCATE", client=client)
+        staging = client.get_table(staging_id)
+        staging.expires = datetime.now(timezone.utc) + timedelta(minutes=BQ_STAGING_EXPIRATION_MINUTES)
+        client.update_table(staging, ["expires"])
+
+        # Colunas novas nos dados (como o ALLOW_FIELD_ADDITION dos loads)
+        target_schema = add_columns(client, table_id, list(staging.schema))
+        target_types = {f.name: f.field_type for f in target_schema}
+        columns = [f.name for f in staging.schema]
+
+        date_type = date_range = None
+        if date_column:
+            date_type = target_types[date_column].upper()
+            date_range = _date_range(table, date_column)
+        query = build_merge(table_id, staging_id, columns, keys, date_column, date_type, date_range, order_by)
+        job = client.query(query)
+        job.result()
+    finally:
+        client.delete_table(staging_id, not_found_ok=True)
+
+    stats = getattr(job, "dml_stats", None)
+    inserted = stats.inserted_row_count if stats else None
+    updated = stats.updated_row_count if stats else None
+    current = current_span()
+    current.set_attribute("rows", table.num_rows)
+    current.set_attribute("inserted", inserted)
+    current.set_attribute("updated", updated)
+    current.set_attribute("bytes_processed", job.total_bytes_processed)
+    logger.info("🔀 MERGE %s (chaves %s): %s linhas, %s inseridas, %s atualizadas, %.1f MB lidos, %.2fs",
+                table_id, ", ".join(keys), table.num_rows, inserted, updated,
+                (job.total_bytes_processed or 0) / 1e6, time.perf_counter() - start)
+    return {"rows": table.num_rows, "inserted": inserted, "updated": updated}
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Gravação no BigQuery pela Storage Write API
+────────────────────────────────────────────
+Os scripts horários (``cloud_facebook_hour_today`` / ``page_per_hour`` /
+``hour_yesterday``) cortavam o DataFrame em pedaços de 5.000 linhas e rodavam
+um load job por pedaço, um depois do outro. Cada execução gastava vários jobs
+da cota de load e, no ``hour_today``, a tabela ficava parcial entre o primeiro
+pedaço (WRITE_TRUNCATE) e o último.
+
+Aqui a tabela inteira vai numa única sessão da Storage Write API:
+
+- um stream PENDING recebe os dados como ``pyarrow.RecordBatch`` (formato
+  Arrow da API), com os tipos do schema da tabela de destino
+- cada append leva o ``offset`` da primeira linha, então um reenvio não
+  duplica linhas
+- no fim o stream é finalizado e commitado com ``BatchCommitWriteStreams``:
+  ou todas as linhas aparecem, ou nenhuma
+
+O stream só acrescenta linhas. Para substituir a tabela (``truncate=True``)
+``write_to_bigquery`` usa um único load Parquet com WRITE_TRUNCATE: um
+``TRUNCATE TABLE`` seguido do commit seriam duas operações, e uma falha entre
+elas deixaria a tabela vazia.
+
+``write_to_bigquery`` escolhe o caminho por ``BQ_WRITE_MODE``; se a Storage
+Write API não estiver instalada ou falhar antes do commit, os dados vão por um
+único load Parquet (``utils.bq_load``).
+"""
+
+import os
+import time
+import logging
+import threading
+
+from utils.bq_load import (
+    add_columns, bigquery_type, get_bq_client, load_to_bigquery, to_arrow_table, _destination_schema,
+)
+from utils.tracing import current_span, traced
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# storage_write = Storage Write API (padrão) | load = load job Parquet
+BQ_WRITE_MODE = os.getenv("BQ_WRITE_MODE", "storage_write").lower()
+# Tamanho máximo de cada AppendRows (o limite da API é 10 MB por requisição)
+STORAGE_WRITE_BATCH_BYTES = int(os.getenv("STORAGE_WRITE_BATCH_BYTES", str(8 * 1024 * 1024)))
+
+
+# ------------------------------------------------------------------------------
+# CLIENTE
+# ------------------------------------------------------------------------------
+_write_clients = {}
+_write_clients_lock = threading.Lock()
+
+
+def get_write_client(client=None):
+    """``BigQueryWriteClient`` com as mesmas credenciais de ``client`` (um por cliente)."""
+    from google.cloud import bigquery_storage_v1
+
+    client = client or get_bq_client()
+    with _write_clients_lock:
+        write_client = _write_clients.get(id(client))
+        if write_client is None:
+            write_client = bigquery_storage_v1.BigQueryWriteClient(credentials=client._credentials)
+            _write_clients[id(client)] = write_client
+        return write_client
+
+
+# ------------------------------------------------------------------------------
+# SCHEMA
+# ------------------------------------------------------------------------------
+def _prepare_table(data, table_id: str, client):
+    """Converte ``data`` para o schema da tabela, criando a tabela ou as colunas que faltam.
+
+    Equivale ao ``ALLOW_FIELD_ADDITION`` dos loads: a Storage Write API recusa
+    colunas que a tabela não tem.
+    """
+    from google.cloud import bigquery
+
+    schema = _destination_schema(client, table_id)
+    table = to_arrow_table(data, schema)
+    known = {f.name for f in schema}
+    new_fields = [bigquery.SchemaField(f.name, bigquery_type(f.type)) for f in table.schema if f.name not in known]
+    if not schema:
+        client.create_table(bigquery.Table(table_id, schema=new_fields))
+        logger.info("🆕 Tabela %s criada com %s colunas", table_id, len(new_fields))
+        schema = new_fields
+    elif new_fields:
+        schema = add_columns(client, table_id, new_fields)
+    else:
+        return table
+    return to_arrow_table(table, schema)
+
+
+# ------------------------------------------------------------------------------
+# GRAVAÇÃO
+# ------------------------------------------------------------------------------
+_totals = {"streams": 0, "rows": 0, "bytes": 0, "appends": 0, "write_seconds": 0.0}
+_totals_lock = threading.Lock()
+
+
+def stream_totals() -> dict:
+    """Soma das gravações pela Storage Write API (streams, rows, bytes, appends, write_seconds)."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def _batches(table, max_bytes: int):
+    """Fatias de ``table`` que cabem em uma requisição AppendRows."""
+    if table.num_rows == 0:
+        return []
+    rows_per_batch = max(1, int(max_bytes * table.num_rows / max(table.nbytes, 1)))
+    return table.to_batches(max_chunksize=rows_per_batch)
+
+
+@traced("bigquery.write_stream")
+def stream_to_bigquery(data, table_id: str, client=None) -> int:
+    """Acrescenta ``data`` em ``table_id`` num stream PENDING e commita tudo de uma vez.
+
+    Args:
+        data: DataFrame, lista de dicts ou ``pyarrow.Table``
+        table_id: "projeto.dataset.tabela"
+        client: ``bigquery.Client`` (schema e criação da tabela); None = ``get_bq_client()``
+
+    Returns:
+        Linhas gravadas
+    """
+    from google.cloud.bigquery_storage_v1 import types, writer
+
+    client = client or get_bq_client()
+    write_client = get_write_client(client)
+    start = time.perf_counter()
+    current_span().set_attribute("table", table_id)
+
+    table = _prepare_table(data, table_id, client)
+    project, dataset, name = table_id.split(".")
+    parent = write_client.table_path(project, dataset, name)
+    stream = write_client.create_write_stream(
+        parent=parent, write_stream=types.WriteStream(type_=types.WriteStream.Type.PENDING))
+
+    template = types.AppendRowsRequest(
+        write_stream=stream.name,
+        arrow_rows=types.AppendRowsRequest.ArrowData(
+            writer_schema=types.ArrowSchema(serialized_schema=table.schema.serialize().to_pybytes())),
+    )
+    append_stream = writer.AppendRowsStream(write_client, template)
+    offset = 0
+    size = 0
+    futures = []
+    try:
+        for batch in _batches(table, STORAGE_WRITE_BATCH_BYTES):
+            payload = batch.serialize().to_pybytes()
+            request = types.AppendRowsRequest(
+                offset=offset,
+                arrow_rows=types.AppendRowsRequest.ArrowData(
+                    rows=types.ArrowRecordBatch(serialized_record_batch=payload, row_count=batch.num_rows)),
+            )
+            futures.append(append_stream.send(request))
+            offset += batch.num_rows
+            size += len(payload)
+        for future in futures:
+            future.result()
+    finally:
+        append_stream.close()
+
+    write_client.finalize_write_stream(name=stream.name)
+    response = write_client.batch_commit_write_streams(
+        types.BatchCommitWriteStreamsRequest(parent=parent, write_streams=[stream.name]))
+    if response.stream_errors:
+        raise RuntimeError(f"Commit do stream falhou em {table_id}: {list(response.stream_errors)}")
+
+    write_seconds = time.perf_counter() - start
+    current = current_span()
+    current.set_attribute("rows", offset)
+    current.set_attribute("bytes", size)
+    current.set_attribute("appends", len(futures))
+    with _totals_lock:
+        _totals["streams"] += 1
+        _totals["rows"] += offset
+        _totals["bytes"] += size
+        _totals["appends"] += len(futures)
+        _totals["write_seconds"] += write_seconds
+    logger.info("🌊 %s: %s linhas em %s appends (%.1f KB Arrow) pela Storage Write API em %.2fs",
+                table_id, offset, len(futures), size / 1024, write_seconds)
+    return offset
+
+
+def write_to_bigquery(data, table_id: str, client=None, truncate: bool = False) -> int:
+    """Acrescenta ``data`` pela Storage Write API ou, se ela não estiver disponível, por um load Parquet.
+
+    Args:
+        data: DataFrame, lista de dicts ou ``pyarrow.Table``
+        table_id: "projeto.dataset.tabela"
+        client: ``bigquery.Client``; None = ``get_bq_client()``
+        truncate: Substitui o conteúdo da tabela num único load WRITE_TRUNCATE (atômico)
+
+    Returns:
+        Linhas gravadas
+    """
+    from google.cloud import bigquery
+
+    client = client or get_bq_client()
+    if BQ_WRITE_MODE == "storage_write" and not truncate:
+        try:
+            return stream_to_bigquery(data, table_id, client=client)
+        except ImportError:
+            logger.warning("⚠️ google-cloud-bigquery-storage não instalado, usando load job")
+        except Exception as e:
+            # Nada foi commitado: o stream PENDING é descartado pelo BigQuery
+            logger.warning(f"⚠️ Storage Write API falhou em {table_id} ({e}), usando load job")
+
+    job = load_to_bigquery(
+        data, table_id, client=client,
+        write_disposition="WRITE_TRUNCATE" if truncate else "WRITE_APPEND",
+        schema_update_options=None if truncate else [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+    )
+    return job.output_rows or 0
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot incremental dos orçamentos de campanha
+────────────────────────────────────────────────
+``daily_budget``, ``lifetime_budget``, ``stop_time`` e ``status`` quase nunca
+mudam entre duas execuções horárias. Em vez de reler todas as campanhas a
+cada execução, o snapshot guarda por conta as campanhas já lidas e a maior
+``updated_time`` vista (marca d'água). Cada execução pede à Graph API só:
+
+- as campanhas da conta com ``updated_time`` depois da marca d'água
+- as campanhas dos insights que ainda não estão no snapshot
+
+O snapshot fica em ``FUNCTIONS_STATE_DIR`` e é compartilhado pelos jobs de
+campanha (today / yesterday / historical e variantes UTC). A cada
+``BUDGET_SNAPSHOT_MAX_AGE`` segundos a conta é relida por inteiro, para
+corrigir qualquer mudança que não tenha alterado ``updated_time``.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from utils.state import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Campos de orçamento lidos das campanhas
+CAMPAIGN_BUDGET_FIELDS = "id,name,daily_budget,lifetime_budget,stop_time,status,updated_time"
+# Campanhas por página (a listagem segue paging.next até o fim)
+BUDGET_PAGE_LIMIT = int(os.getenv("BUDGET_PAGE_LIMIT", "500"))
+# campaign_ids por filtro "IN" (mantém a URL dentro do limite)
+BUDGET_FILTER_CHUNK = 100
+# Releitura completa da conta a cada N segundos (0 = sempre, sem snapshot)
+BUDGET_SNAPSHOT_MAX_AGE = int(os.getenv("BUDGET_SNAPSHOT_MAX_AGE", "86400"))
+# Folga aplicada à marca d'água (segundos) para edições no mesmo segundo da leitura
+BUDGET_WATERMARK_OVERLAP = 60
+# Arquivo do snapshot em FUNCTIONS_STATE_DIR
+BUDGET_SNAPSHOT_FILE = "campaign_budgets.json"
+
+
+def _updated_ts(campaign: dict) -> int:
+    """``updated_time`` da campanha ("2024-05-01T12:00:00-0300") em epoch."""
+    try:
+        return int(datetime.strptime(campaign.get("updated_time", ""), "%Y-%m-%dT%H:%M:%S%z").timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+class CampaignBudgetSnapshot:
+    """Campanhas por conta + marca d'água de ``updated_time``, persistidas em JSON."""
+
+    def __init__(self, filename: str = BUDGET_SNAPSHOT_FILE, max_age: int = BUDGET_SNAPSHOT_MAX_AGE):
+        self.filename = filename
+        self.max_age = max_age
+        self._accounts = load_json(filename, default={}) or {}
+        self._lock = threading.Lock()
+
+    def entry(self, account_id: str, now: float | None = None) -> dict | None:
+        """Cópia do snapshot da conta, ou None se não existe ou venceu a releitura completa."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._accounts.get(account_id)
+            if not entry or now - entry.get("refreshed_at", 0) >= self.max_age:
+                return None
+            return {"watermark": entry["watermark"], "campaigns": dict(entry["campaigns"])}
+
+    def update(self, account_id: str, campaigns: list, full_refresh: bool = False,
+               now: float | None = None) -> None:
+        """Mescla as campanhas lidas e avança a marca d'água da conta."""
+        now = now or time.time()
+        with self._lock:
+            entry = self._accounts.get(account_id)
+            if full_refresh or entry is None:
+                entry = {"watermark": 0, "refreshed_at": now, "campaigns": {}}
+                self._accounts[account_id] = entry
+            for campaign in campaigns:
+                entry["campaigns"][str(campaign["id"])] = campaign
+                entry["watermark"] = max(entry["watermark"], _updated_ts(campaign))
+
+    def save(self) -> None:
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._accounts))
+        save_json(self.filename, snapshot)
+
+
+def _fetch(client, account_id: str, token: str, filters: list) -> list:
+    url = f"{account_id}/campaigns"
+    params = {
+        "access_token": token,
+        "fields": CAMPAIGN_BUDGET_FIELDS,
+        "filtering": json.dumps(filters),
+        "limit": BUDGET_PAGE_LIMIT,
+    }
+    return client.fetch_all(url, params, context=account_id)
+
+
+def _fetch_ids(client, account_id: str, token: str, campaign_ids: list) -> list:
+    campaigns = []
+    for i in range(0, len(campaign_ids), BUDGET_FILTER_CHUNK):
+        chunk = campaign_ids[i:i + BUDGET_FILTER_CHUNK]
+        campaigns.extend(_fetch(client, account_id, token, [{"field": "id", "operator": "IN", "value": chunk}]))
+    return campaigns
+
+
+def fetch_campaign_budgets(client, account_id: str, token: str, campaign_ids: list,
+                           snapshot: "CampaignBudgetSnapshot | None" = None) -> list:
+    """Orçamentos das campanhas ``campaign_ids`` da conta, lendo da API só o que mudou.
+
+    Args:
+        client: ``GraphAPIClient``
+        account_id: Conta com prefixo ``act_``
+        campaign_ids: Campanhas necessárias (as que apareceram nos insights)
+        snapshot: Snapshot compartilhado (None = ``get_budget_snapshot()``)
+
+    Returns:
+        Lista de campanhas (``CAMPAIGN_BUDGET_FIELDS``) das ``campaign_ids`` encontradas
+    """
+    snapshot = snapshot or get_budget_snapshot()
+    entry = snapshot.entry(account_id)
+
+    if entry is None:
+        # Primeira leitura (ou releitura periódica): só as campanhas necessárias
+        campaigns = _fetch_ids(client, account_id, token, campaign_ids)
+        snapshot.update(account_id, campaigns, full_refresh=True)
+        logger.info("💾 [BUDGETS] Conta %s: snapshot criado com %s campanhas", account_id, len(campaigns))
+        return campaigns
+
+    since = max(0, entry["watermark"] - BUDGET_WATERMARK_OVERLAP)
+    changed = _fetch(client, account_id, token,
+                     [{"field": "updated_time", "operator": "GREATER_THAN", "value": since}])
+    known = set(entry["campaigns"]) | {str(c["id"]) for c in changed}
+    missing = [cid for cid in campaign_ids if cid not in known]
+    new = _fetch_ids(client, account_id, token, missing) if missing else []
+    snapshot.update(account_id, changed + new)
+
+    if changed or new:
+        logger.info("💾 [BUDGETS] Conta %s: %s campanhas alteradas, %s novas no snapshot",
+                    account_id, len(changed), len(new))
+    merged = {**entry["campaigns"], **{str(c["id"]): c for c in changed + new}}
+    return [merged[cid] for cid in campaign_ids if cid in merged]
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_budget_snapshot() -> CampaignBudgetSnapshot:
+    """Snapshot compartilhado por todas as threads do processo."""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = CampaignBudgetSnapshot()
+        return _snapshot
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Cache persistente ad_id → creative_id
+──────────────────────────────────────
+O creative de um anúncio praticamente não muda, mas o pipeline de anúncios
+(``cloud_facebook_adsperformance``) resolvia todos os ``ad_id`` a cada
+execução. Este cache guarda em SQLite (``FUNCTIONS_STATE_DIR``):
+
+- ``ads``: ad_id → creative_id, campaign_id
+- ``campaigns``: campaign_id → usa criativo dinâmico (decidido pelo primeiro
+  anúncio visto da campanha)
+
+Só os anúncios ausentes (ou vencidos, ``CREATIVE_CACHE_TTL_DAYS``) vão para a
+Graph API. Com ``CREATIVE_CACHE_BQ_WARM_START=true`` um cache vazio é
+preenchido a partir dos creative_ids já gravados no BigQuery.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from utils.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Arquivo SQLite em FUNCTIONS_STATE_DIR
+CREATIVE_CACHE_FILE = "ad_creatives.sqlite"
+# Validade de cada ad_id no cache (dias)
+CREATIVE_CACHE_TTL_DAYS = float(os.getenv("CREATIVE_CACHE_TTL_DAYS", "30"))
+# Preencher um cache vazio com os creative_ids já gravados no BigQuery
+CREATIVE_CACHE_BQ_WARM_START = os.getenv("CREATIVE_CACHE_BQ_WARM_START", "false").lower() == "true"
+
+# creative_id gravado para anúncios de campanhas com criativo dinâmico
+DYNAMIC_CREATIVE_ID = "dynamic_creative"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ads (
+    ad_id       TEXT PRIMARY KEY,
+    creative_id TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id TEXT PRIMARY KEY,
+    is_dynamic  INTEGER NOT NULL,
+    updated_at  REAL NOT NULL
+);
+"""
+
+# Parâmetros por comando (limite de variáveis do SQLite)
+_SQL_CHUNK = 500
+
+
+class CreativeCache:
+    """Mapeamento ad_id → creative_id e veredito de criativo dinâmico por campanha."""
+
+    def __init__(self, path: str | None = None, ttl_days: float = CREATIVE_CACHE_TTL_DAYS):
+        self.path = path or state_path(CREATIVE_CACHE_FILE)
+        self.ttl = ttl_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def _select(self, sql: str, keys: list, params: tuple = ()) -> list:
+        """Executa ``sql`` (com ``IN ({})``) em blocos de ``keys``; ``params`` vêm antes das chaves."""
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[i:i + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._conn.execute(sql.format(placeholders), (*params, *chunk)).fetchall())
+        return rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ads").fetchone()[0]
+
+    # -- leitura -------------------------------------------------------------
+    def lookup(self, ad_ids) -> dict:
+        """``{ad_id: (creative_id, campaign_id)}`` dos anúncios em cache e dentro da validade."""
+        oldest = time.time() - self.ttl
+        rows = self._select(
+            "SELECT ad_id, creative_id, campaign_id FROM ads WHERE updated_at >= ? AND ad_id IN ({})",
+            [str(a) for a in ad_ids], (oldest,),
+        )
+        return {ad_id: (creative_id, campaign_id) for ad_id, creative_id, campaign_id in rows}
+
+    def dynamic_campaigns(self, campaign_ids) -> dict:
+        """``{campaign_id: bool}`` das campanhas com veredito conhecido."""
+        rows = self._select("SELECT campaign_id, is_dynamic FROM campaigns WHERE campaign_id IN ({})",
+                            [str(c) for c in campaign_ids])
+        return {campaign_id: bool(is_dynamic) for campaign_id, is_dynamic in rows}
+
+    # -- escrita -------------------------------------------------------------
+    def store(self, ads: list, verdicts: dict) -> None:
+        """Grava os anúncios (``[(ad_id, creative_id, campaign_id)]``) e os vereditos novos.
+
+        Vereditos já existentes não são sobrescritos: o primeiro anúncio visto
+        decide a campanha.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ads (ad_id, creative_id, campaign_id, updated_at) VALUES (?, ?, ?, ?)",
+                [(str(a), str(c or ""), str(p or ""), now) for a, c, p in ads],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO campaigns (campaign_id, is_dynamic, updated_at) VALUES (?, ?, ?)",
+                [(str(c), int(d), now) for c, d in verdicts.items()],
+            )
+
+    def warm_start_from_bigquery(self, bq_client, table_id: str) -> int:
+        """Preenche o cache vazio com os pares ad_id/creative_id já gravados no BigQuery.
+
+        Returns:
+            Número de anúncios carregados (0 se o cache já tinha dados)
+        """
+        if len(self) > 0:
+            return 0
+        query = f"""
+            SELECT ad_id, ANY_VALUE(creative_id) AS creative_id, ANY_VALUE(campaign_id) AS campaign_id
+            FROM `{table_id}`
+            WHERE creative_id IS NOT NULL AND creative_id NOT IN ('', 'nan', 'None')
+            GROUP BY ad_id
+        """
+        ads, verdicts = [], {}
+        for row in bq_client.query(query).result():
+            ads.append((row.ad_id, row.creative_id, row.campaign_id))
+            if row.campaign_id:
+                is_dynamic = row.creative_id == DYNAMIC_CREATIVE_ID
+                verdicts[row.campaign_id] = verdicts.get(row.campaign_id, False) or is_dynamic
+        self.store(ads, verdicts)
+        logger.info("💾 Cache de creatives pré-carregado do BigQuery: %s anúncios, %s campanhas",
+                    len(ads), len(verdicts))
+        return len(ads)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_creative_cache() -> CreativeCache:
+    """Cache compartilhado por todas as threads do processo."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CreativeCache()
+        return _cache
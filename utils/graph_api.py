@@ -0,0 +1,578 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente compartilhado da Graph API (Facebook Marketing API)
+─────────────────────────────────────────────────────────────
+Substitui as cópias de ``fb_get`` espalhadas pelos scripts:
+
+1. ``GraphAPIClient``  – ``requests.Session`` com pool keep-alive (várias
+   requisições por conexão TLS em vez de um handshake por chamada).
+2. ``AsyncGraphAPIClient`` – mesmo contrato sobre ``aiohttp`` para os
+   scripts horários que já rodam em asyncio.
+3. ``paginate`` – busca a próxima página em paralelo enquanto o chamador
+   processa a atual (prefetch em pipeline), numa vaga do ``RunScheduler``:
+   conta no limite global e na faixa do token, e sem vaga a página é buscada
+   na hora pela própria tarefa.
+4. ``classify_error`` – classificação única de erros para decidir se vale
+   a pena tentar de novo (rate limit, dados excessivos, 5xx) ou desistir
+   na hora (token inválido, sem permissão, parâmetros inválidos).
+5. Ritmo guiado pelos headers de uso (``utils.rate_limit``) em vez de
+   ``sleep`` fixo antes de cada chamada.
+6. ``batch`` – até 50 sub-requisições GET num único POST (Graph batch API).
+7. Cada requisição é um span ``graph.request`` (``utils.tracing``), com as
+   esperas de rate limit, ``request_delay`` e backoff como spans filhos.
+"""
+
+import os
+import json
+import time
+import logging
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.rate_limit import RateLimitGovernor, account_from_url, get_governor
+from utils.run_metrics import aiohttp_trace_config, record_sleep
+from utils.run_scheduler import get_run_scheduler
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+GRAPH_API_VERSION = os.getenv("GRAPH_API_VERSION", "v24.0")
+GRAPH_API_PUBLIC_HOST = "https://graph.facebook.com"
+# Host da API; outro valor (ex: o servidor local de benchmarks/graph_api_stub.py)
+# recebe também as URLs completas montadas pelos scripts
+GRAPH_API_HOST = os.getenv("GRAPH_API_HOST", GRAPH_API_PUBLIC_HOST).rstrip("/")
+GRAPH_API_BASE_URL = f"{GRAPH_API_HOST}/{GRAPH_API_VERSION}"
+
+# Conexões mantidas abertas no pool (por host)
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "50"))
+# Timeout de cada requisição (em segundos)
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "60"))
+# Máximo de sub-requisições por chamada batch (limite da Graph API)
+GRAPH_BATCH_SIZE = 50
+
+# ------------------------------------------------------------------------------
+# CLASSIFICAÇÃO DE ERROS
+# ------------------------------------------------------------------------------
+ERROR_RATE_LIMIT = "rate_limit"      # códigos 4, 17, 32, 613, 80xxx, HTTP 429
+ERROR_REDUCE_DATA = "reduce_data"    # 500 "Please reduce the amount of data"
+ERROR_AUTH = "auth"                  # 401 / código 190 (token inválido ou expirado)
+ERROR_PERMISSION = "permission"      # 403 sem ser rate limit
+ERROR_NOT_FOUND = "not_found"        # 404
+ERROR_INVALID = "invalid"            # 400 – parâmetros inválidos
+ERROR_TRANSIENT = "transient"        # 5xx, timeout, erro de conexão
+
+RETRYABLE_ERRORS = {ERROR_RATE_LIMIT, ERROR_REDUCE_DATA, ERROR_TRANSIENT}
+
+RATE_LIMIT_CODES = {4, 17, 32, 613}
+
+
+def is_account_level_limit(code: int | None) -> bool:
+    """Limites de Business Use Case (80xxx) valem para a conta, não para o token."""
+    return isinstance(code, int) and 80000 <= code <= 80099
+
+
+class GraphAPIError(Exception):
+    """Erro final (sem mais tentativas) de uma chamada à Graph API."""
+
+    def __init__(self, kind: str, status: int | None = None, code: int | None = None,
+                 subcode: int | None = None, message: str = ""):
+        super().__init__(f"[{kind}] HTTP {status} código {code}/{subcode}: {message}")
+        self.kind = kind
+        self.status = status
+        self.code = code
+        self.subcode = subcode
+        self.message = message
+
+
+def classify_error(status: int | None, payload: dict | None) -> str:
+    """Classifica uma resposta de erro da Graph API.
+
+    Args:
+        status: HTTP status (None para timeout/erro de conexão)
+        payload: Corpo JSON da resposta (pode ser None)
+    """
+    if status is None:
+        return ERROR_TRANSIENT
+
+    error = (payload or {}).get("error", {}) if isinstance(payload, dict) else {}
+    code = error.get("code")
+    subcode = error.get("error_subcode")
+    message = str(error.get("message", "")).lower()
+
+    if status == 429 or code in RATE_LIMIT_CODES or is_account_level_limit(code):
+        return ERROR_RATE_LIMIT
+    if code == 4 and subcode == 1504022:
+        return ERROR_RATE_LIMIT
+    if "user request limit reached" in message:
+        return ERROR_RATE_LIMIT
+    if "reduce the amount of data" in message:
+        return ERROR_REDUCE_DATA
+    if status == 401 or code == 190:
+        return ERROR_AUTH
+    if status == 403:
+        return ERROR_PERMISSION
+    if status == 404:
+        return ERROR_NOT_FOUND
+    if status >= 500 or error.get("is_transient"):
+        return ERROR_TRANSIENT
+    return ERROR_INVALID
+
+
+def _error_details(payload) -> tuple:
+    error = (payload or {}).get("error", {}) if isinstance(payload, dict) else {}
+    return error.get("code"), error.get("error_subcode"), str(error.get("message", ""))
+
+
+def _next_cursor(page: dict) -> str | None:
+    """Cursor da próxima página, ou None quando a página atual é a última."""
+    paging = page.get("paging", {}) or {}
+    if not paging.get("next"):
+        return None
+    return (paging.get("cursors", {}) or {}).get("after")
+
+
+def resolve_url(url: str) -> str:
+    """URL completa: caminhos relativos ganham a base; URLs do host público vão para ``GRAPH_API_HOST``."""
+    if not url.startswith("http"):
+        return f"{GRAPH_API_BASE_URL}/{url.lstrip('/')}"
+    if GRAPH_API_HOST != GRAPH_API_PUBLIC_HOST and url.startswith(GRAPH_API_PUBLIC_HOST + "/"):
+        return GRAPH_API_HOST + url[len(GRAPH_API_PUBLIC_HOST):]
+    return url
+
+
+def _span_path(url: str) -> str:
+    """Caminho da URL sem a base e sem a query (atributo ``path`` dos spans)."""
+    return url.split("?", 1)[0].replace(GRAPH_API_BASE_URL, "", 1) or "/"
+
+
+# ------------------------------------------------------------------------------
+# CLIENTE SÍNCRONO (requests.Session com pool keep-alive)
+# ------------------------------------------------------------------------------
+class GraphAPIClient:
+    """Cliente thread-safe da Graph API com pool de conexões e retry classificado.
+
+    Uma única instância deve ser compartilhada por todo o processo: o token vai
+    nos parâmetros de cada chamada, então grupos e tokens diferentes reutilizam
+    as mesmas conexões com graph.facebook.com.
+    """
+
+    def __init__(self, max_retries: int = 8, backoff_seconds: float = 5.0,
+                 rate_limit_delay: float | None = None, request_delay: float = 0.0,
+                 pool_size: int = GRAPH_POOL_SIZE, timeout: float = GRAPH_TIMEOUT,
+                 governor: RateLimitGovernor | None = None):
+        """
+        Args:
+            max_retries: Tentativas padrão por requisição
+            backoff_seconds: Base do back-off exponencial
+            rate_limit_delay: Pausa em rate limit quando os headers não informam
+                o tempo de recuperação (None = exponencial x2)
+            request_delay: Pausa fixa antes de cada requisição (0 = só o governador)
+            pool_size: Conexões keep-alive mantidas no pool
+            timeout: Timeout de cada requisição (segundos)
+            governor: Governador de rate limit (None = instância compartilhada)
+        """
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.rate_limit_delay = rate_limit_delay
+        self.request_delay = request_delay
+        self.timeout = timeout
+        self.governor = governor or get_governor()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+
+    # -- ciclo de vida ---------------------------------------------------------
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- requisições -----------------------------------------------------------
+    def _backoff(self, kind: str, attempt: int) -> float:
+        if kind == ERROR_RATE_LIMIT:
+            if self.rate_limit_delay is not None:
+                return self.rate_limit_delay
+            return self.backoff_seconds * (2 ** attempt) * 2
+        if kind == ERROR_REDUCE_DATA and self.rate_limit_delay is not None:
+            return self.rate_limit_delay * 2
+        return self.backoff_seconds * (2 ** attempt)
+
+    def request(self, method: str, url: str, params: dict | None = None, data: dict | None = None,
+                retries: int | None = None, context: str = "", max_rate_limit_retries: int = 3,
+                fail_fast: tuple = ()) -> dict:
+        """Executa uma requisição com retry classificado.
+
+        Args:
+            method: "GET" ou "POST"
+            url: URL completa ou caminho relativo (ex: "act_123/insights")
+            params: Query string
+            data: Corpo form-encoded (POST)
+            retries: Número de tentativas (None = max_retries do cliente)
+            context: Contexto adicional para logs (ex: account_id)
+            max_rate_limit_retries: Máximo de tentativas para rate limit
+            fail_fast: Tipos de erro levantados já na primeira ocorrência, para
+                quando o chamador tem uma alternativa melhor (ex: ERROR_REDUCE_DATA)
+
+        Raises:
+            GraphAPIError: quando o erro não é recuperável ou as tentativas acabam
+        """
+        url = resolve_url(url)
+        retries = retries or self.max_retries
+        context_prefix = f"[{context}] " if context else ""
+        token = (params or {}).get("access_token") or (data or {}).get("access_token")
+        account_id = account_from_url(url)
+        rate_limit_attempts = 0
+        last_error = None
+
+        with span("graph.request", method=method, path=_span_path(url), account_id=account_id,
+                  context=context or None) as current:
+            for attempt in range(retries):
+                current.set_attribute("attempts", attempt + 1)
+                wait = self.governor.reserve(token, account_id)
+                if wait > 0:
+                    record_sleep(wait, "rate_limit")
+                    with span("graph.rate_limit_wait", seconds=wait):
+                        time.sleep(wait)
+                if self.request_delay:
+                    with span("graph.request_delay", seconds=self.request_delay):
+                        time.sleep(self.request_delay)
+
+                try:
+                    resp = self.session.request(method, url, params=params, data=data, timeout=self.timeout)
+                except requests.exceptions.RequestException as e:
+                    kind, status, payload = ERROR_TRANSIENT, None, None
+                    last_error = GraphAPIError(kind, message=str(e))
+                    current.set_attribute("error_kind", kind)
+                    logger.warning("%sErro de conexão – tentativa %s/%s: %s",
+                                   context_prefix, attempt + 1, retries, e)
+                else:
+                    self.governor.record_response(token, account_id, resp.headers)
+                    current.set_attribute("status", resp.status_code)
+                    current.set_attribute("bytes", len(resp.content))
+                    if resp.ok:
+                        return resp.json()
+                    status = resp.status_code
+                    try:
+                        payload = resp.json()
+                    except ValueError:
+                        payload = None
+                    kind = classify_error(status, payload)
+                    code, subcode, message = _error_details(payload)
+                    last_error = GraphAPIError(kind, status, code, subcode, message or resp.text[:300])
+                    current.set_attribute("error_kind", kind)
+
+                    if kind in fail_fast:
+                        logger.warning("%sErro %s (%s) – repassado ao chamador", context_prefix, status, kind)
+                        if kind == ERROR_RATE_LIMIT:
+                            # Mesmo sem nova tentativa, as outras threads precisam saber do bloqueio
+                            self.governor.record_throttle(token, account_id, self._backoff(kind, attempt),
+                                                          account_level=is_account_level_limit(code),
+                                                          headers=resp.headers)
+                        raise last_error
+                    if kind not in RETRYABLE_ERRORS:
+                        logger.error("%sErro %s (%s) – sem nova tentativa: %s",
+                                     context_prefix, status, kind, resp.text[:500])
+                        raise last_error
+
+                    logger.warning("%sErro %s (%s) – tentativa %s/%s: %s",
+                                   context_prefix, status, kind, attempt + 1, retries, resp.text[:500])
+
+                if kind == ERROR_RATE_LIMIT:
+                    rate_limit_attempts += 1
+                    # Bloqueia o token/conta para TODAS as threads; a espera acontece
+                    # no reserve() da próxima tentativa
+                    self.governor.record_throttle(token, account_id, self._backoff(kind, attempt),
+                                                  account_level=is_account_level_limit(last_error.code),
+                                                  headers=resp.headers)
+                    if rate_limit_attempts >= max_rate_limit_retries:
+                        logger.warning("%sRate limit persistente após %s tentativas. Pulando esta requisição.",
+                                       context_prefix, max_rate_limit_retries)
+                        raise last_error
+                elif attempt + 1 < retries:
+                    backoff = self._backoff(kind, attempt)
+                    record_sleep(backoff)
+                    with span("graph.backoff", seconds=backoff, error_kind=kind):
+                        time.sleep(backoff)
+
+            logger.error("%s❌ Todas as tentativas falharam para: %s", context_prefix, url)
+            raise last_error
+
+    def get(self, url: str, params: dict | None = None, retries: int | None = None,
+            context: str = "", max_rate_limit_retries: int = 3, fail_fast: tuple = ()) -> dict | None:
+        """GET que devolve o JSON ou None em caso de falha (contrato do antigo ``fb_get``).
+
+        Erros dos tipos em ``fail_fast`` são levantados em vez de virar None.
+        """
+        try:
+            return self.request("GET", url, params=params, retries=retries, context=context,
+                                max_rate_limit_retries=max_rate_limit_retries, fail_fast=fail_fast)
+        except GraphAPIError as e:
+            if e.kind in fail_fast:
+                raise
+            return None
+
+    def batch(self, sub_requests: list, token: str, retries: int | None = None,
+              context: str = "") -> list:
+        """Executa sub-requisições pela Graph batch API (até 50 por POST).
+
+        Args:
+            sub_requests: Lista de ``{"method": "GET", "relative_url": "..."}``
+            token: Access token usado em todas as sub-requisições
+            retries: Tentativas de cada POST (None = max_retries do cliente)
+            context: Contexto adicional para logs
+
+        Returns:
+            Lista na mesma ordem de ``sub_requests`` com o JSON de cada resposta,
+            ou None para as sub-requisições que falharam
+        """
+        context_prefix = f"[{context}] " if context else ""
+        results = []
+        for start in range(0, len(sub_requests), GRAPH_BATCH_SIZE):
+            chunk = sub_requests[start:start + GRAPH_BATCH_SIZE]
+            data = {"access_token": token, "batch": json.dumps(chunk), "include_headers": "false"}
+            try:
+                responses = self.request("POST", GRAPH_API_BASE_URL, data=data, retries=retries, context=context)
+            except GraphAPIError:
+                responses = None
+            if not isinstance(responses, list):
+                results.extend([None] * len(chunk))
+                continue
+
+            for sub_request, response in zip(chunk, responses):
+                body = None
+                if response and response.get("code") == 200:
+                    try:
+                        body = json.loads(response.get("body") or "null")
+                    except ValueError:
+                        body = None
+                elif response:
+                    logger.warning("%sSub-requisição %s falhou com HTTP %s: %s", context_prefix,
+                                   sub_request.get("relative_url"), response.get("code"),
+                                   str(response.get("body"))[:300])
+                results.append(body)
+            # A API devolve null para sub-requisições que não chegaram a rodar
+            results.extend([None] * (len(chunk) - len(responses)))
+        return results
+
+    # -- paginação -------------------------------------------------------------
+    def paginate(self, fetch_page, prefetch: bool = True, token: str | None = None):
+        """Itera sobre as páginas de uma listagem paginada por cursor.
+
+        Args:
+            fetch_page: Função ``fetch_page(after) -> dict | None`` que busca uma página
+            prefetch: Dispara a busca da próxima página antes de devolver a atual
+                (só quando o ``RunScheduler`` tem vaga livre)
+            token: Token das requisições (faixa do prefetch no ``RunScheduler``)
+
+        Yields:
+            O JSON de cada página (com "data" e "paging")
+        """
+        page = fetch_page(None)
+        pending = None
+        try:
+            while page:
+                after = _next_cursor(page)
+                if after and prefetch:
+                    pending = get_run_scheduler().try_submit(fetch_page, after, token=token)
+                yield page
+                if not after:
+                    break
+                page = pending.result() if pending is not None else fetch_page(after)
+                pending = None
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    def iter_pages(self, url: str, params: dict, prefetch: bool = True, **kwargs):
+        """Atalho de ``paginate`` para uma URL + parâmetros fixos."""
+
+        def fetch_page(after):
+            page_params = dict(params)
+            if after:
+                page_params["after"] = after
+            return self.get(url, page_params, **kwargs)
+
+        return self.paginate(fetch_page, prefetch=prefetch, token=params.get("access_token"))
+
+    def fetch_all(self, url: str, params: dict, **kwargs) -> list:
+        """Busca todas as páginas e devolve a lista concatenada de ``data``."""
+        rows = []
+        for page in self.iter_pages(url, params, **kwargs):
+            rows.extend(page.get("data", []))
+        return rows
+
+
+# ------------------------------------------------------------------------------
+# CLIENTE ASSÍNCRONO (aiohttp)
+# ------------------------------------------------------------------------------
+class AsyncGraphAPIClient:
+    """Versão asyncio do cliente, com ``aiohttp.TCPConnector`` keep-alive.
+
+    Uso::
+
+        async with AsyncGraphAPIClient() as client:
+            rows = await client.fetch_all(url, params, context=account_id)
+    """
+
+    def __init__(self, max_retries: int = 3, backoff_seconds: float = 1.0,
+                 limit: int = 100, limit_per_host: int = 30, timeout: float = GRAPH_TIMEOUT,
+                 governor: RateLimitGovernor | None = None):
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.governor = governor or get_governor()
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             trace_configs=[aiohttp_trace_config()])
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method: str, url: str, params: dict | None = None, data: dict | None = None,
+                      retries: int | None = None, context: str = "") -> dict:
+        """Mesmo contrato de ``GraphAPIClient.request`` (levanta ``GraphAPIError``)."""
+        import aiohttp
+
+        url = resolve_url(url)
+        retries = retries or self.max_retries
+        context_prefix = f"[{context}] " if context else ""
+        token = (params or {}).get("access_token") or (data or {}).get("access_token")
+        account_id = account_from_url(url)
+        last_error = None
+
+        with span("graph.request", method=method, path=_span_path(url), account_id=account_id,
+                  context=context or None) as current:
+            for attempt in range(retries):
+                current.set_attribute("attempts", attempt + 1)
+                wait = self.governor.reserve(token, account_id)
+                if wait > 0:
+                    record_sleep(wait, "rate_limit")
+                    with span("graph.rate_limit_wait", seconds=wait):
+                        await asyncio.sleep(wait)
+
+                headers = None
+                try:
+                    async with self.session.request(method, url, params=params, data=data) as resp:
+                        headers = resp.headers
+                        self.governor.record_response(token, account_id, headers)
+                        current.set_attribute("status", resp.status)
+                        if resp.content_length is not None:
+                            current.set_attribute("bytes", resp.content_length)
+                        if resp.status == 200:
+                            return await resp.json(content_type=None)
+                        text = await resp.text()
+                        try:
+                            payload = await resp.json(content_type=None)
+                        except ValueError:
+                            payload = None
+                        status = resp.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    kind = ERROR_TRANSIENT
+                    last_error = GraphAPIError(kind, message=str(e))
+                    current.set_attribute("error_kind", kind)
+                    logger.warning("%sErro de conexão – tentativa %s/%s: %s",
+                                   context_prefix, attempt + 1, retries, e)
+                else:
+                    kind = classify_error(status, payload)
+                    code, subcode, message = _error_details(payload)
+                    last_error = GraphAPIError(kind, status, code, subcode, message or text[:300])
+                    current.set_attribute("error_kind", kind)
+                    if kind not in RETRYABLE_ERRORS:
+                        logger.error("%sErro %s (%s) – sem nova tentativa: %s",
+                                     context_prefix, status, kind, text[:500])
+                        raise last_error
+                    logger.warning("%sErro %s (%s) – tentativa %s/%s: %s",
+                                   context_prefix, status, kind, attempt + 1, retries, text[:500])
+
+                if kind == ERROR_RATE_LIMIT:
+                    self.governor.record_throttle(token, account_id, self.backoff_seconds * (2 ** attempt) * 2,
+                                                  account_level=is_account_level_limit(last_error.code),
+                                                  headers=headers)
+                elif attempt + 1 < retries:
+                    backoff = self.backoff_seconds * (2 ** attempt)
+                    record_sleep(backoff)
+                    with span("graph.backoff", seconds=backoff, error_kind=kind):
+                        await asyncio.sleep(backoff)
+
+            logger.error("%s❌ Todas as tentativas falharam para: %s", context_prefix, url)
+            raise last_error
+
+    async def get(self, url: str, params: dict | None = None, retries: int | None = None,
+                  context: str = "") -> dict | None:
+        try:
+            return await self.request("GET", url, params=params, retries=retries, context=context)
+        except GraphAPIError:
+            return None
+
+    async def paginate(self, fetch_page, prefetch: bool = True):
+        """Versão async de ``GraphAPIClient.paginate`` (``fetch_page`` é uma corrotina)."""
+        page = await fetch_page(None)
+        pending = None
+        try:
+            while page:
+                after = _next_cursor(page)
+                if after and prefetch:
+                    pending = asyncio.ensure_future(fetch_page(after))
+                yield page
+                if not after:
+                    break
+                page = await pending if pending is not None else await fetch_page(after)
+                pending = None
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def iter_pages(self, url: str, params: dict, prefetch: bool = True, **kwargs):
+        async def fetch_page(after):
+            page_params = dict(params)
+            if after:
+                page_params["after"] = after
+            return await self.get(url, page_params, **kwargs)
+
+        async for page in self.paginate(fetch_page, prefetch=prefetch):
+            yield page
+
+    async def fetch_all(self, url: str, params: dict, **kwargs) -> list:
+        rows = []
+        async for page in self.iter_pages(url, params, **kwargs):
+            rows.extend(page.get("data", []))
+        return rows
+
+
+# ------------------------------------------------------------------------------
+# INSTÂNCIA COMPARTILHADA
+# ------------------------------------------------------------------------------
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_graph_client(**kwargs) -> GraphAPIClient:
+    """Devolve o cliente único do processo (criado na primeira chamada com ``kwargs``)."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = GraphAPIClient(**kwargs)
+        return _shared_client
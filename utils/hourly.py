@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Transformações vetorizadas dos insights com breakdown por hora
+────────────────────────────────────────────────────────────────
+Os scripts horários e os ``_utc_*`` percorriam o DataFrame com
+``iterrows()`` + ``row.to_dict()``, procurando o ``link_click`` em
+``actions`` e cortando ``campaign_name`` linha a linha. Aqui as mesmas
+operações são feitas por coluna (``explode`` em ``actions``, métodos
+``.str``), e o intervalo "13:00:00 - 13:59:59" vira a hora inteira 13.
+"""
+
+import pandas as pd
+
+# Breakdown por hora no fuso da conta
+HOURLY_BREAKDOWN = "hourly_stats_aggregated_by_advertiser_time_zone"
+
+
+def hour_from_interval(intervals: pd.Series) -> pd.Series:
+    """"13:00:00 - 13:59:59" → 13 (``Int64``; ``<NA>`` quando o formato não bate)."""
+    hours = pd.to_numeric(intervals.astype("string").str.extract(r"^\s*(\d{1,2}):", expand=False),
+                          errors="coerce")
+    return hours.where(hours.between(0, 23)).astype("Int64")
+
+
+def first_action_value(actions: pd.Series, action_type: str) -> pd.Series:
+    """``value`` da primeira ação ``action_type`` de cada lista em ``actions`` (0 se não houver).
+
+    O índice de ``actions`` precisa ser único.
+    """
+    items = actions.explode().dropna()
+    if items.empty:
+        return pd.Series(0.0, index=actions.index)
+    frame = pd.DataFrame(items.tolist(), index=items.index)
+    if "action_type" not in frame.columns or "value" not in frame.columns:
+        return pd.Series(0.0, index=actions.index)
+    values = frame.loc[frame["action_type"] == action_type, "value"]
+    values = values[~values.index.duplicated()]
+    return pd.to_numeric(values, errors="coerce").reindex(actions.index).fillna(0.0)
+
+
+def first_list_value(column: pd.Series) -> pd.Series:
+    """``value`` do primeiro item de cada lista (ex: ``conversions``); NaN se não houver."""
+    return pd.to_numeric(column.str[0].str.get("value"), errors="coerce")
+
+
+def campaign_site_name(names: pd.Series) -> pd.Series:
+    """Dois primeiros caracteres do nome da campanha ("N/A" se o nome for menor)."""
+    names = names.fillna("").astype(str)
+    return names.str[:2].where(names.str.len() >= 2, "N/A")
+
+
+def campaign_category(names: pd.Series) -> pd.Series:
+    """Tudo antes do terceiro "_" do nome da campanha (o nome inteiro se tiver menos partes)."""
+    names = names.fillna("").astype(str)
+    parts = names.str.split("_", n=3, expand=True).reindex(columns=range(4))
+    category = parts[0] + "_" + parts[1] + "_" + parts[2]
+    return category.where(parts[2].notna(), names)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Relatórios assíncronos de insights (Graph API)
+───────────────────────────────────────────────
+Para contas pesadas (``PROBLEMATIC_ACCOUNTS`` ou que respondem "Please reduce
+the amount of data"), em vez de centenas de páginas de 25 linhas com
+back-off, o relatório roda no servidor do Facebook:
+
+1. ``POST /act_X/insights``            → ``report_run_id``
+2. ``GET /<report_run_id>``            → ``async_status`` até "Job Completed"
+3. ``GET /<report_run_id>/insights``   → resultado em páginas grandes
+
+Opcionalmente o mesmo relatório é exportado em CSV
+(``/ads/ads_insights/export_report``) para ``ASYNC_REPORT_CSV_DIR``.
+"""
+
+import os
+import time
+import logging
+
+from utils.graph_api import GraphAPIClient
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Intervalo entre consultas ao status do relatório (em segundos)
+ASYNC_REPORT_POLL_SECONDS = float(os.getenv("ASYNC_REPORT_POLL_SECONDS", "5"))
+# Tempo máximo de espera pelo relatório (em segundos)
+ASYNC_REPORT_TIMEOUT = float(os.getenv("ASYNC_REPORT_TIMEOUT", "900"))
+# Linhas por página no download do resultado
+ASYNC_REPORT_PAGE_LIMIT = int(os.getenv("ASYNC_REPORT_PAGE_LIMIT", "500"))
+# Pasta para a cópia CSV de cada relatório (vazio = não exporta)
+ASYNC_REPORT_CSV_DIR = os.getenv("ASYNC_REPORT_CSV_DIR", "")
+
+ASYNC_REPORT_EXPORT_URL = "https://www.facebook.com/ads/ads_insights/export_report/"
+
+JOB_COMPLETED = "Job Completed"
+JOB_FAILED_STATUSES = {"Job Failed", "Job Skipped"}
+
+
+class AsyncReportError(Exception):
+    """O relatório assíncrono falhou, foi ignorado pelo Facebook ou estourou o tempo."""
+
+
+def start_report(client: GraphAPIClient, url: str, params: dict, context: str = "") -> str:
+    """Dispara o relatório (``POST .../insights``) e devolve o ``report_run_id``."""
+    data = {k: v for k, v in params.items() if k not in ("limit", "after")}
+    response = client.request("POST", url, data=data, context=context)
+    report_run_id = (response or {}).get("report_run_id")
+    if not report_run_id:
+        raise AsyncReportError(f"Resposta sem report_run_id: {response}")
+    return report_run_id
+
+
+def wait_for_report(client: GraphAPIClient, report_run_id: str, token: str, context: str = "",
+                    poll_seconds: float = ASYNC_REPORT_POLL_SECONDS,
+                    timeout: float = ASYNC_REPORT_TIMEOUT) -> dict:
+    """Consulta ``async_status`` até o relatório terminar.
+
+    Raises:
+        AsyncReportError: relatório falhou/foi ignorado ou passou de ``timeout``
+    """
+    context_prefix = f"[{context}] " if context else ""
+    params = {"access_token": token, "fields": "async_status,async_percent_completion"}
+    deadline = time.monotonic() + timeout
+    last_pct = None
+
+    while True:
+        status = client.request("GET", report_run_id, params=params, context=context) or {}
+        async_status = status.get("async_status")
+        pct = status.get("async_percent_completion")
+        if async_status == JOB_COMPLETED:
+            return status
+        if async_status in JOB_FAILED_STATUSES:
+            raise AsyncReportError(f"Relatório {report_run_id}: {async_status}")
+        if pct != last_pct:
+            logger.info("%s⏳ Relatório %s: %s (%s%%)", context_prefix, report_run_id, async_status, pct)
+            last_pct = pct
+        if time.monotonic() >= deadline:
+            raise AsyncReportError(f"Relatório {report_run_id} não terminou em {timeout:.0f}s ({async_status})")
+        time.sleep(poll_seconds)
+
+
+def download_report(client: GraphAPIClient, report_run_id: str, token: str, context: str = "") -> list:
+    """Baixa o resultado do relatório em páginas de ``ASYNC_REPORT_PAGE_LIMIT`` linhas.
+
+    Raises:
+        GraphAPIError: uma página falhou depois das tentativas do cliente (o
+            relatório nunca volta pela metade como se estivesse completo)
+    """
+    url = f"{report_run_id}/insights"
+
+    def fetch_page(after):
+        params = {"access_token": token, "limit": ASYNC_REPORT_PAGE_LIMIT}
+        if after:
+            params["after"] = after
+        # request (e não get/fetch_all): a falha sobe em vez de encerrar a paginação
+        return client.request("GET", url, params=params, context=context)
+
+    rows = []
+    for page in client.paginate(fetch_page, token=token):
+        rows.extend(page.get("data", []))
+    return rows
+
+
+def export_report_csv(client: GraphAPIClient, report_run_id: str, token: str, path: str,
+                      context: str = "") -> str:
+    """Salva o relatório em CSV pelo endpoint de exportação do Facebook.
+
+    As colunas do CSV usam os nomes de exibição do Gerenciador de Anúncios,
+    por isso ele serve como cópia de auditoria e não substitui o JSON.
+    """
+    params = {"report_run_id": report_run_id, "format": "csv", "access_token": token}
+    resp = client.session.get(ASYNC_REPORT_EXPORT_URL, params=params, timeout=client.timeout)
+    resp.raise_for_status()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(resp.content)
+    logger.info("%s💾 CSV do relatório %s salvo em %s", f"[{context}] " if context else "", report_run_id, path)
+    return path
+
+
+def fetch_insights_report(client: GraphAPIClient, url: str, params: dict, context: str = "",
+                          csv_dir: str = ASYNC_REPORT_CSV_DIR) -> list:
+    """Executa a consulta de insights como relatório assíncrono e devolve as linhas.
+
+    Args:
+        client: Cliente da Graph API
+        url: URL de insights da conta (``.../act_X/insights``)
+        params: Mesmos parâmetros da consulta síncrona (``limit``/``after`` são ignorados)
+        context: Contexto para logs (ex: account_id)
+        csv_dir: Pasta para a cópia CSV (vazio = não exporta)
+
+    Returns:
+        Lista de linhas no mesmo formato do ``data`` da consulta síncrona
+    """
+    token = params.get("access_token")
+    started = time.monotonic()
+    report_run_id = start_report(client, url, params, context=context)
+    logger.info("📨 [%s] Relatório assíncrono %s criado", context, report_run_id)
+
+    wait_for_report(client, report_run_id, token, context=context)
+    rows = download_report(client, report_run_id, token, context=context)
+    logger.info("📥 [%s] Relatório %s: %s linhas em %.1fs",
+                context, report_run_id, len(rows), time.monotonic() - started)
+
+    if csv_dir:
+        try:
+            export_report_csv(client, report_run_id, token,
+                              os.path.join(csv_dir, f"{context or 'report'}_{report_run_id}.csv"), context=context)
+        except Exception as e:
+            logger.warning("⚠️ [%s] Falha ao exportar CSV do relatório %s: %s", context, report_run_id, e)
+    return rows
+
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Coleta multi-janela (hoje / ontem / anteontem) numa única passada
+──────────────────────────────────────────────────────────────────
+Os scripts ``cloud_facebook_{today,yesterday,historical}`` (e as variantes
+``_utc_``) consultam as mesmas contas e campos, mudando só o dia. Em vez de
+três execuções, o script ``today`` pode pedir ``time_range`` D-2..hoje com
+``time_increment=1`` uma vez por conta e distribuir as linhas por
+``date_start`` para a tabela de cada janela.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+# Dias antes de hoje de cada janela
+WINDOW_OFFSETS = {
+    "today": 0,
+    "yesterday": 1,
+    "historical": 2,
+}
+
+
+def parse_windows(value: str) -> list:
+    """Converte ``"today,yesterday"`` em lista validada, na ordem de ``WINDOW_OFFSETS``."""
+    names = {w.strip().lower() for w in (value or "").split(",") if w.strip()}
+    unknown = names - set(WINDOW_OFFSETS)
+    if unknown:
+        raise ValueError(f"Janelas desconhecidas: {sorted(unknown)} (válidas: {list(WINDOW_OFFSETS)})")
+    return [w for w in WINDOW_OFFSETS if w in names]
+
+
+def window_dates(windows: list, now: datetime) -> dict:
+    """Data (YYYY-MM-DD) de cada janela, no fuso de ``now``."""
+    return {w: (now - timedelta(days=WINDOW_OFFSETS[w])).strftime("%Y-%m-%d") for w in windows}
+
+
+def time_range_for(dates: dict) -> str:
+    """``time_range`` (JSON) cobrindo todas as datas das janelas."""
+    return json.dumps({"since": min(dates.values()), "until": max(dates.values())})
+
+
+def split_by_window(df, dates: dict, column: str = "date_start") -> dict:
+    """Separa as linhas de ``df`` por janela conforme o dia de ``column``.
+
+    Returns:
+        dict janela -> DataFrame (vazio quando a janela não teve linhas)
+    """
+    import pandas as pd
+
+    if df.empty or column not in df.columns:
+        return {w: df.iloc[0:0] for w in dates}
+    days = pd.to_datetime(df[column], errors="coerce").dt.strftime("%Y-%m-%d")
+    return {w: df[days == day].reset_index(drop=True) for w, day in dates.items()}
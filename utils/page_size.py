@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Tamanho de página adaptativo para os insights da Graph API
+────────────────────────────────────────────────────────────
+Em vez de pedir sempre 25 linhas por página, cada conta começa em
+``GRAPH_PAGE_SIZE_START`` (500) e só cai pela metade quando a API responde
+"Please reduce the amount of data" ou HTTP 5xx. O último tamanho que
+funcionou fica salvo por conta (``utils.state``) e é o ponto de partida da
+próxima execução; contas que passam uma execução inteira sem erro voltam a
+dobrar até o máximo.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from utils.graph_api import ERROR_REDUCE_DATA, ERROR_TRANSIENT, GraphAPIError
+from utils.run_metrics import record_sleep
+from utils.state import load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Tamanho inicial (e máximo) da página
+GRAPH_PAGE_SIZE_START = int(os.getenv("GRAPH_PAGE_SIZE_START", "500"))
+# Menor tamanho antes de desistir da paginação síncrona
+GRAPH_PAGE_SIZE_MIN = int(os.getenv("GRAPH_PAGE_SIZE_MIN", "25"))
+# Tentativas no mesmo tamanho para erros de conexão/timeout
+GRAPH_PAGE_RETRIES = int(os.getenv("GRAPH_PAGE_RETRIES", "3"))
+
+# Tipos de erro que a página precisa receber na hora (sem retry no cliente)
+PAGE_SIZE_FAIL_FAST = (ERROR_REDUCE_DATA, ERROR_TRANSIENT)
+
+
+class PageSizeMemory:
+    """Último tamanho de página bom por conta, persistido em JSON."""
+
+    def __init__(self, namespace: str):
+        self.filename = f"graph_page_sizes_{namespace}.json"
+        self._sizes = load_json(self.filename, default={}) or {}
+        self._lock = threading.Lock()
+
+    def get(self, account_id: str, default: int = GRAPH_PAGE_SIZE_START) -> int:
+        with self._lock:
+            return int(self._sizes.get(account_id, default))
+
+    def set(self, account_id: str, size: int) -> None:
+        with self._lock:
+            if self._sizes.get(account_id) == size:
+                return
+            self._sizes[account_id] = size
+            snapshot = dict(self._sizes)
+        save_json(self.filename, snapshot)
+
+
+_memories = {}
+_memories_lock = threading.Lock()
+
+
+def get_page_size_memory(namespace: str) -> PageSizeMemory:
+    """Memória compartilhada por todas as threads do processo para um ``namespace``."""
+    with _memories_lock:
+        if namespace not in _memories:
+            _memories[namespace] = PageSizeMemory(namespace)
+        return _memories[namespace]
+
+
+def _should_shrink(error: GraphAPIError) -> bool:
+    if error.kind == ERROR_REDUCE_DATA:
+        return True
+    return error.kind == ERROR_TRANSIENT and (error.status or 0) >= 500
+
+
+class AdaptivePageSize:
+    """Controla o ``limit`` das páginas de uma conta durante a paginação.
+
+    Uso::
+
+        pager = AdaptivePageSize(acc, memory)
+        pages = GRAPH_CLIENT.paginate(lambda after: pager.fetch(lambda limit: get_page(after, limit)))
+        ...
+        pager.finish()
+
+    ``fetch_page(limit)`` deve levantar ``GraphAPIError`` para os tipos em
+    ``PAGE_SIZE_FAIL_FAST`` (``fail_fast=PAGE_SIZE_FAIL_FAST`` no cliente).
+    """
+
+    def __init__(self, account_id: str, memory: PageSizeMemory | None = None,
+                 start: int = GRAPH_PAGE_SIZE_START, min_size: int = GRAPH_PAGE_SIZE_MIN,
+                 retries: int = GRAPH_PAGE_RETRIES, backoff_seconds: float = 5.0):
+        self.account_id = account_id
+        self.memory = memory
+        self.max_size = start
+        self.min_size = min_size
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.size = memory.get(account_id, start) if memory else start
+        self.shrunk = False
+        self.pages = 0
+
+    def fetch(self, fetch_page):
+        """Busca uma página, reduzindo o ``limit`` pela metade quando a API pede.
+
+        Raises:
+            GraphAPIError: ainda "reduce data" no tamanho mínimo (o chamador
+                pode cair no relatório assíncrono) ou erro de conexão persistente
+        """
+        attempt = 0
+        while True:
+            try:
+                page = fetch_page(self.size)
+            except GraphAPIError as e:
+                if _should_shrink(e) and self.size > self.min_size:
+                    new_size = max(self.min_size, self.size // 2)
+                    logger.warning("📉 [%s] %s com limit=%s – tentando limit=%s",
+                                   self.account_id, e.kind, self.size, new_size)
+                    self.size = new_size
+                    self.shrunk = True
+                    continue
+                if e.kind == ERROR_TRANSIENT and attempt + 1 < self.retries:
+                    record_sleep(self.backoff_seconds * (2 ** attempt))
+                    time.sleep(self.backoff_seconds * (2 ** attempt))
+                    attempt += 1
+                    continue
+                raise
+            self.pages += 1
+            return page
+
+    def finish(self) -> None:
+        """Salva o tamanho para a próxima execução (dobra se não houve redução)."""
+        if self.memory is None or self.pages == 0:
+            return
+        size = self.size if self.shrunk else min(self.max_size, self.size * 2)
+        self.memory.set(self.account_id, size)
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Perfis de CPU e memória por etapa (opcional)
+─────────────────────────────────────────────
+Os spans (``utils.tracing``) mostram quanto tempo cada etapa levou, mas não
+em que funções o tempo foi gasto nem quem alocou a memória. Para perfilar uma
+execução real era preciso alterar o código.
+
+Com ``PROFILE_MODE`` ligado, as funções marcadas com ``@profiled()``
+(``process_group``, ``process_all``, ``transform_campaigns``,
+``consolidate_and_upload_by_table``, ``ca_google_ads_today``,
+``run_gam_collection``) rodam sob:
+
+- ``cpu``: ``cProfile``. As tarefas que a etapa submete ao ``RunScheduler``
+  são perfiladas na thread do worker e somadas à etapa, então o perfil de
+  ``process_all`` inclui as requisições das contas. Uma etapa aninhada em
+  outra também entra no perfil da etapa de fora. No Python 3.12+ o
+  ``cProfile`` usa ``sys.monitoring``, que só aceita um profiler no processo:
+  um único perfil fica ligado enquanto houver etapa aberta (ele já vê todas as
+  threads) e vai para todas as etapas abertas no período.
+- ``memory``: ``tracemalloc``. A diferença entre os snapshots do início e do
+  fim da etapa, por linha. O ``tracemalloc`` é do processo inteiro: com grupos
+  em paralelo, a diferença inclui o que as outras threads alocaram no período.
+
+As chamadas da mesma etapa (ex: um ``process_group`` por grupo) são somadas.
+``export_profiles`` (chamado junto do ``export_spans`` e do
+``save_run_metrics``) grava os artefatos ao lado do JSONL de spans:
+
+- ``<script>_<execution_id>.<etapa>.prof``: abre com ``pstats`` / snakeviz
+- ``<script>_<execution_id>.<etapa>.txt``: top funções por tempo acumulado e próprio
+- ``<script>_<execution_id>.<etapa>.mem.txt``: top linhas por memória alocada
+
+Desligado (o padrão), ``@profiled()`` só chama a função. Se o profiler não
+puder ser ligado (ex: outra ferramenta já ativa), a etapa roda sem perfil e
+o motivo vai para o log: erro do perfil nunca chega à função perfilada.
+"""
+
+import io
+import os
+import sys
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+import functools
+import threading
+import contextvars
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from utils.tracing import TRACE_DIR
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# "cpu", "memory" ou "cpu,memory" (vazio = desligado)
+_MODE_ALIASES = {"cprofile": "cpu", "tracemalloc": "memory"}
+PROFILE_MODES = {
+    _MODE_ALIASES.get(mode.strip().lower(), mode.strip().lower())
+    for mode in os.getenv("PROFILE_MODE", "").split(",") if mode.strip() and mode.strip().lower() not in ("0", "off")
+}
+# Só estas etapas (separadas por vírgula; vazio = todas)
+PROFILE_STAGES = {s.strip() for s in os.getenv("PROFILE_STAGES", "").split(",") if s.strip()}
+# Pasta dos artefatos (padrão: junto dos spans)
+PROFILE_DIR = os.getenv("PROFILE_DIR", TRACE_DIR)
+# Linhas nos resumos em texto
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+# Quadros de pilha guardados pelo tracemalloc por alocação
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+# Python 3.12+: cProfile sobre sys.monitoring, um profiler por processo (vê todas as threads)
+SHARED_CPU_PROFILE = sys.version_info >= (3, 12)
+
+
+class _Stage:
+    """Perfis acumulados de uma etapa nesta execução."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.profiles = []      # cProfile.Profile já desligados
+        self.memory = {}        # (arquivo, linha) -> [bytes, blocos]
+        self.peak_bytes = 0
+        self.lock = threading.Lock()
+
+    def add_profile(self, profile) -> None:
+        with self.lock:
+            self.profiles.append(profile)
+
+    def add_memory(self, diff: list, peak_bytes: int) -> None:
+        with self.lock:
+            for stat in diff:
+                frame = stat.traceback[0]
+                entry = self.memory.setdefault((frame.filename, frame.lineno), [0, 0])
+                entry[0] += stat.size_diff
+                entry[1] += stat.count_diff
+            self.peak_bytes = max(self.peak_bytes, peak_bytes)
+
+
+_stages = {}
+_stages_lock = threading.Lock()
+
+# Etapas com cProfile ativas no contexto atual (as tarefas submetidas somam nelas)
+_active_cpu = contextvars.ContextVar("profiling_active_cpu", default=())
+# Pilha de perfis ligados na thread (só um cProfile recebe eventos por vez)
+_thread = threading.local()
+# Perfil único do processo (3.12+): etapas abertas e quem recebe o perfil ao fechar
+_shared_profile = None
+_shared_open = 0
+_shared_collectors = {}
+_shared_lock = threading.Lock()
+# Avisos de falha do profiler já registrados (um por motivo)
+_warned = set()
+# Etapas com tracemalloc em andamento (o último a sair desliga, se foi daqui que ligou)
+_tracing_stages = 0
+_tracing_owned = False
+_tracing_lock = threading.Lock()
+
+
+def profiling_enabled(stage: str | None = None) -> bool:
+    """True se ``PROFILE_MODE`` está ligado (e ``stage`` está em ``PROFILE_STAGES``)."""
+    return bool(PROFILE_MODES) and (stage is None or not PROFILE_STAGES or stage in PROFILE_STAGES)
+
+
+def _stage(name: str) -> _Stage:
+    with _stages_lock:
+        return _stages.setdefault(name, _Stage(name))
+
+
+def _profile_stack() -> list:
+    stack = getattr(_thread, "stack", None)
+    if stack is None:
+        stack = _thread.stack = []
+    return stack
+
+
+def _warn_once(key: str, message: str, *args) -> None:
+    if key not in _warned:
+        _warned.add(key)
+        logger.warning(message, *args)
+
+
+def _resume(stack: list) -> None:
+    if stack:
+        try:
+            stack[-1].enable()
+        except Exception as e:
+            _warn_once("resume", "⚠️ Perfil de CPU externo não religou (%s) – segue sem ele", e)
+
+
+@contextmanager
+def _thread_cpu_profile(collectors: tuple):
+    """Liga um ``cProfile`` na thread; ao sair, o perfil vai para todos os ``collectors``."""
+    stack = _profile_stack()
+    profile = cProfile.Profile()
+    try:
+        if stack:
+            # O perfil de fora pausa; o de dentro também é somado nele (via collectors)
+            stack[-1].disable()
+        profile.enable()
+    except Exception as e:
+        _warn_once("enable", "⚠️ Perfil de CPU não ligou (%s) – etapa segue sem perfil", e)
+        _resume(stack)
+        profile = None
+    if profile is None:
+        yield
+        return
+    stack.append(profile)
+    try:
+        yield
+    finally:
+        try:
+            profile.disable()
+            # remove e não pop: corrotinas podem abrir e fechar etapas intercaladas
+            stack.remove(profile)
+            _resume(stack)
+            for collector in collectors:
+                collector.add_profile(profile)
+        except Exception as e:
+            _warn_once("disable", "⚠️ Perfil de CPU descartado: %s", e)
+
+
+@contextmanager
+def _shared_cpu_profile(collectors: tuple):
+    """Junta o bloco ao perfil único do processo; o último a sair entrega o perfil aos ``collectors``."""
+    global _shared_profile, _shared_open, _shared_collectors
+    with _shared_lock:
+        if _shared_open == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                _shared_profile = profile
+            except Exception as e:
+                _warn_once("enable", "⚠️ Perfil de CPU não ligou (%s) – etapa segue sem perfil", e)
+        joined = _shared_profile is not None
+        if joined:
+            _shared_open += 1
+            _shared_collectors.update(dict.fromkeys(collectors))
+    try:
+        yield
+    finally:
+        if joined:
+            profile, stages = None, ()
+            with _shared_lock:
+                _shared_open -= 1
+                if _shared_open == 0:
+                    profile, _shared_profile = _shared_profile, None
+                    stages, _shared_collectors = _shared_collectors, {}
+            if profile is not None:
+                try:
+                    profile.disable()
+                    for stage in stages:
+                        stage.add_profile(profile)
+                except Exception as e:
+                    _warn_once("disable", "⚠️ Perfil de CPU descartado: %s", e)
+
+
+_cpu_profile = _shared_cpu_profile if SHARED_CPU_PROFILE else _thread_cpu_profile
+
+
+def _start_tracemalloc():
+    global _tracing_stages, _tracing_owned
+    with _tracing_lock:
+        if _tracing_stages == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _tracing_owned = True
+        _tracing_stages += 1
+    return tracemalloc.take_snapshot()
+
+
+def _stop_tracemalloc(stage: _Stage, before) -> None:
+    global _tracing_stages, _tracing_owned
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    with _tracing_lock:
+        _tracing_stages -= 1
+        if _tracing_stages == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    stage.add_memory(diff, peak)
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Perfila o bloco como a etapa ``name`` (não faz nada com ``PROFILE_MODE`` desligado).
+
+    Uso::
+
+        with profile_stage("load"):
+            upload(df)
+    """
+    if not profiling_enabled(name):
+        yield
+        return
+    stage = _stage(name)
+    start = time.perf_counter()
+    before = None
+    if "memory" in PROFILE_MODES:
+        try:
+            before = _start_tracemalloc()
+        except Exception as e:
+            _warn_once("tracemalloc", "⚠️ tracemalloc não ligou (%s) – etapa segue sem perfil de memória", e)
+    token = None
+    try:
+        if "cpu" in PROFILE_MODES:
+            collectors = _active_cpu.get() + (stage,)
+            token = _active_cpu.set(collectors)
+            with _cpu_profile(collectors):
+                yield
+        else:
+            yield
+    finally:
+        if token is not None:
+            _active_cpu.reset(token)
+        if before is not None:
+            try:
+                _stop_tracemalloc(stage, before)
+            except Exception as e:
+                _warn_once("tracemalloc", "⚠️ Perfil de memória descartado: %s", e)
+        with stage.lock:
+            stage.calls += 1
+            stage.seconds += time.perf_counter() - start
+
+
+def profiled(name: str | None = None):
+    """Decorator que roda a função dentro de ``profile_stage`` (nome padrão: o da função).
+
+    Funciona com funções comuns e ``async``. Numa corrotina o ``cProfile`` vê
+    o event loop inteiro enquanto a etapa está aberta.
+    """
+
+    def decorator(fn):
+        stage = name or fn.__name__
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with profile_stage(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def profile_task(fn):
+    """``fn`` perfilada na thread que a executar, somando nas etapas abertas agora.
+
+    Usado pelo ``RunScheduler`` ao submeter tarefas; sem etapa de CPU aberta
+    (ou com o perfil único do 3.12+, que já vê a thread do worker) devolve
+    ``fn`` como está.
+    """
+    collectors = _active_cpu.get()
+    if not collectors or SHARED_CPU_PROFILE:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _cpu_profile(collectors):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# ------------------------------------------------------------------------------
+# EXPORTAÇÃO
+# ------------------------------------------------------------------------------
+def _cpu_report(stage: _Stage, stats: pstats.Stats) -> str:
+    out = io.StringIO()
+    out.write(f"Etapa {stage.name}: {stage.calls} chamadas, {stage.seconds:.2f}s, "
+              f"{len(stage.profiles)} perfis (threads/tarefas)\n")
+    for sort in ("cumulative", "tottime"):
+        out.write(f"\n== Top {PROFILE_TOP} por {sort} ==\n")
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(PROFILE_TOP)
+    return out.getvalue()
+
+
+def _memory_report(stage: _Stage) -> str:
+    top = sorted(stage.memory.items(), key=lambda item: abs(item[1][0]), reverse=True)[:PROFILE_TOP]
+    lines = [f"Etapa {stage.name}: {stage.calls} chamadas, {stage.seconds:.2f}s, "
+             f"pico rastreado pelo tracemalloc {stage.peak_bytes / 1e6:.1f} MB", "",
+             f"{'MB':>10} {'blocos':>10}  linha"]
+    for (filename, lineno), (size, count) in top:
+        lines.append(f"{size / 1e6:>10.2f} {count:>10}  {filename}:{lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def drain_profiles() -> dict:
+    """Tira as etapas acumuladas (``{nome: _Stage}``) e começa do zero."""
+    global _stages
+    with _stages_lock:
+        stages, _stages = _stages, {}
+    return stages
+
+
+def export_profiles(script_name: str, execution_id: str | None = None) -> list:
+    """Grava os perfis das etapas em ``PROFILE_DIR``.
+
+    Falhas só vão para o log: o perfil nunca derruba a execução.
+
+    Args:
+        script_name: Mesmo nome usado em ``cloud_facebook_executions``
+        execution_id: Id da execução (o mesmo dos spans)
+
+    Returns:
+        Caminhos dos arquivos gravados
+    """
+    stages = drain_profiles()
+    if not stages:
+        return []
+    execution_id = execution_id or datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    prefix = os.path.join(PROFILE_DIR, f"{script_name}_{execution_id}")
+    paths = []
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for stage in stages.values():
+            if stage.profiles:
+                stats = pstats.Stats(*stage.profiles)
+                stats.dump_stats(f"{prefix}.{stage.name}.prof")
+                with open(f"{prefix}.{stage.name}.txt", "w", encoding="utf-8") as f:
+                    f.write(_cpu_report(stage, stats))
+                paths += [f"{prefix}.{stage.name}.prof", f"{prefix}.{stage.name}.txt"]
+            if stage.memory:
+                with open(f"{prefix}.{stage.name}.mem.txt", "w", encoding="utf-8") as f:
+                    f.write(_memory_report(stage))
+                paths.append(f"{prefix}.{stage.name}.mem.txt")
+    except Exception as e:
+        logger.warning("⚠️ Não foi possível gravar os perfis em %s: %s", PROFILE_DIR, e)
+    for path in paths:
+        logger.info("🔬 Perfil gravado em %s", path)
+    return paths
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Governador de rate limit da Graph API
+──────────────────────────────────────
+Lê os headers de uso devolvidos em TODAS as respostas da Graph API e
+mantém um orçamento por token e por conta de anúncio:
+
+- ``X-App-Usage``                 → uso da aplicação/usuário (por token)
+- ``X-Business-Use-Case-Usage``   → uso por business (por token), com
+                                    ``estimated_time_to_regain_access``
+- ``X-Ad-Account-Usage``          → uso da conta (``acc_id_util_pct``)
+
+Enquanto o uso fica abaixo de ``GRAPH_USAGE_TARGET_PCT`` as requisições
+saem sem espera. Entre o alvo e ``GRAPH_USAGE_MAX_PCT`` o intervalo entre
+requisições cresce linearmente até ``GRAPH_MAX_PACING_DELAY``. Acima do
+máximo, ou depois de um erro de rate limit, a chave fica bloqueada até o
+tempo estimado de recuperação — para todas as threads que usam o mesmo
+token/conta, e não só para a que recebeu o erro.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Uso (%) a partir do qual as requisições passam a ser espaçadas
+GRAPH_USAGE_TARGET_PCT = float(os.getenv("GRAPH_USAGE_TARGET_PCT", "75"))
+# Uso (%) a partir do qual a chave é pausada até o uso baixar
+GRAPH_USAGE_MAX_PCT = float(os.getenv("GRAPH_USAGE_MAX_PCT", "95"))
+# Intervalo máximo entre requisições na faixa alvo → máximo (segundos)
+GRAPH_MAX_PACING_DELAY = float(os.getenv("GRAPH_MAX_PACING_DELAY", "5.0"))
+# Pausa quando o uso passa do máximo e a API não informa o tempo de recuperação
+GRAPH_THROTTLE_PAUSE = float(os.getenv("GRAPH_THROTTLE_PAUSE", "60.0"))
+
+_ACCOUNT_RE = re.compile(r"/(act_\d+)")
+
+
+def token_key(token: str | None) -> str:
+    """Identificador estável do token para logs e chaves (nunca o token em si)."""
+    if not token:
+        return "token:anon"
+    return "token:" + hashlib.sha1(token.encode("utf-8")).hexdigest()[:10]
+
+
+def account_from_url(url: str) -> str | None:
+    """Extrai ``act_<id>`` da URL da requisição, se houver."""
+    match = _ACCOUNT_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def _load_header(headers, name: str):
+    raw = headers.get(name) if headers is not None else None
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_usage_headers(headers) -> dict:
+    """Resume os headers de uso em percentuais e tempos de recuperação.
+
+    Os tempos de recuperação não querem dizer que a chave está bloqueada:
+    ``reset_time_duration`` (conta) vem em qualquer nível de uso, é a janela
+    em que o uso decai. Só valem no máximo de uso ou num erro de rate limit.
+
+    Returns:
+        dict com ``token_pct``, ``account_pct`` (None quando ausentes) e
+        ``token_regain_seconds``/``account_regain_seconds``
+    """
+    token_pct = None
+    token_regain = 0.0
+    account_pct = None
+    account_regain = 0.0
+
+    app_usage = _load_header(headers, "X-App-Usage")
+    if isinstance(app_usage, dict):
+        token_pct = max(float(app_usage.get(k, 0) or 0) for k in ("call_count", "total_time", "total_cputime"))
+
+    buc_usage = _load_header(headers, "X-Business-Use-Case-Usage")
+    if isinstance(buc_usage, dict):
+        for entries in buc_usage.values():
+            for entry in entries or []:
+                pct = max(float(entry.get(k, 0) or 0) for k in ("call_count", "total_time", "total_cputime"))
+                token_pct = pct if token_pct is None else max(token_pct, pct)
+                # estimated_time_to_regain_access vem em minutos
+                regain = float(entry.get("estimated_time_to_regain_access", 0) or 0) * 60
+                token_regain = max(token_regain, regain)
+
+    account_usage = _load_header(headers, "X-Ad-Account-Usage")
+    if isinstance(account_usage, dict):
+        account_pct = float(account_usage.get("acc_id_util_pct", 0) or 0)
+        account_regain = float(account_usage.get("reset_time_duration", 0) or 0)
+
+    return {
+        "token_pct": token_pct,
+        "token_regain_seconds": token_regain,
+        "account_pct": account_pct,
+        "account_regain_seconds": account_regain,
+    }
+
+
+class _Budget:
+    """Estado de uma chave (token ou conta)."""
+
+    __slots__ = ("usage_pct", "next_slot", "blocked_until")
+
+    def __init__(self):
+        self.usage_pct = 0.0
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+
+
+class RateLimitGovernor:
+    """Orçamento de requisições por token e por conta, guiado pelos headers de uso."""
+
+    def __init__(self, target_pct: float = GRAPH_USAGE_TARGET_PCT, max_pct: float = GRAPH_USAGE_MAX_PCT,
+                 max_pacing_delay: float = GRAPH_MAX_PACING_DELAY, throttle_pause: float = GRAPH_THROTTLE_PAUSE):
+        self.target_pct = target_pct
+        self.max_pct = max_pct
+        self.max_pacing_delay = max_pacing_delay
+        self.throttle_pause = throttle_pause
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self.total_wait_seconds = 0.0
+
+    def _budget(self, key: str) -> _Budget:
+        budget = self._budgets.get(key)
+        if budget is None:
+            budget = self._budgets[key] = _Budget()
+        return budget
+
+    def _keys(self, token: str | None, account_id: str | None) -> list:
+        keys = [token_key(token)]
+        if account_id:
+            keys.append(account_id)
+        return keys
+
+    def _interval(self, usage_pct: float) -> float:
+        if usage_pct < self.target_pct:
+            return 0.0
+        if usage_pct >= self.max_pct:
+            return self.throttle_pause
+        ratio = (usage_pct - self.target_pct) / (self.max_pct - self.target_pct)
+        return self.max_pacing_delay * ratio
+
+    def reserve(self, token: str | None, account_id: str | None = None) -> float:
+        """Reserva o próximo horário livre para uma requisição.
+
+        Returns:
+            Segundos que o chamador deve esperar antes de enviar a requisição
+        """
+        now = time.monotonic()
+        with self._lock:
+            budgets = [self._budget(k) for k in self._keys(token, account_id)]
+            slot = max([now] + [max(b.next_slot, b.blocked_until) for b in budgets])
+            for budget in budgets:
+                budget.next_slot = slot + self._interval(budget.usage_pct)
+            wait = slot - now
+            self.total_wait_seconds += wait
+        return wait
+
+    def record_response(self, token: str | None, account_id: str | None, headers) -> None:
+        """Atualiza os orçamentos com os headers de uso de uma resposta."""
+        usage = parse_usage_headers(headers)
+        now = time.monotonic()
+        with self._lock:
+            if usage["token_pct"] is not None:
+                self._update(token_key(token), usage["token_pct"], usage["token_regain_seconds"], now)
+            if account_id and usage["account_pct"] is not None:
+                self._update(account_id, usage["account_pct"], usage["account_regain_seconds"], now)
+
+    def _update(self, key: str, usage_pct: float, regain_seconds: float, now: float) -> None:
+        budget = self._budget(key)
+        crossed = budget.usage_pct < self.max_pct <= usage_pct
+        budget.usage_pct = usage_pct
+        # Abaixo do máximo o espaçamento fica por conta do next_slot (reserve)
+        if usage_pct >= self.max_pct:
+            budget.blocked_until = max(budget.blocked_until, now + (regain_seconds or self.throttle_pause))
+        if crossed:
+            logger.warning("🚦 [%s] Uso em %.0f%% – pausando novas requisições desta chave", key, usage_pct)
+
+    def record_throttle(self, token: str | None, account_id: str | None = None,
+                        fallback_seconds: float | None = None, account_level: bool = False,
+                        headers=None) -> float:
+        """Registra um erro de rate limit e bloqueia a chave afetada.
+
+        Args:
+            token: Token usado na requisição
+            account_id: Conta da requisição (quando houver)
+            fallback_seconds: Pausa quando os headers não informam o tempo de recuperação
+            account_level: True para limites da conta (80xxx), False para token/app (4, 17, 429)
+            headers: Headers da própria resposta de erro (None = sem resposta)
+
+        Returns:
+            Segundos até a chave ser liberada
+        """
+        key = account_id if (account_level and account_id) else token_key(token)
+        usage = parse_usage_headers(headers)
+        # O tempo de recuperação informado na própria resposta de erro tem prioridade
+        regain = usage["account_regain_seconds"] if (account_level and account_id) else usage["token_regain_seconds"]
+        pause = regain or (fallback_seconds if fallback_seconds is not None else self.throttle_pause)
+        now = time.monotonic()
+        with self._lock:
+            budget = self._budget(key)
+            budget.blocked_until = max(budget.blocked_until, now + pause)
+            remaining = budget.blocked_until - now
+        logger.warning("🚫 [%s] Rate limit – chave bloqueada por %.0f segundos", key, remaining)
+        return remaining
+
+    def usage(self, key: str) -> float:
+        with self._lock:
+            budget = self._budgets.get(key)
+            return budget.usage_pct if budget else 0.0
+
+    def available(self, token: str | None, account_id: str | None = None) -> bool:
+        """True quando nenhuma das chaves (token/conta) está bloqueada."""
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(token, account_id):
+                budget = self._budgets.get(key)
+                if budget and budget.blocked_until > now:
+                    return False
+        return True
+
+
+# ------------------------------------------------------------------------------
+# INSTÂNCIA COMPARTILHADA
+# ------------------------------------------------------------------------------
+_shared_governor = None
+_shared_lock = threading.Lock()
+
+
+def get_governor() -> RateLimitGovernor:
+    """Governador único do processo (os limites da Graph API são por token/conta, não por thread)."""
+    global _shared_governor
+    with _shared_lock:
+        if _shared_governor is None:
+            _shared_governor = RateLimitGovernor()
+        return _shared_governor
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Consumo de recursos por execução
+─────────────────────────────────
+As linhas de ``cloud_facebook_executions`` só traziam ``execution_time_seconds``
+(e no ``execute_notebook`` ele era a soma dos tempos dos grupos, que rodam em
+paralelo). Os jobs de Google Ads, GAM e helpers não registravam nada.
+
+``RunMeter`` mede uma execução inteira:
+
+- tempo real (wall clock) e tempo de CPU do processo
+- pico de memória residente (RSS) e de threads, amostrados em segundo plano
+  a cada ``RUN_METRICS_SAMPLE_SECONDS``
+- requisições HTTP e bytes enviados/recebidos: ``requests`` (Graph API,
+  helpers, clientes do Google Cloud), ``aiohttp`` (``aiohttp_trace_config``)
+  e gRPC (``grpc_interceptor``, Google Ads)
+- bytes enviados ao BigQuery por load e pela Storage Write API
+- segundos dormindo em backoff e em espera de rate limit (``record_sleep``)
+
+Os scripts de campanhas do Facebook gravam as métricas nas colunas novas de
+``cloud_facebook_executions``; os demais pontos de entrada usam
+``metered_run``, que grava uma linha por execução em ``RUN_METRICS_TABLE_ID``.
+
+Os contadores são do processo: as métricas assumem uma execução por vez,
+como rodam as Cloud Functions e o runner.
+"""
+
+import os
+import time
+import logging
+import asyncio
+import threading
+import contextvars
+import functools
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Tabela das execuções dos jobs fora de cloud_facebook_executions
+RUN_METRICS_TABLE_ID = os.getenv("RUN_METRICS_TABLE_ID", "data-v1-423414.test.cloud_run_executions")
+# Intervalo de amostragem de memória e threads (em segundos)
+RUN_METRICS_SAMPLE_SECONDS = float(os.getenv("RUN_METRICS_SAMPLE_SECONDS", "1.0"))
+
+# ------------------------------------------------------------------------------
+# CONTADORES
+# ------------------------------------------------------------------------------
+_totals = {"http_requests": 0, "http_bytes_out": 0, "http_bytes_in": 0,
+           "backoff_sleep_seconds": 0.0, "rate_limit_wait_seconds": 0.0}
+_totals_lock = threading.Lock()
+
+
+def record_http(bytes_out: int = 0, bytes_in: int = 0, count: int = 0) -> None:
+    with _totals_lock:
+        _totals["http_requests"] += count
+        _totals["http_bytes_out"] += bytes_out
+        _totals["http_bytes_in"] += bytes_in
+
+
+def record_sleep(seconds: float, kind: str = "backoff") -> None:
+    """Registra uma espera: ``kind`` = "backoff" (nova tentativa) ou "rate_limit"."""
+    key = "rate_limit_wait_seconds" if kind == "rate_limit" else "backoff_sleep_seconds"
+    with _totals_lock:
+        _totals[key] += seconds
+
+
+def http_totals() -> dict:
+    """Soma do processo (http_requests, http_bytes_out/in, backoff_sleep_seconds, rate_limit_wait_seconds)."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+# ------------------------------------------------------------------------------
+# GANCHOS HTTP
+# ------------------------------------------------------------------------------
+_http_meter_installed = False
+_install_lock = threading.Lock()
+
+
+def _body_size(body) -> int:
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return 0
+
+
+def install_http_meter() -> None:
+    """Conta as requisições feitas por qualquer ``requests.Session`` do processo.
+
+    ``requests.get``/``post`` e o transporte dos clientes do Google Cloud
+    passam por ``Session.send``; a contagem envolve esse método uma única vez.
+    """
+    global _http_meter_installed
+    with _install_lock:
+        if _http_meter_installed:
+            return
+        import requests
+
+        original_send = requests.Session.send
+
+        @functools.wraps(original_send)
+        def send(self, request, **kwargs):
+            response = original_send(self, request, **kwargs)
+            size = response.headers.get("Content-Length")
+            if size is None and not kwargs.get("stream"):
+                size = len(response.content or b"")
+            record_http(_body_size(request.body), int(size or 0), count=1)
+            return response
+
+        requests.Session.send = send
+        _http_meter_installed = True
+
+
+def aiohttp_trace_config():
+    """``aiohttp.TraceConfig`` que conta requisições e bytes (``ClientSession(trace_configs=[...])``)."""
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        record_http(count=1)
+
+    async def on_request_chunk_sent(session, context, params):
+        record_http(bytes_out=len(params.chunk))
+
+    async def on_response_chunk_received(session, context, params):
+        record_http(bytes_in=len(params.chunk))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
+
+
+def _message_size(message) -> int:
+    """Tamanho serializado de uma mensagem protobuf ou proto-plus."""
+    try:
+        return message.ByteSize()
+    except AttributeError:
+        try:
+            return type(message).pb(message).ByteSize()
+        except Exception:
+            return 0
+
+
+def grpc_interceptor():
+    """Interceptor gRPC que conta chamadas e bytes (``client.get_service(..., interceptors=[...])``).
+
+    Em chamadas com resposta em stream só o pedido é medido: as respostas
+    são consumidas pelo chamador.
+    """
+    import grpc
+
+    class _MeterInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+        def intercept_unary_unary(self, continuation, client_call_details, request):
+            record_http(bytes_out=_message_size(request), count=1)
+            response = continuation(client_call_details, request)
+
+            def done(call):
+                if call.exception() is None:
+                    record_http(bytes_in=_message_size(call.result()))
+
+            response.add_done_callback(done)
+            return response
+
+        def intercept_unary_stream(self, continuation, client_call_details, request):
+            record_http(bytes_out=_message_size(request), count=1)
+            return continuation(client_call_details, request)
+
+    return _MeterInterceptor()
+
+
+# ------------------------------------------------------------------------------
+# MEDIÇÃO DA EXECUÇÃO
+# ------------------------------------------------------------------------------
+def _rss_bytes() -> int:
+    """Memória residente atual do processo (0 se a plataforma não informar)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        # Sem /proc: o pico do processo (KB no Linux, bytes no macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def _transfer_totals() -> dict:
+    from utils.bq_load import load_totals
+    from utils.bq_write_stream import stream_totals
+
+    totals = http_totals()
+    totals["bq_upload_bytes"] = load_totals()["bytes"] + stream_totals()["bytes"]
+    return totals
+
+
+class RunMeter:
+    """Mede tempo, CPU, memória, threads e tráfego de uma execução.
+
+    Uso::
+
+        meter = RunMeter("cloud_facebook_today_complete").start()
+        ...
+        metrics = meter.finish()
+    """
+
+    def __init__(self, script_name: str, sample_seconds: float = RUN_METRICS_SAMPLE_SECONDS):
+        self.script_name = script_name
+        self.sample_seconds = sample_seconds
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, _rss_bytes())
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.sample_seconds):
+            self._sample()
+
+    def start(self) -> "RunMeter":
+        install_http_meter()
+        self.started_at = datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._baseline = _transfer_totals()
+        self._sample()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True, name="run-meter")
+        self._sampler.start()
+        return self
+
+    def finish(self) -> dict:
+        """Para a amostragem e devolve as métricas da execução (também vão para o log)."""
+        self._stop.set()
+        self._sample()
+        totals = _transfer_totals()
+        metrics = {
+            "wall_time_seconds": round(time.perf_counter() - self._wall, 3),
+            "cpu_seconds": round(time.process_time() - self._cpu, 3),
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+            "peak_threads": self.peak_threads,
+        }
+        for key, value in totals.items():
+            delta = value - self._baseline.get(key, 0)
+            metrics[key] = round(delta, 3) if isinstance(delta, float) else delta
+
+        logger.info("📏 %s: %.1fs reais, %.1fs de CPU, pico de %.0f MB e %s threads",
+                    self.script_name, metrics["wall_time_seconds"], metrics["cpu_seconds"],
+                    metrics["peak_rss_mb"], metrics["peak_threads"])
+        logger.info("📏 %s requisições HTTP (%.1f MB enviados, %.1f MB recebidos), %.1f MB para o BigQuery, "
+                    "%.1fs em backoff, %.1fs esperando rate limit",
+                    metrics["http_requests"], metrics["http_bytes_out"] / 1e6, metrics["http_bytes_in"] / 1e6,
+                    metrics["bq_upload_bytes"] / 1e6, metrics["backoff_sleep_seconds"],
+                    metrics["rate_limit_wait_seconds"])
+        return metrics
+
+
+def resource_schema() -> list:
+    """Colunas das métricas de ``RunMeter.finish`` (``bigquery.SchemaField``)."""
+    from google.cloud import bigquery
+
+    return [
+        bigquery.SchemaField("wall_time_seconds", "FLOAT"),
+        bigquery.SchemaField("cpu_seconds", "FLOAT"),
+        bigquery.SchemaField("peak_rss_mb", "FLOAT"),
+        bigquery.SchemaField("peak_threads", "INTEGER"),
+        bigquery.SchemaField("http_requests", "INTEGER"),
+        bigquery.SchemaField("http_bytes_out", "INTEGER"),
+        bigquery.SchemaField("http_bytes_in", "INTEGER"),
+        bigquery.SchemaField("bq_upload_bytes", "INTEGER"),
+        bigquery.SchemaField("backoff_sleep_seconds", "FLOAT"),
+        bigquery.SchemaField("rate_limit_wait_seconds", "FLOAT"),
+    ]
+
+
+def save_run_metrics(script_name: str, started_at: datetime, metrics: dict, status: str,
+                     error: str | None = None, client=None) -> None:
+    """Grava uma linha da execução em ``RUN_METRICS_TABLE_ID`` (falhas só vão para o log).
+
+    Os perfis das etapas (``PROFILE_MODE``) são gravados junto, com o mesmo ``execution_id``.
+    """
+    from google.cloud import bigquery
+
+    from utils.bq_load import load_to_bigquery
+    from utils.profiling import export_profiles
+
+    export_profiles(script_name, started_at.strftime("%Y%m%d_%H%M%S"))
+
+    row = {
+        "execution_id": started_at.strftime("%Y%m%d_%H%M%S"),
+        "execution_timestamp": started_at,
+        "script_name": script_name,
+        "status": status,
+        "error_summary": error,
+        **metrics,
+    }
+    schema = [
+        bigquery.SchemaField("execution_id", "STRING"),
+        bigquery.SchemaField("execution_timestamp", "DATETIME"),
+        bigquery.SchemaField("script_name", "STRING"),
+        bigquery.SchemaField("status", "STRING"),
+        bigquery.SchemaField("error_summary", "STRING"),
+    ] + resource_schema()
+    try:
+        load_to_bigquery([row], RUN_METRICS_TABLE_ID, schema=schema, client=client,
+                         schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION])
+        logger.info("✅ Métricas da execução salvas em %s", RUN_METRICS_TABLE_ID)
+    except Exception as e:
+        logger.error("Erro ao salvar métricas da execução: %s", str(e))
+
+
+# Medição em andamento (uma entrada chamando outra não mede duas vezes)
+_active = contextvars.ContextVar("run_metrics_active", default=False)
+
+
+def metered_run(script_name: str):
+    """Decorator de ponto de entrada: mede a execução e grava em ``RUN_METRICS_TABLE_ID``.
+
+    Funciona com funções comuns e ``async``; o erro da função é registrado
+    (``status="error"``) e levantado de novo.
+    """
+
+    def decorator(fn):
+        def begin():
+            if _active.get():
+                return None, None
+            return RunMeter(script_name).start(), _active.set(True)
+
+        def end(meter, token, error):
+            if meter is None:
+                return
+            _active.reset(token)
+            metrics = meter.finish()
+            save_run_metrics(script_name, meter.started_at, metrics, "error" if error else "success",
+                             f"{type(error).__name__}: {error}"[:1000] if error else None)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                meter, token = begin()
+                error = None
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    end(meter, token, error)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            meter, token = begin()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                end(meter, token, error)
+
+        return wrapper
+
+    return decorator
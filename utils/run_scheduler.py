@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Agendador único de requisições por execução
+────────────────────────────────────────────
+Antes cada script abria um ``ThreadPoolExecutor(len(GROUPS))`` para os
+grupos e, dentro de cada grupo, mais dois pools de ``MAX_WORKERS`` (insights
+e orçamentos): com 12 grupos eram centenas de threads disputando a mesma
+API, com o volume multiplicado pelo número de grupos.
+
+Aqui existe um único pool por processo:
+
+- ``max_concurrency`` limita as tarefas rodando ao mesmo tempo na execução
+  inteira (um único ajuste: ``MAX_WORKERS``)
+- cada token tem uma "faixa" com no máximo ``token_lane`` tarefas em
+  andamento, para nenhum token monopolizar o pool
+- as filas dos grupos são atendidas em rodízio (round robin), então um grupo
+  com 300 contas não atrasa os grupos pequenos
+
+Os grupos em si rodam em threads de orquestração (``run_groups``) que só
+submetem tarefas e esperam os resultados; todo o trabalho de rede passa
+pelo pool. O prefetch de páginas do ``GraphAPIClient.paginate`` também: ele
+usa ``try_submit``, que só aceita a tarefa se houver vaga livre agora (no
+total e na faixa do token) e nunca espera, então uma tarefa que pagina não
+fica presa aguardando uma vaga ocupada por ela mesma.
+
+Cada tarefa roda no contexto (``contextvars``) de quem a submeteu, então os
+spans abertos dentro dela (``utils.tracing``) ficam sob o span do grupo e,
+com ``PROFILE_MODE=cpu``, o perfil dela soma na etapa que a submeteu
+(``utils.profiling``).
+"""
+
+import os
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future, as_completed
+
+from utils.profiling import profile_task
+from utils.rate_limit import token_key
+from utils.tracing import bind_context, span
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# Tarefas em andamento na execução inteira (somando todos os grupos)
+RUN_MAX_CONCURRENCY = int(os.getenv("RUN_MAX_CONCURRENCY", "20"))
+# Tarefas em andamento por token
+RUN_TOKEN_LANE = int(os.getenv("RUN_TOKEN_LANE", "8"))
+
+# Grupo da thread de orquestração atual (usado quando ``submit`` não recebe ``group``)
+_current_group = contextvars.ContextVar("run_scheduler_group", default=None)
+
+
+class _Task:
+    __slots__ = ("future", "fn", "args", "lane")
+
+    def __init__(self, fn, args: tuple, lane):
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.lane = lane
+
+
+class RunScheduler:
+    """Pool global com faixas por token e fila justa entre grupos.
+
+    Uso::
+
+        scheduler = get_run_scheduler()
+        futures = {scheduler.submit(fetch, acc, token=token): acc for acc in accounts}
+        for future in as_completed(futures):
+            ...
+    """
+
+    def __init__(self, max_concurrency: int = RUN_MAX_CONCURRENCY, token_lane: int = RUN_TOKEN_LANE):
+        """
+        Args:
+            max_concurrency: Tarefas simultâneas no processo
+            token_lane: Tarefas simultâneas por token (limitado a ``max_concurrency``)
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.token_lane = max(1, min(token_lane, self.max_concurrency))
+
+        self._queues = OrderedDict()  # grupo -> deque[_Task]
+        self._reserved = deque()      # tarefas do try_submit, com vaga já contada
+        self._lanes = {}              # faixa -> tarefas em andamento
+        self._active = 0              # tarefas em andamento ou reservadas
+        self._cond = threading.Condition()
+        self._threads = []
+        self._idle = 0
+
+    # -- estado (chamado com o lock) -----------------------------------------
+    def _lane_free(self, lane) -> bool:
+        return lane is None or self._lanes.get(lane, 0) < self.token_lane
+
+    def _take(self):
+        """Próxima tarefa: as reservadas primeiro, depois rodízio entre os grupos respeitando as faixas."""
+        if self._reserved:
+            return self._reserved.popleft()
+        if self._active >= self.max_concurrency:
+            return None
+        for _ in range(len(self._queues)):
+            group, queue = next(iter(self._queues.items()))
+            # O grupo vai para o fim da fila, tenha ou não sido atendido
+            self._queues.move_to_end(group)
+            for task in queue:
+                if self._lane_free(task.lane):
+                    queue.remove(task)
+                    if not queue:
+                        del self._queues[group]
+                    self._claim(task.lane)
+                    return task
+        return None
+
+    def _claim(self, lane) -> None:
+        self._active += 1
+        if lane is not None:
+            self._lanes[lane] = self._lanes.get(lane, 0) + 1
+
+    def _spawn(self, needed: int = 1) -> None:
+        if self._idle < needed and len(self._threads) < self.max_concurrency:
+            thread = threading.Thread(target=self._worker, daemon=True,
+                                      name=f"run-worker-{len(self._threads) + 1}")
+            self._threads.append(thread)
+            thread.start()
+
+    # -- execução ------------------------------------------------------------
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                self._idle += 1
+                task = self._take()
+                while task is None:
+                    self._cond.wait()
+                    task = self._take()
+                self._idle -= 1
+
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.fn(*task.args))
+                    except BaseException as e:
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if task.lane is not None:
+                        self._lanes[task.lane] -= 1
+                    self._cond.notify_all()
+
+    def submit(self, fn, *args, token: str | None = None, group: str | None = None) -> Future:
+        """Enfileira ``fn(*args)``.
+
+        Args:
+            token: Token usado pela tarefa (define a faixa); None = sem faixa
+            group: Fila do rodízio; None = grupo da orquestração atual
+                (``run_groups``) ou, fora dela, a faixa do token
+
+        Returns:
+            ``concurrent.futures.Future`` (funciona com ``as_completed``)
+        """
+        lane = token_key(token) if token else None
+        group = group or _current_group.get() or lane or "default"
+        task = _Task(bind_context(profile_task(fn)), args, lane)
+        with self._cond:
+            self._queues.setdefault(group, deque()).append(task)
+            self._spawn()
+            self._cond.notify()
+        return task.future
+
+    def try_submit(self, fn, *args, token: str | None = None) -> Future | None:
+        """Roda ``fn(*args)`` já, se houver vaga livre no pool e na faixa do token.
+
+        Não enfileira nem espera: sem vaga devolve None e o chamador faz o
+        trabalho ele mesmo. Com vaga, a tarefa passa na frente das filas dos
+        grupos, então pode ser esperada de dentro de outra tarefa.
+
+        Returns:
+            ``Future`` ou None quando não há vaga
+        """
+        lane = token_key(token) if token else None
+        with self._cond:
+            if self._active >= self.max_concurrency or not self._lane_free(lane):
+                return None
+            task = _Task(bind_context(profile_task(fn)), args, lane)
+            self._claim(lane)
+            self._reserved.append(task)
+            self._spawn(len(self._reserved))
+            self._cond.notify()
+        return task.future
+
+    def map(self, fn, items, token: str | None = None, group: str | None = None):
+        """Submete ``fn(item)`` para cada item e devolve ``{future: item}``."""
+        return {self.submit(fn, item, token=token, group=group): item for item in items}
+
+
+def run_groups(groups: dict, process_group):
+    """Roda ``process_group(nome, config)`` de cada grupo em sua thread de orquestração.
+
+    As threads de grupo só coordenam: as requisições delas devem ir para o
+    ``RunScheduler`` compartilhado, que aplica o limite global.
+
+    Yields:
+        (nome do grupo, future) na ordem em que os grupos terminam
+    """
+    futures = {}
+    for group_name, group_config in groups.items():
+        future = Future()
+
+        def orchestrate(name=group_name, config=group_config, future=future):
+            _current_group.set(name)
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                # O span fecha antes do resultado: quem espera o future já o encontra gravado
+                with span("group", group=name):
+                    result = process_group(name, config)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=bind_context(orchestrate), daemon=True, name=f"group-{group_name}").start()
+        futures[future] = group_name
+
+    for future in as_completed(futures):
+        yield futures[future], future
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_run_scheduler(**kwargs) -> RunScheduler:
+    """Agendador compartilhado pelo processo (``kwargs`` valem só na primeira chamada)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RunScheduler(**kwargs)
+            logger.info("🧵 Agendador global: %s tarefas simultâneas, %s por token",
+                        _scheduler.max_concurrency, _scheduler.token_lane)
+        return _scheduler
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Schemas das tabelas do BigQuery em um só lugar
+───────────────────────────────────────────────
+Cada script repetia a mesma tabela quatro vezes: a lista ``expected_columns``
+com os valores padrão, os laços ``string_fields`` / ``datetime_fields`` /
+``float_fields`` / ``integer_fields``, a lista de ``bigquery.SchemaField`` e o
+DataFrame vazio usado para zerar a tabela. Bastava uma das cópias divergir
+para o load falhar por tipo incompatível.
+
+Aqui cada tabela é declarada uma vez (``TableSchema``) e gera:
+
+- ``coerce(df)``: colunas na ordem do schema, faltantes preenchidas e tipos
+  convertidos numa única passada (um DataFrame novo, sem cópias parciais)
+- ``bigquery_schema()``: lista de ``bigquery.SchemaField``
+- ``arrow_schema()``: ``pyarrow.Schema`` equivalente
+- ``empty_frame()``: DataFrame vazio já tipado
+
+``partition_field`` / ``clustering_fields`` dizem como a tabela é criada
+(partição diária e cluster, ver ``utils.bq_tables``).
+"""
+
+import pandas as pd
+
+# Tipos do BigQuery → tipo do pandas após ``coerce``
+STRING = "STRING"
+INTEGER = "INTEGER"
+FLOAT = "FLOAT"
+DATETIME = "DATETIME"
+TIMESTAMP = "TIMESTAMP"
+
+_PANDAS_DTYPES = {
+    STRING: "object",
+    INTEGER: "int64",
+    FLOAT: "float64",
+    DATETIME: "datetime64[ns]",
+    TIMESTAMP: "datetime64[ns]",
+}
+
+
+class Field:
+    """Coluna da tabela.
+
+    Args:
+        name: Nome da coluna
+        bq_type: ``STRING``, ``INTEGER``, ``FLOAT``, ``DATETIME`` ou ``TIMESTAMP``
+        nullable: Mantém valores ausentes (INTEGER vira ``Int64``; FLOAT fica
+            com NaN). Sem isso números ausentes viram 0
+    """
+
+    __slots__ = ("name", "bq_type", "nullable")
+
+    def __init__(self, name: str, bq_type: str, nullable: bool = False):
+        if bq_type not in _PANDAS_DTYPES:
+            raise ValueError(f"Tipo não suportado para {name}: {bq_type}")
+        self.name = name
+        self.bq_type = bq_type
+        self.nullable = nullable
+
+    def default(self):
+        """Valor de uma coluna ausente no DataFrame."""
+        if self.bq_type == STRING:
+            return ""
+        if self.bq_type in (INTEGER, FLOAT) and not self.nullable:
+            return 0
+        return None
+
+    def coerce(self, values: pd.Series) -> pd.Series:
+        if self.bq_type == STRING:
+            return values.astype(str)
+        if self.bq_type in (DATETIME, TIMESTAMP):
+            return pd.to_datetime(values, errors="coerce")
+        numbers = pd.to_numeric(values, errors="coerce")
+        if self.bq_type == FLOAT:
+            numbers = numbers.astype("float64")
+            return numbers if self.nullable else numbers.fillna(0.0)
+        if self.nullable:
+            return numbers.astype("Int64")
+        return numbers.fillna(0).astype("int64")
+
+    def arrow_type(self):
+        import pyarrow as pa
+
+        return {
+            STRING: pa.string(),
+            INTEGER: pa.int64(),
+            FLOAT: pa.float64(),
+            DATETIME: pa.timestamp("us"),
+            TIMESTAMP: pa.timestamp("us", tz="UTC"),
+        }[self.bq_type]
+
+
+class TableSchema:
+    """Colunas (em ordem) de uma tabela do BigQuery.
+
+    Args:
+        name: Nome lógico da tabela
+        fields: Lista de ``Field``
+        partition_field: Coluna de data da partição diária (None = sem partição)
+        clustering_fields: Colunas de cluster (até 4)
+    """
+
+    def __init__(self, name: str, fields: list, partition_field: str | None = None,
+                 clustering_fields: list | None = None):
+        self.name = name
+        self.fields = list(fields)
+        self.columns = [f.name for f in self.fields]
+        self.partition_field = partition_field
+        self.clustering_fields = list(clustering_fields or [])
+
+    def extend(self, name: str, fields: list) -> "TableSchema":
+        """Novo schema com as colunas deste mais ``fields`` no final (mesma partição e cluster)."""
+        return TableSchema(name, self.fields + list(fields), self.partition_field, self.clustering_fields)
+
+    def coerce(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Colunas na ordem do schema, faltantes com o padrão e tipos do BigQuery.
+
+        Colunas que não estão no schema são descartadas.
+        """
+        index = df.index
+        columns = {}
+        for field in self.fields:
+            if field.name in df.columns:
+                values = df[field.name]
+            else:
+                values = pd.Series(field.default(), index=index, dtype="object")
+            columns[field.name] = field.coerce(values)
+        return pd.DataFrame(columns, index=index)
+
+    def empty_frame(self) -> pd.DataFrame:
+        """DataFrame sem linhas com as colunas e tipos do schema."""
+        return pd.DataFrame({
+            f.name: pd.Series(dtype="Int64" if f.nullable and f.bq_type == INTEGER else _PANDAS_DTYPES[f.bq_type])
+            for f in self.fields
+        })
+
+    def bigquery_schema(self) -> list:
+        from google.cloud import bigquery
+
+        return [bigquery.SchemaField(f.name, f.bq_type) for f in self.fields]
+
+    def arrow_schema(self):
+        import pyarrow as pa
+
+        return pa.schema([pa.field(f.name, f.arrow_type()) for f in self.fields])
+
+
+# ------------------------------------------------------------------------------
+# TABELAS
+# ------------------------------------------------------------------------------
+# Campanhas (cloud_facebook_today / yesterday / historical)
+FACEBOOK_CAMPAIGNS = TableSchema("facebook_campaigns", [
+    Field("account_name", STRING),
+    Field("account_id", STRING),
+    Field("campaign_id", STRING),
+    Field("campaign_name", STRING),
+    Field("date_start", DATETIME),
+    Field("date_stop", DATETIME),
+    Field("conversions", FLOAT),
+    Field("spend", FLOAT),
+    Field("objective", STRING),
+    Field("cpc", FLOAT),
+    Field("ctr", FLOAT),
+    Field("frequency", FLOAT),
+    Field("impressions", INTEGER),
+    Field("reach", INTEGER),
+    Field("imported_at", DATETIME),
+    Field("daily_budget", FLOAT),
+    Field("lifetime_budget", FLOAT),
+    Field("amount_spent", FLOAT),
+    Field("campaign_end_time", TIMESTAMP),
+    Field("campaign_status", STRING),
+], partition_field="date_start", clustering_fields=["account_id", "campaign_id"])
+
+# Campanhas com breakdown por hora (cloud_facebook_utc_*): ``hour`` guarda o
+# intervalo em texto e ``hour_of_day`` a hora inteira
+FACEBOOK_CAMPAIGNS_UTC = FACEBOOK_CAMPAIGNS.extend("facebook_campaigns_utc", [
+    Field("hour", STRING),
+    Field("hour_of_day", INTEGER, nullable=True),
+])
+
+# Anúncios (cloud_facebook_adsperformance)
+FACEBOOK_ADS_PERFORMANCE = TableSchema("facebook_ads_performance", [
+    Field("date_start", DATETIME),
+    Field("ad_id", STRING),
+    Field("campaign_id", STRING),
+    Field("campaign_name", STRING),
+    Field("account_id", STRING),
+    Field("account_name", STRING),
+    Field("creative_id", STRING),
+    Field("impressions", INTEGER),
+    Field("clicks", INTEGER),
+    Field("spend", FLOAT),
+    Field("ctr", FLOAT),
+    Field("cpm", FLOAT),
+    Field("ad_name", STRING),
+    Field("date_stop", DATETIME),
+    Field("imported_at", DATETIME),
+], partition_field="date_start", clustering_fields=["account_id", "campaign_id", "ad_id"])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Estado local persistido entre execuções
+────────────────────────────────────────
+Os workflows rodam em runner self-hosted, então a home do runner sobrevive
+de uma execução para a outra. Pequenos arquivos de estado (tamanho de
+página por conta, caches) ficam em ``FUNCTIONS_STATE_DIR``.
+"""
+
+import os
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+FUNCTIONS_STATE_DIR = os.getenv(
+    "FUNCTIONS_STATE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cloudarbitration")
+)
+
+
+def state_path(name: str) -> str:
+    """Caminho de um arquivo de estado (cria a pasta se preciso)."""
+    os.makedirs(FUNCTIONS_STATE_DIR, exist_ok=True)
+    return os.path.join(FUNCTIONS_STATE_DIR, name)
+
+
+def load_json(name: str, default=None):
+    """Lê um arquivo de estado JSON; devolve ``default`` se não existir ou estiver corrompido."""
+    path = os.path.join(FUNCTIONS_STATE_DIR, name)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️ Estado %s ilegível (%s) – ignorando", path, e)
+        return default
+
+
+def save_json(name: str, data) -> None:
+    """Grava o estado de forma atômica (arquivo temporário + rename)."""
+    path = state_path(name)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=FUNCTIONS_STATE_DIR, prefix=f".{name}.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("⚠️ Não foi possível gravar o estado %s: %s", path, e)
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Spans de execução (estilo OpenTelemetry)
+─────────────────────────────────────────
+``upload_execution_metadata`` grava uma linha por execução: tempo total,
+contagem de grupos e um resumo de erros. Não dá para saber em que conta,
+página ou espera o tempo foi gasto.
+
+Aqui cada etapa abre um span com início, duração, status e atributos:
+
+- ``group`` / ``token`` / ``account.*``: orquestração (``run_groups``) e
+  tarefas dos scripts
+- ``graph.request``: cada requisição à Graph API, com as esperas filhas
+  ``graph.rate_limit_wait``, ``graph.request_delay`` e ``graph.backoff``
+- ``transform``: montagem do DataFrame final
+- ``bigquery.load`` / ``bigquery.write_stream`` / ``bigquery.merge``: cargas
+
+O span pai vem de um ``ContextVar``: o ``RunScheduler``, o ``run_groups`` e o
+prefetch de páginas levam o contexto de quem submeteu a tarefa para a thread
+que a executa, então a árvore grupo → conta → requisição → espera se mantém.
+
+``export_spans`` (chamado junto do ``upload_execution_metadata``) grava os
+spans da execução num JSONL local (``TRACE_DIR``) e na tabela
+``TRACE_TABLE_ID``, particionada por dia de ``start_time``.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from utils.state import FUNCTIONS_STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+# CONFIGURAÇÕES
+# ------------------------------------------------------------------------------
+# 0 desliga a coleta de spans
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+# Máximo de spans guardados por execução (o excedente é descartado e contado)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200000"))
+# Pasta dos arquivos JSONL
+TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(FUNCTIONS_STATE_DIR, "traces"))
+# Tabela de spans no BigQuery (vazio = só o JSONL)
+TRACE_TABLE_ID = os.getenv("TRACE_TABLE_ID", "data-v1-423414.test.cloud_facebook_spans")
+
+# Span aberto no contexto atual (pai dos próximos)
+_current_span = contextvars.ContextVar("tracing_current_span", default=None)
+# False durante o export, para a carga dos spans não gerar spans
+_recording = contextvars.ContextVar("tracing_recording", default=True)
+
+
+class Span:
+    """Um intervalo de tempo nomeado; ``set_attribute`` acrescenta dados ao span."""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes", "status", "error",
+                 "thread", "start_time", "_start", "duration_ms")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = attributes
+        self.status = "ok"
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error) -> None:
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"[:500] if isinstance(error, BaseException) else str(error)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time": datetime.fromtimestamp(self.start_time, timezone.utc).isoformat(),
+            "end_time": datetime.fromtimestamp(self.start_time + (self.duration_ms or 0) / 1000,
+                                               timezone.utc).isoformat(),
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Devolvido quando a coleta está desligada."""
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_error(self, error) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+# ------------------------------------------------------------------------------
+# COLETA
+# ------------------------------------------------------------------------------
+_spans = []
+_dropped = 0
+_trace_id = uuid.uuid4().hex
+_spans_lock = threading.Lock()
+
+
+def _finish(current: Span) -> None:
+    global _dropped
+    current.duration_ms = (time.perf_counter() - current._start) * 1000
+    with _spans_lock:
+        if len(_spans) < TRACE_MAX_SPANS:
+            _spans.append(current)
+        else:
+            _dropped += 1
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Abre um span filho do span atual.
+
+    Uso::
+
+        with span("account.insights", account_id=acc) as s:
+            rows = fetch(acc)
+            s.set_attribute("rows", len(rows))
+
+    Uma exceção que atravessa o bloco marca o span com ``status="error"``.
+    """
+    if not TRACE_ENABLED or not _recording.get():
+        yield _NOOP
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.trace_id if parent else _trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(current)
+
+
+def current_span():
+    """Span aberto no contexto atual (ou um span vazio, se não houver)."""
+    return _current_span.get() or _NOOP
+
+
+def traced(name: str, *arg_names: str):
+    """Decorator que roda a função dentro de ``span(name)``.
+
+    Args:
+        name: Nome do span
+        arg_names: Nomes dos atributos tirados dos argumentos posicionais, na
+            ordem (ex: ``traced("account.insights", "account_id")``)
+
+    O tamanho do resultado (lista, DataFrame...), quando existe, vai no
+    atributo ``items``.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **dict(zip(arg_names, args))) as current:
+                result = fn(*args, **kwargs)
+                if hasattr(result, "__len__") and not isinstance(result, (dict, str)):
+                    current.set_attribute("items", len(result))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def bind_context(fn):
+    """``fn`` presa ao contexto atual, para rodar em outra thread com o mesmo span pai."""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+# ------------------------------------------------------------------------------
+# EXPORTAÇÃO
+# ------------------------------------------------------------------------------
+def drain_spans() -> tuple:
+    """Tira os spans coletados e começa um novo trace.
+
+    Returns:
+        (trace_id, lista de ``Span``, spans descartados pelo limite)
+    """
+    global _spans, _dropped, _trace_id
+    with _spans_lock:
+        trace_id, spans, dropped = _trace_id, _spans, _dropped
+        _spans, _dropped, _trace_id = [], 0, uuid.uuid4().hex
+    return trace_id, spans, dropped
+
+
+def summarize(spans: list) -> dict:
+    """Soma por nome de span: ``{nome: {"count", "total_ms", "max_ms", "errors"}}``."""
+    summary = {}
+    for s in spans:
+        entry = summary.setdefault(s.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0})
+        entry["count"] += 1
+        entry["total_ms"] += s.duration_ms or 0
+        entry["max_ms"] = max(entry["max_ms"], s.duration_ms or 0)
+        entry["errors"] += s.status == "error"
+    return summary
+
+
+def _spans_schema():
+    from google.cloud import bigquery
+
+    return [
+        bigquery.SchemaField("execution_id", "STRING"),
+        bigquery.SchemaField("script_name", "STRING"),
+        bigquery.SchemaField("trace_id", "STRING"),
+        bigquery.SchemaField("span_id", "STRING"),
+        bigquery.SchemaField("parent_span_id", "STRING"),
+        bigquery.SchemaField("name", "STRING"),
+        bigquery.SchemaField("start_time", "TIMESTAMP"),
+        bigquery.SchemaField("end_time", "TIMESTAMP"),
+        bigquery.SchemaField("duration_ms", "FLOAT"),
+        bigquery.SchemaField("status", "STRING"),
+        bigquery.SchemaField("error", "STRING"),
+        bigquery.SchemaField("thread", "STRING"),
+        bigquery.SchemaField("attributes", "STRING"),
+    ]
+
+
+def export_spans(script_name: str, execution_id: str | None = None, client=None, upload: bool = True) -> str | None:
+    """Grava os spans da execução em ``TRACE_DIR`` e em ``TRACE_TABLE_ID``.
+
+    Falhas na exportação só vão para o log: o trace nunca derruba a execução.
+
+    Args:
+        script_name: Mesmo nome usado em ``cloud_facebook_executions``
+        execution_id: Id da linha em ``cloud_facebook_executions``
+        client: ``bigquery.Client``; None = ``get_bq_client()``
+        upload: False = só o arquivo local
+
+    Returns:
+        Caminho do JSONL (None se não houve spans)
+    """
+    trace_id, spans, dropped = drain_spans()
+    if not spans:
+        return None
+    execution_id = execution_id or datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    rows = []
+    for s in spans:
+        row = s.to_dict()
+        row["execution_id"] = execution_id
+        row["script_name"] = script_name
+        rows.append(row)
+
+    top = sorted(summarize(spans).items(), key=lambda item: item[1]["total_ms"], reverse=True)[:8]
+    logger.info("🔭 Trace %s: %s spans%s", trace_id, len(spans), f" ({dropped} descartados)" if dropped else "")
+    for name, entry in top:
+        logger.info("   • %s: %s spans, %.1fs no total, máx %.2fs, %s erros",
+                    name, entry["count"], entry["total_ms"] / 1000, entry["max_ms"] / 1000, entry["errors"])
+
+    path = None
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"{script_name}_{execution_id}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        logger.info("🔭 Spans gravados em %s", path)
+    except OSError as e:
+        logger.warning("⚠️ Não foi possível gravar os spans em %s: %s", TRACE_DIR, e)
+
+    if upload and TRACE_TABLE_ID:
+        from utils.bq_load import load_to_bigquery
+        from utils.bq_tables import ensure_table
+
+        token = _recording.set(False)
+        try:
+            for row in rows:
+                row["attributes"] = json.dumps(row["attributes"], ensure_ascii=False, default=str)
+            schema = _spans_schema()
+            ensure_table(TRACE_TABLE_ID, schema, "start_time", ["script_name", "name"], client=client)
+            load_to_bigquery(rows, TRACE_TABLE_ID, schema=schema, client=client)
+            logger.info("✅ %s spans salvos em %s", len(rows), TRACE_TABLE_ID)
+        except Exception as e:
+            logger.error("Erro ao salvar spans em %s: %s", TRACE_TABLE_ID, str(e))
+        finally:
+            _recording.reset(token)
+    return path
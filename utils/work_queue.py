@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Fila de contas compartilhada entre tokens (work stealing)
+──────────────────────────────────────────────────────────
+Grupos com vários tokens dividiam as contas em fatias fixas e processavam
+cada fatia em sequência. Aqui todas as contas vão para uma fila única e
+cada token puxa a próxima conta quando tem folga de rate limit
+(``RateLimitGovernor.available``):
+
+- token bloqueado por rate limit   → não puxa contas até liberar; a conta
+  que estava com ele volta para a fila e outro token assume
+- token inválido (401/190)          → sai da fila; as contas dele ficam
+  com os outros tokens
+- sem permissão na conta (403/404)  → a conta volta para a fila excluindo
+  esse token
+
+A fila não tem threads próprias: a thread que chama ``run`` distribui as
+contas e cada conta roda no executor recebido (``submit``, ex: o
+``RunScheduler`` da execução, com a faixa do token). Sem executor, um pool
+local de ``workers_per_token`` threads por token faz o papel.
+"""
+
+import time
+import logging
+import threading
+from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.graph_api import ERROR_AUTH, ERROR_NOT_FOUND, ERROR_PERMISSION, ERROR_RATE_LIMIT, GraphAPIError
+from utils.rate_limit import RateLimitGovernor, get_governor, token_key
+
+logger = logging.getLogger(__name__)
+
+# Intervalo para reavaliar tokens bloqueados quando não há conta elegível (segundos)
+WORK_QUEUE_POLL_SECONDS = 0.5
+
+# Erros que o worker deve receber na hora (sem retry no cliente) para repassar a conta
+HANDOFF_ERRORS = (ERROR_AUTH, ERROR_PERMISSION, ERROR_NOT_FOUND, ERROR_RATE_LIMIT)
+
+
+class _Item:
+    __slots__ = ("account", "excluded", "attempts")
+
+    def __init__(self, account: str):
+        self.account = account
+        self.excluded = set()
+        self.attempts = 0
+
+
+class TokenWorkQueue:
+    """Distribui contas entre tokens conforme a folga de cada um.
+
+    Uso::
+
+        queue = TokenWorkQueue(accounts, tokens, workers_per_token=5, submit=scheduler.submit)
+        results, failures = queue.run(lambda acc, token: fetch(acc, token))
+    """
+
+    def __init__(self, accounts: list, tokens: list, workers_per_token: int = 5,
+                 governor: RateLimitGovernor | None = None, max_attempts: int | None = None,
+                 name: str = "", submit=None):
+        """
+        Args:
+            accounts: Contas a processar (duplicadas são ignoradas)
+            tokens: Tokens disponíveis para o grupo
+            workers_per_token: Contas processadas em paralelo por token
+            governor: Governador de rate limit (None = instância compartilhada)
+            max_attempts: Tentativas por conta somando todos os tokens
+                (None = 3 por token)
+            name: Nome do grupo para logs
+            submit: ``submit(fn, *args, token=token) -> Future`` que roda cada conta
+                (ex: ``RunScheduler.submit``); None = pool de threads próprio
+        """
+        self.tokens = list(dict.fromkeys(tokens))
+        self.workers_per_token = max(1, workers_per_token)
+        self.governor = governor or get_governor()
+        self.max_attempts = max_attempts or 3 * len(self.tokens)
+        self.name = name
+        self.submit = submit
+
+        self._pending = deque(_Item(acc) for acc in dict.fromkeys(accounts))
+        self._dead_tokens = set()
+        self._in_flight = 0
+        self._busy = dict.fromkeys(self.tokens, 0)  # token -> contas em andamento
+        self._cond = threading.Condition()
+        self.results = {}
+        self.failures = {}
+
+    # -- estado (chamado com o lock) -----------------------------------------
+    def _label(self, token: str) -> str:
+        return f"{self.name}/{token_key(token)}" if self.name else token_key(token)
+
+    def _live_tokens(self) -> set:
+        return set(self.tokens) - self._dead_tokens
+
+    def _fail(self, item: _Item, error) -> None:
+        self.failures[item.account] = error
+        logger.error("❌ [%s] Conta %s sem token disponível após %s tentativas: %s",
+                     self.name, item.account, item.attempts, error)
+
+    def _requeue(self, item: _Item, error) -> None:
+        if item.attempts >= self.max_attempts or not (self._live_tokens() - item.excluded):
+            self._fail(item, error)
+        else:
+            self._pending.append(item)
+
+    def _drop_orphans(self) -> None:
+        """Falha as contas que nenhum token vivo pode mais processar."""
+        live = self._live_tokens()
+        for item in list(self._pending):
+            if not (live - item.excluded):
+                self._pending.remove(item)
+                self._fail(item, "nenhum token com acesso")
+
+    def _take(self, token: str):
+        for item in self._pending:
+            if token not in item.excluded and self.governor.available(token, item.account):
+                self._pending.remove(item)
+                self._in_flight += 1
+                item.attempts += 1
+                return item
+        return None
+
+    # -- execução ------------------------------------------------------------
+    def _dispatch(self, submit, work) -> None:
+        """Entrega contas aos tokens com folga (chamado com o lock)."""
+        for token in self.tokens:
+            while token not in self._dead_tokens and self._busy[token] < self.workers_per_token:
+                item = self._take(token)
+                if item is None:
+                    break
+                self._busy[token] += 1
+                future = submit(work, item.account, token, token=token)
+                future.add_done_callback(partial(self._done, token, item))
+
+    def _done(self, token: str, item: _Item, future) -> None:
+        label = self._label(token)
+        error = future.exception()
+        with self._cond:
+            self._in_flight -= 1
+            self._busy[token] -= 1
+            if error is None:
+                self.results[item.account] = (token, future.result())
+            elif isinstance(error, GraphAPIError):
+                if error.kind == ERROR_AUTH:
+                    logger.error("🔑 [%s] Token inválido – repassando contas aos outros tokens", label)
+                    self._dead_tokens.add(token)
+                    self._drop_orphans()
+                elif error.kind == ERROR_RATE_LIMIT:
+                    logger.warning("🔁 [%s] Rate limit na conta %s – devolvendo à fila", label, item.account)
+                else:
+                    logger.warning("🔁 [%s] Conta %s indisponível (%s) – tentando com outro token",
+                                   label, item.account, error.kind)
+                    item.excluded.add(token)
+                self._requeue(item, error)
+            else:
+                logger.warning("🔁 [%s] Erro na conta %s: %s – tentando com outro token",
+                               label, item.account, error)
+                item.excluded.add(token)
+                self._requeue(item, error)
+            self._cond.notify_all()
+
+    def run(self, work) -> tuple:
+        """Processa a fila até esvaziar.
+
+        Args:
+            work: Função ``work(account, token) -> resultado``; deve levantar
+                ``GraphAPIError`` (ver ``HANDOFF_ERRORS``) para repassar a conta
+
+        Returns:
+            (results, failures): ``{conta: (token, resultado)}`` e ``{conta: erro}``
+        """
+        started = time.time()
+        submit, pool = self.submit, None
+        if submit is None:
+            pool = ThreadPoolExecutor(max_workers=len(self.tokens) * self.workers_per_token,
+                                      thread_name_prefix=f"token-queue-{self.name or 'default'}")
+
+            def submit(fn, *args, token=None):
+                return pool.submit(fn, *args)
+        try:
+            with self._cond:
+                while self._pending or self._in_flight:
+                    self._dispatch(submit, work)
+                    # Acorda quando uma conta termina ou para reavaliar tokens bloqueados
+                    self._cond.wait(WORK_QUEUE_POLL_SECONDS)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        per_token = {}
+        for token, _ in self.results.values():
+            per_token[token] = per_token.get(token, 0) + 1
+        logger.info("📦 [%s] Fila concluída em %.2fs: %s contas ok, %s falhas – %s",
+                    self.name, time.time() - started, len(self.results), len(self.failures),
+                    ", ".join(f"{token_key(t)}={n}" for t, n in per_token.items()) or "nenhum token")
+        return self.results, self.failures